@@ -2,10 +2,35 @@
 Модуль с вопросами для AI-агента и логикой взаимодействия с Claude API
 """
 
-from typing import List, Dict
-from anthropic import Anthropic
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager, nullcontext
+from typing import List, Dict, Optional, Callable, Awaitable, AsyncIterator
+from anthropic import Anthropic, AsyncAnthropic
 import os
 
+from hedging import HedgePolicy, hedged_stream
+from resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    is_retryable,
+    is_model_unavailable,
+    retry_after,
+    backoff_delay,
+)
+from metrics import observe_llm_call
+from single_flight import SingleFlight, answers_hash
+from tracing import tracer, traced
+
+logger = logging.getLogger(__name__)
+
+# Колбэк, который получает позицию в очереди, когда все слоты генерации заняты
+QueueCallback = Callable[[int], Awaitable[None]]
+
+# Колбэк, который получает запись о каждом вызове Claude (для журнала llm_calls)
+CallCallback = Callable[..., None]
+
 # Список вопросов для квалификации клиента
 QUESTIONS = [
     {
@@ -45,18 +70,154 @@ QUESTIONS = [
     }
 ]
 
+# Цепочка моделей по умолчанию: при сбоях запрос уходит к следующей.
+# Полный список известных моделей — ALL_MODELS в check_models.py
+DEFAULT_MODELS = [
+    "claude-3-haiku-20240307",  # Claude 3 Haiku - быстрая и дешевая модель
+]
+
+# Цены в долларах за миллион токенов — для оценки стоимости лида по журналу вызовов
+MODEL_PRICING = {
+    "claude-3-5-sonnet-20241022": {"input": 3.0, "output": 15.0, "cache_write": 3.75, "cache_read": 0.30},
+    "claude-3-5-sonnet-20240620": {"input": 3.0, "output": 15.0, "cache_write": 3.75, "cache_read": 0.30},
+    "claude-3-sonnet-20240229": {"input": 3.0, "output": 15.0, "cache_write": 3.75, "cache_read": 0.30},
+    "claude-3-opus-20240229": {"input": 15.0, "output": 75.0, "cache_write": 18.75, "cache_read": 1.50},
+    "claude-3-haiku-20240307": {"input": 0.25, "output": 1.25, "cache_write": 0.30, "cache_read": 0.03},
+}
+
+# Версия промпта: меняется при любой правке SYSTEM_PROMPT или build_prompt,
+# чтобы кэш ответов не отдавал результаты старого промпта
+PROMPT_VERSION = "2"
+
+# Статичная часть промпта: роль эксперта и требования к формату ответа.
+# Не зависит от пользователя, поэтому помечается для кэширования промпта
+SYSTEM_PROMPT = """Ты — эксперт по внедрению AI-решений и автоматизации для B2B-бизнеса.
+
+На основе ответов клиента проанализируй его ситуацию и предложи 2-3 конкретных сценария внедрения AI и автоматизации.
+
+Для каждого сценария укажи:
+1. **Название сценария** (короткое, ёмкое)
+2. **Что автоматизируем** (конкретные процессы)
+3. **Ожидаемый эффект** (экономия времени, рост конверсии, снижение нагрузки и т.д.)
+4. **Какие данные/системы нужны** для реализации
+5. **Срок внедрения** (ориентировочно)
+
+Сценарии должны быть:
+- Практичными и реализуемыми
+- Ранжированы по приоритету (от самого важного к менее приоритетному)
+- Адаптированы под размер бизнеса и бюджет клиента
+- Написаны простым языком, без технического жаргона
+
+Формат ответа: структурированный текст с эмодзи для визуальной привлекательности."""
+
 
 class AIAgent:
     """Класс для взаимодействия с Claude API"""
 
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, max_concurrent_generations: int = 10,
+                 cache=None, models: List[str] = None, max_retries: int = 2,
+                 request_timeout: float = 60.0, breaker_threshold: int = 5,
+                 breaker_reset_timeout: float = 30.0, max_retry_delay: float = 8.0,
+                 hedge_policy: Optional[HedgePolicy] = None,
+                 on_llm_call: Optional[CallCallback] = None):
         self.api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
         if not self.api_key:
             raise ValueError("ANTHROPIC_API_KEY не найден!")
 
         self.client = Anthropic(api_key=self.api_key)
-        self.model = "claude-3-haiku-20240307"  # Claude 3 Haiku - быстрая и дешевая модель
+        # Повторы делаем сами (с переходом на другие модели), поэтому встроенные отключены
+        self.async_client = AsyncAnthropic(
+            api_key=self.api_key,
+            max_retries=0,
+            timeout=request_timeout,
+        )
+
+        # Упорядоченная цепочка моделей; первая — основная
+        self.models = list(models or DEFAULT_MODELS)
+        self.model = self.models[0]
+        self.last_model: Optional[str] = None
+
+        # Повторы с экспоненциальной задержкой и размыкатель на каждую модель
+        self.max_retries = max_retries
+        self.max_retry_delay = max_retry_delay
+        self.breakers: Dict[str, CircuitBreaker] = {
+            model: CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+            for model in self.models
+        }
+
+        # Хеджирование медленных запросов (None — выключено)
+        self.hedge_policy = hedge_policy
 
+        # Журнал вызовов: on_llm_call(conversation_id=..., model=..., outcome=..., ...)
+        self.on_llm_call = on_llm_call
+
+        # Глобальное ограничение одновременных запросов к Claude
+        self.max_concurrent_generations = max_concurrent_generations
+        self._slots = asyncio.Semaphore(max_concurrent_generations)
+        self.in_flight = 0
+        self.waiting = 0
+
+        # Кэш готовых ответов (ScenarioCache), необязателен
+        self.cache = cache
+
+        # Генерации, идущие сейчас, по (диалог, хэш ответов): повторный вызов ждёт ту же
+        self.flights = SingleFlight()
+
+        # Расход токенов последнего запроса и суммарно за время работы
+        self.last_usage: Dict[str, float] = {}
+        self.usage_totals: Dict[str, float] = {}
+
+    def build_prompt(self, answers: List[Dict]) -> str:
+        """Собрать переменную часть промпта (ответы клиента) для Claude"""
+        # Формируем контекст из ответов
+        context = "Ответы клиента:\n\n"
+        for answer in answers:
+            context += f"Вопрос {answer['question_number']}: {answer['question_text']}\n"
+            context += f"Ответ: {answer['answer']}\n\n"
+
+        return context + "Предложи 2-3 сценария внедрения для этого клиента."
+
+    def _request_params(self, answers: List[Dict], model: str = None) -> Dict:
+        """Параметры запроса к Claude API"""
+        return {
+            "model": model or self.model,
+            "max_tokens": 2500,
+            # Статичная часть промпта одинакова для всех, поэтому кэшируется на стороне API
+            "system": [
+                {
+                    "type": "text",
+                    "text": SYSTEM_PROMPT,
+                    "cache_control": {"type": "ephemeral"}
+                }
+            ],
+            "messages": [
+                {
+                    "role": "user",
+                    "content": self.build_prompt(answers)
+                }
+            ]
+        }
+
+    def _record_usage(self, usage, elapsed: float):
+        """Запомнить расход токенов, включая чтение и запись кэша промпта"""
+        self.last_usage = {
+            'input_tokens': usage.input_tokens,
+            'output_tokens': usage.output_tokens,
+            'cache_read_input_tokens': getattr(usage, 'cache_read_input_tokens', None) or 0,
+            'cache_creation_input_tokens': getattr(usage, 'cache_creation_input_tokens', None) or 0,
+            'latency_ms': elapsed * 1000,
+        }
+        for key, value in self.last_usage.items():
+            self.usage_totals[key] = self.usage_totals.get(key, 0) + value
+
+        logger.info(
+            f"Claude: {self.last_usage['input_tokens']} входных токенов, "
+            f"{self.last_usage['cache_read_input_tokens']} из кэша, "
+            f"{self.last_usage['cache_creation_input_tokens']} записано в кэш, "
+            f"{self.last_usage['output_tokens']} выходных, {elapsed:.1f} с"
+        )
+
+    @traced('ai.generate_scenarios')
     def generate_scenarios(self, answers: List[Dict]) -> str:
         """
         Генерация 2-3 сценариев внедрения на основе ответов пользователя
@@ -67,50 +228,278 @@ class AIAgent:
         Returns:
             Отформатированный текст со сценариями
         """
+        # Запрос к Claude API
+        started = time.perf_counter()
+        message = self.client.messages.create(**self._request_params(answers))
+        self._record_usage(message.usage, time.perf_counter() - started)
 
-        # Формируем контекст из ответов
-        context = "Ответы клиента:\n\n"
-        for answer in answers:
-            context += f"Вопрос {answer['question_number']}: {answer['question_text']}\n"
-            context += f"Ответ: {answer['answer']}\n\n"
+        # Извлекаем текст ответа
+        return message.content[0].text
 
-        # Промпт для Claude
-        prompt = f"""Ты — эксперт по внедрению AI-решений и автоматизации для B2B-бизнеса.
+    async def _cache_get(self, answers: List[Dict]) -> Optional[str]:
+        """Найти в кэше готовый ответ основной модели"""
+        if not self.cache:
+            return None
 
-На основе ответов клиента проанализируй его ситуацию и предложи 2-3 конкретных сценария внедрения AI и автоматизации.
+        cache_key = self.cache.make_key(answers, self.model, PROMPT_VERSION)
+        try:
+            cached = await self.cache.get(cache_key)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша сценариев: {e}")
+            return None
 
-{context}
+        if cached is not None:
+            logger.info("Сценарии взяты из кэша, запрос к Claude не нужен")
+        return cached
 
-Для каждого сценария укажи:
-1. **Название сценария** (короткое, ёмкое)
-2. **Что автоматизируем** (конкретные процессы)
-3. **Ожидаемый эффект** (экономия времени, рост конверсии, снижение нагрузки и т.д.)
-4. **Какие данные/системы нужны** для реализации
-5. **Срок внедрения** (ориентировочно)
+    async def _cache_put(self, answers: List[Dict], model: Optional[str], text: str):
+        """
+        Сохранить ответ основной модели в кэш. Ответы резервных моделей не кэшируем:
+        искать их _cache_get не будет, а место в кэше они бы занимали
+        """
+        if not self.cache or model != self.model:
+            return
 
-Сценарии должны быть:
-- Практичными и реализуемыми
-- Ранжированы по приоритету (от самого важного к менее приоритетному)
-- Адаптированы под размер бизнеса и бюджет клиента
-- Написаны простым языком, без технического жаргона
+        try:
+            cache_key = self.cache.make_key(answers, model, PROMPT_VERSION)
+            await self.cache.put(cache_key, model, PROMPT_VERSION, text)
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш сценариев: {e}")
 
-Формат ответа: структурированный текст с эмодзи для визуальной привлекательности."""
+    @asynccontextmanager
+    async def _generation_slot(self, on_queued: Optional[QueueCallback] = None) -> AsyncIterator[None]:
+        """Занять слот генерации; если все заняты — сообщить позицию в очереди"""
+        if self._slots.locked():
+            self.waiting += 1
+            position = self.waiting
+            try:
+                with tracer.span('ai.wait_slot', position=position):
+                    if on_queued:
+                        try:
+                            await on_queued(position)
+                        except Exception as e:
+                            logger.warning(f"Не удалось сообщить позицию в очереди: {e}")
+                    await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
 
-        # Запрос к Claude API
-        message = self.client.messages.create(
-            model=self.model,
-            max_tokens=2500,
-            temperature=0.7,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def _log_call(self, conversation_id: Optional[int], model: str, outcome: str, usage=None,
+                  ttft: Optional[float] = None, elapsed: Optional[float] = None,
+                  error: Optional[str] = None):
+        """Передать запись о вызове Claude в метрики и журнал"""
+        record = dict(
+            conversation_id=conversation_id,
+            model=model,
+            outcome=outcome,
+            input_tokens=usage.input_tokens if usage else 0,
+            output_tokens=usage.output_tokens if usage else 0,
+            cache_read_tokens=(getattr(usage, 'cache_read_input_tokens', None) or 0) if usage else 0,
+            cache_write_tokens=(getattr(usage, 'cache_creation_input_tokens', None) or 0) if usage else 0,
+            ttft_ms=ttft * 1000 if ttft is not None else None,
+            latency_ms=elapsed * 1000 if elapsed is not None else None,
+            error=error,
         )
+        observe_llm_call(**record)
 
-        # Извлекаем текст ответа
-        return message.content[0].text
+        if not self.on_llm_call:
+            return
+
+        try:
+            self.on_llm_call(**record)
+        except Exception as e:
+            logger.warning(f"Не удалось записать вызов Claude в журнал: {e}")
+
+    async def _stream_once(self, model: str, answers: List[Dict],
+                           conversation_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Один потоковый запрос к конкретной модели"""
+        started = time.perf_counter()
+        ttft = None
+        usage = None
+        outcome = 'error'
+        error = None
+        with tracer.span('llm.stream', model=model, conversation_id=conversation_id) as span:
+            try:
+                async with self.async_client.messages.stream(**self._request_params(answers, model)) as stream:
+                    async for text in stream.text_stream:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                        yield text
+
+                    message = await stream.get_final_message()
+                usage = message.usage
+                outcome = 'ok'
+                self._record_usage(usage, time.perf_counter() - started)
+            except (asyncio.CancelledError, GeneratorExit):
+                # Отмена: проигравший хедж или прерванная задача
+                outcome = 'cancelled'
+                raise
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                if span:
+                    span.set(outcome=outcome,
+                             ttft_ms=round(ttft * 1000, 1) if ttft is not None else None,
+                             input_tokens=usage.input_tokens if usage else 0,
+                             output_tokens=usage.output_tokens if usage else 0)
+                self._log_call(conversation_id, model, outcome, usage, ttft,
+                               time.perf_counter() - started, error)
+
+    def _stream_attempt(self, model: str, answers: List[Dict],
+                        conversation_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Запрос к модели, с хеджированием медленного первого токена, если оно включено"""
+        if self.hedge_policy is None:
+            return self._stream_once(model, answers, conversation_id)
+
+        return hedged_stream(lambda: self._stream_once(model, answers, conversation_id),
+                             self.hedge_policy)
+
+    async def _stream_with_fallback(self, answers: List[Dict],
+                                    conversation_id: Optional[int] = None,
+                                    answered_by: Optional[List[str]] = None) -> AsyncIterator[str]:
+        """
+        Потоковый запрос с повторами и переходом по цепочке моделей.
+        Повторить можно только до первого полученного фрагмента текста.
+        Модель, давшая ответ, добавляется в answered_by (last_model общий для всех вызовов)
+        """
+        last_error: Optional[Exception] = None
+
+        for model in self.models:
+            breaker = self.breakers[model]
+            if not breaker.allow():
+                logger.info(f"Модель {model} временно отключена, пробуем следующую")
+                continue
+
+            try:
+                for attempt in range(self.max_retries + 1):
+                    emitted = False
+                    try:
+                        async for text in self._stream_attempt(model, answers, conversation_id):
+                            emitted = True
+                            yield text
+                    except Exception as e:
+                        if emitted:
+                            # Обрыв посреди ответа: повтор продублировал бы уже отправленный текст
+                            breaker.record_failure()
+                            raise
+                        if not (is_retryable(e) or is_model_unavailable(e)):
+                            # Ошибка запроса, а не деградация модели
+                            raise
+
+                        breaker.record_failure()
+
+                        last_error = e
+                        logger.warning(f"Ошибка модели {model} (попытка {attempt + 1}): {e}")
+                        if is_model_unavailable(e) or not breaker.allow():
+                            break
+
+                        delay = retry_after(e)
+                        if delay is None:
+                            delay = backoff_delay(attempt, cap=self.max_retry_delay)
+                        elif delay > self.max_retry_delay:
+                            # Ждать долго нет смысла — лучше сразу перейти к другой модели
+                            break
+                        if attempt < self.max_retries:
+                            await asyncio.sleep(delay)
+                        continue
+
+                    breaker.record_success()
+                    self.last_model = model
+                    if answered_by is not None:
+                        answered_by.append(model)
+                    return
+            finally:
+                # Отмена, закрытый поток или ошибка запроса не дают ответа о состоянии модели:
+                # освобождаем пробный запрос, иначе модель останется отключённой навсегда
+                breaker.release()
+
+        if last_error:
+            raise last_error
+        raise CircuitOpenError("Все модели Claude временно недоступны")
+
+    @traced('ai.generate_scenarios_async')
+    async def generate_scenarios_async(self, answers: List[Dict],
+                                       on_queued: Optional[QueueCallback] = None,
+                                       conversation_id: Optional[int] = None) -> str:
+        """
+        Асинхронная генерация сценариев, не блокирующая event loop
+
+        Args:
+            answers: Список ответов пользователя с вопросами
+            on_queued: Колбэк с позицией в очереди, если лимит запросов исчерпан
+            conversation_id: Диалог, к которому относится вызов (для журнала)
+
+        Returns:
+            Отформатированный текст со сценариями
+        """
+        chunks = [text async for text in self.stream_scenarios(
+            answers, on_queued=on_queued, conversation_id=conversation_id
+        )]
+        return ''.join(chunks)
+
+    async def stream_scenarios(self, answers: List[Dict],
+                               on_queued: Optional[QueueCallback] = None,
+                               conversation_id: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Потоковая генерация сценариев: отдает фрагменты текста по мере их появления.
+        Повторный вызов для того же диалога с теми же ответами, пока идёт первый,
+        не обращается к Claude, а получает готовый текст первого целиком
+
+        Args:
+            answers: Список ответов пользователя с вопросами
+            on_queued: Колбэк с позицией в очереди, если лимит запросов исчерпан
+            conversation_id: Диалог, к которому относится вызов (для журнала)
+
+        Yields:
+            Очередной фрагмент текста ответа
+        """
+        with tracer.span('ai.stream_scenarios', conversation_id=conversation_id) as span:
+            flight_key = None
+            if conversation_id is not None:
+                flight_key = (conversation_id, answers_hash(answers))
+                joined, shared = await self.flights.join(flight_key)
+                if span:
+                    span.set(single_flight=joined)
+                if joined:
+                    logger.info(f"Генерация для диалога {conversation_id} уже идёт, ждём её результат")
+                    self._log_call(conversation_id, self.model, 'shared')
+                    yield shared
+                    return
+
+            with self.flights.lead(flight_key) if flight_key else nullcontext() as flight:
+                cached = await self._cache_get(answers)
+                if span:
+                    span.set(cache_hit=cached is not None)
+                if cached is not None:
+                    self._log_call(conversation_id, self.model, 'cache_hit')
+                    if flight:
+                        flight.set_result(cached)
+                    yield cached
+                    return
+
+                chunks = []
+                answered_by: List[str] = []
+                async with self._generation_slot(on_queued):
+                    async for text in self._stream_with_fallback(answers, conversation_id, answered_by):
+                        chunks.append(text)
+                        yield text
+
+                result = ''.join(chunks)
+                if flight:
+                    flight.set_result(result)
+
+            # Ответ резервной модели не должен отдаваться из кэша вместо ответа основной
+            # и не должен вытеснять из него полезные записи
+            await self._cache_put(answers, answered_by[0] if answered_by else None, result)
 
     def get_question_by_number(self, number: int) -> Dict:
         """Получить вопрос по номеру"""
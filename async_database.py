@@ -0,0 +1,218 @@
+"""
+Асинхронная обёртка над Database: все обращения к SQLite выполняются
+в отдельном пуле потоков, чтобы не блокировать event loop бота
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple, Callable, Any
+
+from database import Database
+from metrics import DB_CALL_SECONDS
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+def _traced_call(name: str, method: Callable, args: tuple, kwargs: dict) -> Any:
+    """Вызов метода Database в потоке пула под своим спаном"""
+    with tracer.span(f'sqlite.{name}'):
+        return method(*args, **kwargs)
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database с ограниченной очередью и замером времени вызовов"""
+
+    def __init__(self, db: Database, max_workers: int = 1, max_pending: int = 100,
+                 slow_call_ms: float = 200.0):
+        self.db = db
+        self.max_pending = max_pending
+        self.slow_call_ms = slow_call_ms
+
+        # Отдельный пул потоков только для работы с БД
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='db')
+        # Ограничиваем глубину очереди: лишние вызовы ждут в event loop, а не копятся в пуле
+        self._slots = asyncio.Semaphore(max_pending)
+        self._pending = 0
+
+        # Фоновые записи, результат которых никто не ждет
+        self._background = set()
+
+        # Статистика по методам: количество вызовов и суммарное время
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    @property
+    def pending(self) -> int:
+        """Количество вызовов, ожидающих выполнения или выполняющихся сейчас"""
+        return self._pending
+
+    async def _call(self, method: Callable, *args, **kwargs) -> Any:
+        """Выполнить метод Database в пуле потоков с замером времени"""
+        name = method.__name__
+        if tracer.enabled:
+            # Спан db.* включает ожидание в очереди, вложенный sqlite.* — само выполнение
+            with tracer.span(f'db.{name}'):
+                context = contextvars.copy_context()
+                return await self._run(name, context.run, _traced_call, name, method, args, kwargs)
+
+        return await self._run(name, method, *args, **kwargs)
+
+    async def _run(self, name: str, function: Callable, *args, **kwargs) -> Any:
+        async with self._slots:
+            self._pending += 1
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            try:
+                return await loop.run_in_executor(
+                    self._executor, lambda: function(*args, **kwargs)
+                )
+            finally:
+                self._pending -= 1
+                self._record(name, (time.perf_counter() - started) * 1000)
+
+    def _record(self, name: str, elapsed_ms: float):
+        """Учесть время выполнения вызова"""
+        stat = self.stats.setdefault(name, {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stat['calls'] += 1
+        stat['total_ms'] += elapsed_ms
+        stat['max_ms'] = max(stat['max_ms'], elapsed_ms)
+        DB_CALL_SECONDS.observe(elapsed_ms / 1000, method=name)
+
+        if elapsed_ms >= self.slow_call_ms:
+            logger.warning(f"Медленный вызов БД {name}: {elapsed_ms:.1f} мс")
+        else:
+            logger.debug(f"Вызов БД {name}: {elapsed_ms:.1f} мс")
+
+    async def add_user(self, user_id: int, username: str = None,
+                       first_name: str = None, last_name: str = None):
+        """Добавление или обновление пользователя"""
+        return await self._call(self.db.add_user, user_id, username, first_name, last_name)
+
+    async def start_conversation(self, user_id: int) -> int:
+        """Начать новый диалог для пользователя"""
+        return await self._call(self.db.start_conversation, user_id)
+
+    async def save_answer(self, conversation_id: int, question_number: int,
+                          question_text: str, answer: str):
+        """Сохранить ответ на вопрос"""
+        return await self._call(self.db.save_answer, conversation_id,
+                                question_number, question_text, answer)
+
+    async def get_conversation_answers(self, conversation_id: int) -> List[Dict]:
+        """Получить все ответы для диалога"""
+        return await self._call(self.db.get_conversation_answers, conversation_id)
+
+    async def complete_conversation(self, conversation_id: int):
+        """Завершить диалог"""
+        return await self._call(self.db.complete_conversation, conversation_id)
+
+    async def save_scenarios(self, conversation_id: int, scenarios: List[Dict]) -> bool:
+        """Сохранить сгенерированные сценарии (повторный вызов ничего не меняет)"""
+        return await self._call(self.db.save_scenarios, conversation_id, scenarios)
+
+    async def get_user_conversations(self, user_id: int) -> List[Dict]:
+        """Получить все диалоги пользователя"""
+        return await self._call(self.db.get_user_conversations, user_id)
+
+    async def get_active_conversation(self, user_id: int) -> Optional[int]:
+        """Получить активный диалог пользователя (если есть)"""
+        return await self._call(self.db.get_active_conversation, user_id)
+
+    async def get_cached_response(self, cache_key: str,
+                                  max_age_seconds: float) -> Optional[Tuple[str, float]]:
+        """Получить ответ из кэша сценариев и время его создания"""
+        return await self._call(self.db.get_cached_response, cache_key, max_age_seconds)
+
+    async def put_cached_response(self, cache_key: str, model: str, prompt_version: str,
+                                  response: str, max_entries: int):
+        """Сохранить ответ в кэш сценариев"""
+        return await self._call(self.db.put_cached_response, cache_key, model,
+                                prompt_version, response, max_entries)
+
+    async def delete_expired_cache(self, max_age_seconds: float) -> int:
+        """Удалить устаревшие записи кэша сценариев"""
+        return await self._call(self.db.delete_expired_cache, max_age_seconds)
+
+    async def enqueue_generation_job(self, conversation_id: int, user_id: int, chat_id: int,
+                                     message_id: int, answers_hash: Optional[str] = None) -> Tuple[int, bool]:
+        """Поставить задачу на генерацию в очередь, если такой ещё нет"""
+        return await self._call(self.db.enqueue_generation_job, conversation_id,
+                                user_id, chat_id, message_id, answers_hash)
+
+    async def claim_generation_job(self, worker_id: str, lease_seconds: float,
+                                   shard: Optional[Tuple[int, int]] = None) -> Optional[Dict]:
+        """Взять в работу следующую задачу генерации"""
+        return await self._call(self.db.claim_generation_job, worker_id, lease_seconds, shard)
+
+    async def extend_generation_lease(self, job_id: int, worker_id: str,
+                                      lease_seconds: float) -> bool:
+        """Продлить аренду задачи генерации"""
+        return await self._call(self.db.extend_generation_lease, job_id, worker_id, lease_seconds)
+
+    async def complete_generation_job(self, job_id: int, worker_id: str) -> bool:
+        """Отметить задачу генерации выполненной, если она всё ещё у этого воркера"""
+        return await self._call(self.db.complete_generation_job, job_id, worker_id)
+
+    async def fail_generation_job(self, job_id: int, worker_id: str, error: str, retry: bool) -> bool:
+        """Вернуть задачу генерации в очередь или отметить проваленной, если она всё ещё у этого воркера"""
+        return await self._call(self.db.fail_generation_job, job_id, worker_id, error, retry)
+
+    async def get_generation_queue_position(self, job_id: int,
+                                            shard: Optional[Tuple[int, int]] = None) -> int:
+        """Место задачи генерации в очереди"""
+        return await self._call(self.db.get_generation_queue_position, job_id, shard)
+
+    async def recover_generation_jobs(self, owner_prefix: Optional[str] = None) -> int:
+        """Вернуть в очередь задачи, оставшиеся в работе после остановки"""
+        return await self._call(self.db.recover_generation_jobs, owner_prefix)
+
+    async def record_llm_call(self, **record):
+        """Записать вызов Claude в журнал"""
+        return await self._call(self.db.record_llm_call, **record)
+
+    def record_llm_call_background(self, **record):
+        """Записать вызов Claude в журнал в фоне, не задерживая генерацию"""
+        task = asyncio.create_task(self.record_llm_call(**record))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def wait_background(self):
+        """Дождаться фоновых записей (перед остановкой)"""
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    async def get_llm_latency_percentiles(self, days: int = 1,
+                                          percentiles: Tuple[float, ...] = (0.5, 0.95)) -> Dict:
+        """Перцентили задержки вызовов Claude"""
+        return await self._call(self.db.get_llm_latency_percentiles, days, percentiles)
+
+    async def get_llm_tokens_per_day(self, days: int = 30) -> List[Dict]:
+        """Расход токенов по дням"""
+        return await self._call(self.db.get_llm_tokens_per_day, days)
+
+    async def get_llm_cost_per_completed_lead(self, pricing: Dict[str, Dict[str, float]],
+                                              days: int = 30) -> Optional[float]:
+        """Средняя стоимость вызовов Claude на завершенный диалог"""
+        return await self._call(self.db.get_llm_cost_per_completed_lead, pricing, days)
+
+    async def get_user_data(self, user_id: int) -> Optional[Dict]:
+        """Сохраненные user_data пользователя"""
+        return await self._call(self.db.get_user_data, user_id)
+
+    async def get_conversation_states(self, name: str) -> Dict[tuple, object]:
+        """Состояния ConversationHandler"""
+        return await self._call(self.db.get_conversation_states, name)
+
+    async def save_persistence(self, user_data: Dict[int, Optional[Dict]],
+                               states: Dict[Tuple[str, tuple], object]):
+        """Записать накопленные изменения user_data и состояний одной транзакцией"""
+        return await self._call(self.db.save_persistence, user_data, states)
+
+    def shutdown(self):
+        """Дождаться завершения запущенных вызовов, остановить пул потоков и закрыть БД"""
+        self._executor.shutdown(wait=True)
+        self.db.close()
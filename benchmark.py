@@ -0,0 +1,507 @@
+"""
+Микробенчмарки Database и вспомогательных методов AIAgent с проверкой регрессий.
+
+Базы на 10k/100k/1M диалогов заполняются один раз и кэшируются в --data-dir;
+каждый прогон работает с копией, поэтому пишущие методы не раздувают исходник.
+
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json --max-regression 20
+    python benchmark.py --sizes 10000 --only get_user_conversations,build_prompt
+
+Код выхода 1, если какой-либо замер стал медленнее базового больше чем на
+--max-regression % сверх шума обоих прогонов и замедление подтвердилось
+при повторных замерах (--confirm). Сравнивается среднее быстрейшей половины
+раундов, приведённое к скорости машины по калибровочному замеру
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, List, Tuple, Callable, Iterator
+
+from database import Database, MIGRATIONS
+
+logger = logging.getLogger('benchmark')
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+# Меняется, когда меняется состав тестовых данных: старые кэшированные базы пересоздаются
+SEED_VERSION = 1
+
+MODEL = 'claude-3-haiku-20240307'
+
+# Замер: (имя, подготовка аргументов на number вызовов, вызов)
+Prepare = Callable[[int], List[tuple]]
+Benchmark = Tuple[str, Prepare, Callable]
+
+
+# ==================== ТЕСТОВЫЕ ДАННЫЕ ====================
+def _timestamp(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _seed_rows(conversations: int, rng: random.Random) -> Dict[str, Iterator[tuple]]:
+    """
+    Строки всех таблиц; генераторы, чтобы 1M диалогов не держать в памяти.
+    Каждый пятый диалог не завершён, у остальных есть сценарии и вызов Claude
+    """
+    users = max(1, conversations // 2)
+    # SQLite сравнивает с datetime('now') в UTC
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    epoch = time.time()
+
+    def conversation_rows():
+        for conversation_id in range(1, conversations + 1):
+            started = now - timedelta(seconds=rng.randrange(90 * 24 * 3600))
+            completed = conversation_id % 5 != 0
+            yield (conversation_id, 1 + conversation_id % users, _timestamp(started),
+                   _timestamp(started + timedelta(minutes=10)) if completed else None,
+                   'completed' if completed else 'in_progress')
+
+    def answer_rows():
+        for conversation_id in range(1, conversations + 1):
+            answered = 7 if conversation_id % 5 != 0 else 1 + conversation_id % 6
+            for number in range(1, answered + 1):
+                yield (conversation_id, number, f"Вопрос {number}", f"Ответ {conversation_id}-{number}")
+
+    def completed_ids():
+        return (c for c in range(1, conversations + 1) if c % 5 != 0)
+
+    def llm_call_rows():
+        for conversation_id in completed_ids():
+            created = now - timedelta(seconds=rng.randrange(30 * 24 * 3600))
+            yield (conversation_id, MODEL, 900, 1200, 700, 0, rng.uniform(300, 1500),
+                   rng.uniform(2000, 12000), 'ok', _timestamp(created))
+
+    return {
+        'users': ((user_id, f"user{user_id}", f"Имя{user_id}", None) for user_id in range(1, users + 1)),
+        'conversations': conversation_rows(),
+        'conversation_answers': answer_rows(),
+        'scenarios': ((c, '[{"text": "Сценарии"}]') for c in completed_ids()),
+        'llm_calls': llm_call_rows(),
+        'generation_jobs': ((c, 1 + c % users, 1 + c % users, c, f"hash{c}", 'done', 1, epoch, epoch)
+                            for c in completed_ids()),
+        'scenario_cache': ((f"bench-{i}", MODEL, '2', 'Сценарии', epoch, epoch)
+                           for i in range(max(1, conversations // 10))),
+        'user_data': ((user_id, json.dumps({'conversation_id': user_id, 'current_question': 3}), epoch)
+                      for user_id in range(1, max(1, users // 10) + 1)),
+        'conversation_states': (('ai_dialog', json.dumps([user_id, user_id]), '1', epoch)
+                                for user_id in range(1, max(1, users // 100) + 1)),
+    }
+
+
+_SEED_SQL = {
+    'users': 'INSERT INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)',
+    'conversations': '''INSERT INTO conversations (id, user_id, started_at, completed_at, status)
+                        VALUES (?, ?, ?, ?, ?)''',
+    'conversation_answers': '''INSERT INTO conversation_answers
+                               (conversation_id, question_number, question_text, answer)
+                               VALUES (?, ?, ?, ?)''',
+    'scenarios': 'INSERT INTO scenarios (conversation_id, scenarios_json) VALUES (?, ?)',
+    'llm_calls': '''INSERT INTO llm_calls
+                    (conversation_id, model, input_tokens, output_tokens, cache_read_tokens,
+                     cache_write_tokens, ttft_ms, latency_ms, outcome, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'generation_jobs': '''INSERT INTO generation_jobs
+                          (conversation_id, user_id, chat_id, message_id, answers_hash, status,
+                           attempts, created_at, updated_at)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'scenario_cache': '''INSERT INTO scenario_cache
+                         (cache_key, model, prompt_version, response, created_at, last_used_at)
+                         VALUES (?, ?, ?, ?, ?, ?)''',
+    'user_data': 'INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?)',
+    'conversation_states': '''INSERT INTO conversation_states (name, key, state, updated_at)
+                              VALUES (?, ?, ?, ?)''',
+}
+
+
+def seeded_database(data_dir: str, conversations: int, seed: int = 0) -> str:
+    """Путь к заполненной базе нужного размера; создаётся при первом обращении"""
+    os.makedirs(data_dir, exist_ok=True)
+    name = f"bench_{conversations}_s{SEED_VERSION}_m{MIGRATIONS[-1][0]}.db"
+    path = os.path.join(data_dir, name)
+    if os.path.exists(path):
+        return path
+
+    print(f"Заполняем базу на {conversations} диалогов: {path}", file=sys.stderr)
+    started = time.perf_counter()
+    building = path + '.tmp'
+    if os.path.exists(building):
+        os.remove(building)
+
+    # Схему создаёт сам Database, чтобы она совпадала с рабочей
+    Database(building).close()
+
+    conn = sqlite3.connect(building)
+    conn.execute('PRAGMA synchronous = OFF')
+    with conn:
+        for table, rows in _seed_rows(conversations, random.Random(seed)).items():
+            conn.executemany(_SEED_SQL[table], rows)
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+    os.replace(building, path)
+    print(f"Готово за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+    return path
+
+
+# ==================== ЗАМЕРЫ ====================
+def database_benchmarks(db: Database, path: str, conversations: int, rng: random.Random) -> List[Benchmark]:
+    """Замеры всех публичных методов Database на базе заданного размера"""
+    from ai_questions import MODEL_PRICING
+
+    users = max(1, conversations // 2)
+    cache_entries = max(1, conversations // 10)
+    worker = 'bench-0'
+
+    def user() -> int:
+        return rng.randint(1, users)
+
+    def conversation() -> int:
+        return rng.randint(1, conversations)
+
+    def each(make: Callable[[], tuple]) -> Prepare:
+        return lambda number: [make() for _ in range(number)]
+
+    def drain_queue():
+        # Ожидающие задачи прошлых раундов копились бы и замедляли каждый следующий claim
+        db.flush()
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("UPDATE generation_jobs SET status = 'failed' WHERE status = 'pending'")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def claimed_jobs(number: int) -> List[int]:
+        # Подготовка вне замера: новые задачи, уже взятые в работу
+        drain_queue()
+        job_ids = []
+        for _ in range(number):
+            db.enqueue_generation_job(conversation(), user(), 1, 1, uuid.uuid4().hex)
+            job_ids.append(db.claim_generation_job(worker, 120)['id'])
+        return job_ids
+
+    def pending_jobs(number: int) -> List[tuple]:
+        drain_queue()
+        for _ in range(number):
+            db.enqueue_generation_job(conversation(), user(), 1, 1, uuid.uuid4().hex)
+        return [(worker, 120)] * number
+
+    def open_close():
+        Database(path).close()
+
+    def save_answers_flushed(*rows: tuple):
+        # Полная стоимость записи ответа: постановка в очередь и фиксация пачки
+        for args in rows:
+            db.save_answer(*args)
+        db.flush()
+
+    return [
+        ('open_close', each(tuple), open_close),
+        ('add_user', each(lambda: (user(), 'username', 'Имя', None)), db.add_user),
+        ('start_conversation', each(lambda: (user(),)), db.start_conversation),
+        ('save_answer', each(lambda: (conversation(), 7, 'Вопрос', 'Ответ')), db.save_answer),
+        ('save_answer_x100_flushed',
+         each(lambda: tuple((conversation(), 7, 'Вопрос', 'Ответ') for _ in range(100))),
+         save_answers_flushed),
+        ('get_conversation_answers', each(lambda: (conversation(),)), db.get_conversation_answers),
+        ('complete_conversation', each(lambda: (conversation(),)), db.complete_conversation),
+        ('save_scenarios', each(lambda: (conversation(), [{'text': 'Сценарии'}])), db.save_scenarios),
+        ('get_user_conversations', each(lambda: (user(),)), db.get_user_conversations),
+        ('get_active_conversation', each(lambda: (user(),)), db.get_active_conversation),
+        ('get_cached_response', each(lambda: (f"bench-{rng.randrange(cache_entries)}", 30 * 24 * 3600)),
+         db.get_cached_response),
+        ('put_cached_response', each(lambda: (uuid.uuid4().hex, MODEL, '2', 'Сценарии', cache_entries)),
+         db.put_cached_response),
+        ('delete_expired_cache', each(lambda: (30 * 24 * 3600,)), db.delete_expired_cache),
+        ('enqueue_generation_job', each(lambda: (conversation(), user(), 1, 1, uuid.uuid4().hex)),
+         db.enqueue_generation_job),
+        ('claim_generation_job', pending_jobs, db.claim_generation_job),
+        ('extend_generation_lease', lambda n: [(job_id, worker, 120) for job_id in claimed_jobs(n)],
+         db.extend_generation_lease),
+        ('complete_generation_job', lambda n: [(job_id, worker) for job_id in claimed_jobs(n)],
+         db.complete_generation_job),
+        ('fail_generation_job', lambda n: [(job_id, worker, 'ошибка', True) for job_id in claimed_jobs(n)],
+         db.fail_generation_job),
+        ('get_generation_queue_position', each(lambda: (rng.randint(1, conversations),)),
+         db.get_generation_queue_position),
+        ('recover_generation_jobs', each(lambda: (None,)), db.recover_generation_jobs),
+        ('record_llm_call', each(lambda: (conversation(), MODEL, 'ok', 900, 1200, 700, 0, 500.0, 5000.0)),
+         db.record_llm_call),
+        ('get_llm_latency_percentiles', each(lambda: (30,)), db.get_llm_latency_percentiles),
+        ('get_llm_tokens_per_day', each(lambda: (30,)), db.get_llm_tokens_per_day),
+        ('get_llm_cost_per_completed_lead', each(lambda: (MODEL_PRICING, 30)),
+         db.get_llm_cost_per_completed_lead),
+        ('get_user_data', each(lambda: (rng.randint(1, max(1, users // 10)),)), db.get_user_data),
+        ('get_conversation_states', each(lambda: ('ai_dialog',)), db.get_conversation_states),
+        ('save_persistence', each(lambda: (
+            {user(): {'conversation_id': conversation(), 'current_question': 4}},
+            {('ai_dialog', (user(), user())): 1},
+        )), db.save_persistence),
+    ]
+
+
+def agent_benchmarks(rng: random.Random) -> List[Benchmark]:
+    """Замеры сборки промпта и форматирования вопросов (без обращений к API)"""
+    from ai_questions import AIAgent, QUESTIONS
+
+    agent = AIAgent(api_key='benchmark')
+    answers = [
+        {'question_number': q['number'], 'question_text': q['text'],
+         'answer': ' '.join(['ответ'] * rng.randint(5, 60))}
+        for q in QUESTIONS
+    ]
+    total = agent.get_total_questions()
+
+    def each(make: Callable[[], tuple]) -> Prepare:
+        return lambda number: [make() for _ in range(number)]
+
+    return [
+        ('build_prompt', each(lambda: (answers,)), agent.build_prompt),
+        ('request_params', each(lambda: (answers,)), agent._request_params),
+        ('format_question', each(lambda: (rng.randint(1, total),)), agent.format_question),
+        ('get_question_by_number', each(lambda: (rng.randint(1, total),)), agent.get_question_by_number),
+    ]
+
+
+def measure(prepare: Prepare, call: Callable, rounds: int, min_time: float,
+            max_number: int = 10_000) -> Dict:
+    """
+    Время одного вызова: число вызовов в раунде подбирается так, чтобы раунд
+    длился не меньше min_time. Для сравнения берётся среднее быстрейшей половины
+    раундов — медленные раунды обычно означают помехи, а не код
+    """
+    # Калибровка (заодно прогрев кэшей SQLite и подготовленных запросов)
+    number = 1
+    while True:
+        batch = prepare(number)
+        started = time.perf_counter()
+        for args in batch:
+            call(*args)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= max_number:
+            break
+        number = min(max_number, max(number * 2, int(number * min_time / max(elapsed, 1e-9))))
+
+    per_call = []
+    for _ in range(rounds):
+        batch = prepare(number)
+        started = time.perf_counter()
+        for args in batch:
+            call(*args)
+        per_call.append((time.perf_counter() - started) / number)
+
+    per_call.sort()
+    trimmed = statistics.fmean(per_call[:max(1, len(per_call) // 2)])
+    return {
+        'trimmed_us': round(trimmed * 1e6, 3),
+        'median_us': round(statistics.median(per_call) * 1e6, 3),
+        'min_us': round(per_call[0] * 1e6, 3),
+        # Разброс быстрых раундов: насколько их среднее выше минимума
+        'noise_pct': round((trimmed / per_call[0] - 1) * 100, 1) if per_call[0] else 0.0,
+        'number': number,
+        'rounds': rounds,
+    }
+
+
+def calibrate(rounds: int, min_time: float) -> float:
+    """
+    Эталонная нагрузка (Python и SQLite в памяти), не зависящая от кода бота:
+    по ней результаты приводятся к скорости машины в момент прогона
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT INTO t (value) VALUES (?)", ((f"value-{i}",) for i in range(1000)))
+
+    def reference():
+        rows = conn.execute("SELECT value FROM t WHERE id % 7 = 0").fetchall()
+        return sum(len(row[0]) for row in rows) + sum(i * i for i in range(500))
+
+    try:
+        return measure(lambda number: [()] * number, reference, rounds, min_time)['trimmed_us']
+    finally:
+        conn.close()
+
+
+def run(sizes: List[int], data_dir: str, rounds: int, min_time: float,
+        only: Optional[List[str]] = None, seed: int = 0, write_behind: bool = True) -> Dict:
+    results: Dict[str, Dict[str, Dict]] = {}
+    calibration_us = calibrate(rounds, min_time)
+
+    def selected(benchmarks: List[Benchmark]) -> List[Benchmark]:
+        return [b for b in benchmarks if not only or b[0] in only]
+
+    rng = random.Random(seed)
+    group = results['ai_questions'] = {}
+    for name, prepare, call in selected(agent_benchmarks(rng)):
+        group[name] = measure(prepare, call, rounds, min_time)
+        print(f"ai_questions {name}: {group[name]['trimmed_us']} мкс", file=sys.stderr)
+
+    for size in sizes:
+        source = seeded_database(data_dir, size, seed)
+        workdir = tempfile.mkdtemp(prefix='bench-')
+        path = os.path.join(workdir, 'bench.db')
+        # Пишущие замеры меняют базу, поэтому работаем с копией
+        shutil.copyfile(source, path)
+
+        group = results[f"database_{size}"] = {}
+        # Как в боте: ответы и пользователи пишутся через очередь отложенной записи
+        db = Database(path, write_behind=write_behind)
+        try:
+            for name, prepare, call in selected(database_benchmarks(db, path, size, rng)):
+                group[name] = measure(prepare, call, rounds, min_time)
+                print(f"database_{size} {name}: {group[name]['trimmed_us']} мкс", file=sys.stderr)
+        finally:
+            db.close()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'rounds': rounds,
+            'min_time': min_time,
+            'write_behind': write_behind,
+            'calibration_us': calibration_us,
+        },
+        'results': results,
+    }
+
+
+def _typical(result: Dict) -> float:
+    # Старые базовые файлы содержат только медиану
+    return result.get('trimmed_us') or result['median_us']
+
+
+def compare(current: Dict, baseline: Dict, max_regression: float) -> List[Tuple[str, str, float, float, float]]:
+    """
+    Замеры, ставшие медленнее базовых больше чем на max_regression процентов
+    сверх шума обоих прогонов. Базовое время приводится к скорости машины
+    по отношению калибровочных замеров
+    """
+    scale = 1.0
+    base_calibration = baseline.get('meta', {}).get('calibration_us')
+    current_calibration = current.get('meta', {}).get('calibration_us')
+    if base_calibration and current_calibration:
+        scale = current_calibration / base_calibration
+
+    regressions = []
+    for group, benchmarks in current['results'].items():
+        for name, result in benchmarks.items():
+            base = baseline.get('results', {}).get(group, {}).get(name)
+            if not base or not _typical(base):
+                continue
+            expected = _typical(base) * scale
+            change = (_typical(result) / expected - 1) * 100
+            allowed = max_regression + base.get('noise_pct', 0.0) + result.get('noise_pct', 0.0)
+            if change > allowed:
+                regressions.append((group, name, round(expected, 3), _typical(result), change))
+    return regressions
+
+
+def confirm_regressions(regressions: List[Tuple[str, str, float, float, float]], baseline: Dict,
+                        args: argparse.Namespace, write_behind: bool) -> List[Tuple[str, str, float, float, float]]:
+    """Перезамерить подозрительные замеры; регрессия остаётся, только если повторилась каждый раз"""
+    for attempt in range(args.confirm):
+        if not regressions:
+            break
+        suspects = {(group, name) for group, name, *_ in regressions}
+        names = sorted({name for _, name in suspects})
+        sizes = sorted({int(group.split('_')[1]) for group, _ in suspects if group.startswith('database_')})
+        print(f"Перепроверка {len(suspects)} замеров (попытка {attempt + 1})", file=sys.stderr)
+
+        rerun = run(sizes, args.data_dir, args.rounds, args.min_time, names, args.seed + attempt + 1,
+                    write_behind)
+        rerun['results'] = {
+            group: {name: result for name, result in benchmarks.items() if (group, name) in suspects}
+            for group, benchmarks in rerun['results'].items()
+        }
+        confirmed = {(group, name) for group, name, *_ in compare(rerun, baseline, args.max_regression)}
+        regressions = [r for r in regressions if (r[0], r[1]) in confirmed]
+    return regressions
+
+
+def print_results(current: Dict, baseline: Optional[Dict]):
+    header = (f"{'группа':<22}{'замер':<34}{'время мкс':>12}{'мин мкс':>12}{'шум':>8}"
+              f"{'база мкс':>12}{'изм.':>9}")
+    print(header)
+    print('-' * len(header))
+    for group, benchmarks in current['results'].items():
+        for name, result in benchmarks.items():
+            base = (baseline or {}).get('results', {}).get(group, {}).get(name)
+            base_cell = f"{_typical(base):>12}" if base else f"{'-':>12}"
+            change = (f"{(_typical(result) / _typical(base) - 1) * 100:>+8.1f}%"
+                      if base and _typical(base) else f"{'-':>9}")
+            print(f"{group:<22}{name:<34}{_typical(result):>12}{result['min_us']:>12}"
+                  f"{result.get('noise_pct', 0.0):>7.1f}%{base_cell}{change}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Микробенчмарки Database и AIAgent с проверкой регрессий')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='размеры баз в диалогах через запятую')
+    parser.add_argument('--data-dir', default='.benchmark', help='где хранить заполненные базы')
+    parser.add_argument('--rounds', type=int, default=15)
+    parser.add_argument('--min-time', type=float, default=0.1, help='минимальная длительность раунда, с')
+    parser.add_argument('--only', default=None, help='только эти замеры (через запятую)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=None, help='JSON с базовыми результатами для сравнения')
+    parser.add_argument('--max-regression', type=float, default=20.0,
+                        help='допустимое замедление сверх шума, %%')
+    parser.add_argument('--confirm', type=int, default=2,
+                        help='сколько раз перепроверить замедление, прежде чем считать его регрессией')
+    parser.add_argument('--write-behind', choices=('0', '1'), default=os.getenv('DB_WRITE_BEHIND', '1'),
+                        help='отложенная запись, как DB_WRITE_BEHIND в боте')
+    parser.add_argument('--save-baseline', default=None, help='сохранить результаты как базовые')
+    parser.add_argument('--json', default=None, help='сохранить результаты в файл')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    only = [name.strip() for name in args.only.split(',')] if args.only else None
+    write_behind = args.write_behind == '1'
+    current = run(sizes, args.data_dir, args.rounds, args.min_time, only, args.seed, write_behind)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print_results(current, baseline)
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(current, f, ensure_ascii=False, indent=2)
+
+    if baseline:
+        regressions = confirm_regressions(compare(current, baseline, args.max_regression),
+                                          baseline, args, write_behind)
+        if regressions:
+            print(f"\nЗамедление больше {args.max_regression}%:")
+            for group, name, base, result, change in regressions:
+                print(f"  {group} {name}: {base} → {result} мкс ({change:+.1f}%, база с поправкой на машину)")
+            return 1
+        print(f"\nРегрессий больше {args.max_regression}% нет")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
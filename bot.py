@@ -1,7 +1,10 @@
 import os
+import asyncio
 import logging
+from functools import partial
+from typing import Dict
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, Update, Message, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -10,11 +13,41 @@ from telegram.ext import (
     filters,
     ContextTypes,
     ConversationHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 
 # Импортируем наши модули
 from database import Database
+from async_database import AsyncDatabase
+from session_cache import SessionCache
+from response_cache import ScenarioCache
+from speculative import SpeculativeGenerator
+from generation_jobs import GenerationWorkerPool
+from hedging import HedgePolicy
+from progressive_message import ProgressiveMessage
+from metrics import (
+    MetricsServer,
+    HANDLER_SECONDS,
+    DB_PENDING,
+    GENERATIONS_IN_FLIGHT,
+    GENERATIONS_WAITING,
+    UPDATE_QUEUE_DEPTH,
+    FLOOD_REJECTED,
+    FLOOD_TRACKED_USERS,
+    HEDGE_DEADLINE_SECONDS,
+    track_handler,
+)
+from tracing import tracer, traced
+from webhook import run_webhook
+from persistence import SQLitePersistence
+from content import ContentRegistry
+from send_scheduler import SendScheduler, INTERACTIVE, BULK
+from rate_limit import UserRateLimiter
+from update_processor import UserOrderedUpdateProcessor
+from single_flight import answers_hash
 from ai_questions import AIAgent, QUESTIONS
 
 # Загружаем переменные окружения из .env файла
@@ -37,335 +70,234 @@ if not BOT_TOKEN:
 if not ANTHROPIC_API_KEY:
     raise ValueError("Не найден ANTHROPIC_API_KEY в переменных окружения!")
 
-# Инициализируем базу данных и AI-агента
-db = Database()
-ai_agent = AIAgent(ANTHROPIC_API_KEY)
+# Доля процесса при запуске через супервизор: WORKER_SHARD="номер/всего",
+# воркер получает апдейты пользователей с user_id % всего == номер
+WORKER_SHARD = None
+if os.getenv('WORKER_SHARD'):
+    WORKER_SHARD = tuple(int(part) for part in os.getenv('WORKER_SHARD').split('/'))
 
-# Состояния для ConversationHandler
-ASKING_QUESTIONS = 1
-GENERATING_SCENARIOS = 2
+# Инициализируем базу данных и AI-агента
+# Все обращения к SQLite идут через отдельный пул потоков, чтобы не блокировать event loop
+db = AsyncDatabase(
+    Database(
+        os.getenv('DB_PATH', 'bot_data.db'),
+        pool_size=int(os.getenv('DB_POOL_SIZE', '4')),
+        wal=os.getenv('DB_WAL', '1') == '1',
+        write_behind=os.getenv('DB_WRITE_BEHIND', '1') == '1',
+        batch_interval_ms=float(os.getenv('DB_BATCH_INTERVAL_MS', '50')),
+        batch_max_rows=int(os.getenv('DB_BATCH_MAX_ROWS', '100')),
+    ),
+    max_workers=int(os.getenv('DB_WORKERS', '1')),
+    max_pending=int(os.getenv('DB_MAX_PENDING', '100')),
+)
+# Состояние анкет держим в памяти, запись идет сквозь кэш в SQLite
+sessions = SessionCache(
+    db,
+    max_size=int(os.getenv('SESSION_CACHE_SIZE', '10000')),
+    ttl_seconds=float(os.getenv('SESSION_CACHE_TTL', '3600')),
+)
+# Кэш готовых сценариев для почти одинаковых ответов
+scenario_cache = None
+if os.getenv('SCENARIO_CACHE', '1') == '1':
+    scenario_cache = ScenarioCache(
+        db,
+        ttl_seconds=float(os.getenv('SCENARIO_CACHE_TTL', str(7 * 24 * 3600))),
+        max_entries=int(os.getenv('SCENARIO_CACHE_MAX_ENTRIES', '10000')),
+    )
+# Хеджирование медленных запросов к Claude (опционально)
+hedge_policy = None
+if os.getenv('HEDGE_REQUESTS', '0') == '1':
+    hedge_policy = HedgePolicy(
+        percentile=float(os.getenv('HEDGE_PERCENTILE', '0.95')),
+        min_delay=float(os.getenv('HEDGE_MIN_DELAY', '1.0')),
+        budget_ratio=float(os.getenv('HEDGE_BUDGET_RATIO', '0.1')),
+    )
+ai_agent = AIAgent(
+    ANTHROPIC_API_KEY,
+    max_concurrent_generations=int(os.getenv('MAX_CONCURRENT_GENERATIONS', '10')),
+    cache=scenario_cache,
+    models=[m.strip() for m in os.getenv('CLAUDE_MODELS', 'claude-3-haiku-20240307').split(',') if m.strip()],
+    max_retries=int(os.getenv('CLAUDE_MAX_RETRIES', '2')),
+    request_timeout=float(os.getenv('CLAUDE_TIMEOUT', '60')),
+    breaker_threshold=int(os.getenv('CLAUDE_BREAKER_THRESHOLD', '5')),
+    breaker_reset_timeout=float(os.getenv('CLAUDE_BREAKER_RESET', '30')),
+    hedge_policy=hedge_policy,
+    # Каждый вызов Claude пишется в журнал llm_calls в фоне
+    on_llm_call=db.record_llm_call_background,
+)
 
+# Спекулятивная генерация до ответа на последний вопрос (опционально)
+speculative = None
+if os.getenv('SPECULATIVE_GENERATION', '0') == '1':
+    speculative = SpeculativeGenerator(
+        ai_agent,
+        placeholder_budget=os.getenv('SPECULATIVE_PLACEHOLDER_BUDGET', '50 000 рублей в месяц'),
+        max_age=float(os.getenv('SPECULATIVE_MAX_AGE', '600')),
+    )
 
-# ==================== КОМАНДА /start ====================
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start с приветствием и главным меню"""
-    user = update.effective_user
+# Очередь задач генерации в SQLite и пул воркеров, который её разбирает
+# В режиме нескольких процессов супервизор задает GENERATION_OWNER — постоянное имя
+# процесса, чтобы после перезапуска возвращать в очередь только свои задачи
+generation_workers = GenerationWorkerPool(
+    db,
+    workers=int(os.getenv('GENERATION_WORKERS', '4')),
+    lease_seconds=float(os.getenv('GENERATION_LEASE_SECONDS', '120')),
+    max_attempts=int(os.getenv('GENERATION_MAX_ATTEMPTS', '3')),
+    owner_prefix=os.getenv('GENERATION_OWNER') or None,
+    # Задачи берём только у своих пользователей — тех же, чьи апдейты получает процесс
+    shard=WORKER_SHARD,
+)
 
-    welcome_text = f"""
-🤖 *Привет, {user.first_name}!*
+# Все запросы к Telegram идут через планировщик с лимитами на бота и на чат.
+# Лимит на бота общий для всех воркеров супервизора, поэтому делим его поровну;
+# чат всегда обслуживает один воркер (маршрутизация по user_id), его лимит не делим
+outbox = SendScheduler(
+    global_rate=float(os.getenv('SEND_GLOBAL_RATE', '30')) / (WORKER_SHARD[1] if WORKER_SHARD else 1),
+    chat_rate=float(os.getenv('SEND_CHAT_RATE', '1')),
+    chat_burst=float(os.getenv('SEND_CHAT_BURST', '3')),
+)
 
-Я AI-агент *Сергея Зисмана* — эксперта по внедрению AI-решений и автоматизации для B2B-бизнеса.
+# Ограничение частоты на пользователя: дешёвые кнопки и сообщения отдельно от генераций
+FLOOD_CONTROL = os.getenv('FLOOD_CONTROL', '1') == '1'
+menu_limiter = UserRateLimiter(
+    rate=float(os.getenv('FLOOD_MENU_RATE', '1')),
+    burst=float(os.getenv('FLOOD_MENU_BURST', '10')),
+)
+generation_limiter = UserRateLimiter(
+    rate=float(os.getenv('FLOOD_GENERATIONS_PER_HOUR', '3')) / 3600,
+    burst=float(os.getenv('FLOOD_GENERATION_BURST', '3')),
+    cleanup_interval=3600,
+)
 
-Здесь ты можешь:
-• Узнать о Сергее и его подходе
-• Изучить программы и услуги
-• Получить контакты для связи
-• Записаться на консультацию
-• Пройти диалог с AI-агентом для подбора сценария
+# Экраны меню из файла контента; файл перечитывается при изменении
+content = ContentRegistry(os.getenv(
+    'CONTENT_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content.json')
+))
 
-_Выбери интересующий раздел из меню ниже_ 👇
-"""
+# Состояния для ConversationHandler
+ASKING_QUESTIONS = 1
+GENERATING_SCENARIOS = 2
 
-    # Создаем клавиатуру с кнопками
-    keyboard = [
-        [InlineKeyboardButton("👤 О Сергее", callback_data='about')],
-        [InlineKeyboardButton("📋 Программы и услуги", callback_data='programs')],
-        [InlineKeyboardButton("📞 Контакты", callback_data='contact')],
-        [InlineKeyboardButton("💼 Кейсы", callback_data='cases')],
-        [InlineKeyboardButton("📅 Записаться на консультацию", callback_data='consultation')],
-        [InlineKeyboardButton("🤖 Диалог с AI-агентом", callback_data='start_ai_dialog')],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(
-        welcome_text,
-        parse_mode=ParseMode.MARKDOWN,
-        reply_markup=reply_markup
+# ==================== ОТПРАВКА ====================
+async def reply(update: Update, text: str, **kwargs) -> Message:
+    """Ответить на сообщение пользователя через планировщик отправки"""
+    return await outbox.submit(
+        update.effective_chat.id,
+        partial(update.message.reply_text, text, **kwargs),
     )
 
 
-# ==================== КОМАНДА /about ====================
-async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Информация об эксперте"""
-    about_text = """
-👤 *О Сергее Зисмане*
-
-Меня зовут *Сергей Зисман*. Я помогаю B2B-сервисам и экспертам внедрять AI так, чтобы это влияло на цифры, а не оставалось "интересным экспериментом".
-
-🎯 *Моя специализация:*
-• AI-агенты и автоматизации под продажи, поддержку и контент
-• Быстрые внутренние инструменты через вайбкодинг
-
-💡 *Мой подход:*
-Я беру задачу, превращаю её в понятный процесс и делаю систему, которая работает каждый день.
-
-🔗 *Почему это работает в B2B:*
-Я строю агентов вокруг ключевых точек:
-⚡ Скорость реакции
-💡 Качество первых вопросов
-🔍 Точность попадания в задачу
-📈 Процесс до решения
+async def edit(update: Update, text: str, **kwargs):
+    """Изменить сообщение с нажатой кнопкой; частые правки одного сообщения склеиваются"""
+    query = update.callback_query
+    message = query.message
+    return await outbox.submit(
+        message.chat.id,
+        partial(query.edit_message_text, text, **kwargs),
+        coalesce_key=(message.chat.id, message.message_id),
+    )
 
-_А не вокруг "умных ответов"_
-"""
 
-    keyboard = [[InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+# ==================== ЭКРАНЫ МЕНЮ ====================
+async def show_screen(update: Update, name: str):
+    """Показать готовый экран: правкой сообщения для кнопки или ответом на команду"""
+    screen = content[name]
+    user = update.effective_user
+    text = screen.render(user.first_name if user else None)
 
     if update.callback_query:
-        await update.callback_query.edit_message_text(
-            about_text,
+        await edit(
+            update,
+            text,
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup
+            reply_markup=screen.reply_markup,
+            disable_web_page_preview=screen.disable_web_page_preview
         )
     else:
-        await update.message.reply_text(
-            about_text,
+        await reply(
+            update,
+            text,
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup
+            reply_markup=screen.reply_markup,
+            disable_web_page_preview=screen.disable_web_page_preview
         )
 
 
-# ==================== КОМАНДА /programs ====================
-async def programs(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Список программ и услуг"""
-    programs_text = """
-📋 *Что я внедряю*
-
-*1️⃣ AI-агенты для продаж в B2B*
-
-Когда лидов вроде бы хватает, но "встречи не ставятся" и менеджеры тонут в переписке.
-
-*Агент умеет:*
-✓ Задавать вопросы и квалифицировать по твоим критериям
-✓ Собирать вводные для КП и созвона
-✓ Отвечать на типовые возражения и доводить до следующего шага
-✓ Фиксировать всё в CRM
-
-*Результат:* меньше потерь на первом касании и быстрее переход от интереса к разговору.
-
-─────────────────
-
-*2️⃣ AI-агенты для поддержки клиентов*
+# ==================== КОМАНДА /start ====================
+@track_handler()
+@traced()
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /start с приветствием и главным меню"""
+    await show_screen(update, 'menu')
 
-Когда команда делает одно и то же: "а где инструкция", "а как оплатить", "а что входит".
 
-*Агент:*
-✓ Отвечает по базе знаний и регламентам
-✓ Просит недостающие данные
-✓ Отделяет простые обращения от сложных
+# ==================== КОМАНДА /about ====================
+@track_handler()
+@traced()
+async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Информация об эксперте"""
+    await show_screen(update, 'about')
 
-*Результат:* ниже нагрузка, выше скорость ответов, меньше раздражения у клиентов.
-"""
 
-    keyboard = [
-        [InlineKeyboardButton("▶️ Следующая страница", callback_data='programs_2')],
-        [InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
-            programs_text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup
-        )
-    else:
-        await update.message.reply_text(
-            programs_text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup
-        )
+# ==================== КОМАНДА /programs ====================
+@track_handler()
+@traced()
+async def programs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Список программ и услуг"""
+    await show_screen(update, 'programs')
 
 
+@track_handler()
+@traced()
 async def programs_page_2(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Вторая страница программ"""
-    programs_text = """
-📋 *Что я внедряю* (продолжение)
-
-*3️⃣ AI-агенты для экспертов: контент и воронка*
-
-Когда ты эксперт, и главная проблема не "что сказать", а как стабильно выдавать это в продажу.
-
-*Агент помогает:*
-✓ Упаковывать оффер и формулировать "почему покупают"
-✓ Делать контент-план под твою воронку
-✓ Писать сценарии видео, письма, лендинг-блоки
-✓ Сохранять единый стиль и логику
-
-*Результат:* регулярность, ясность, меньше ручной работы, больше системности.
-
-─────────────────
-
-*4️⃣ Вайбкодинг: быстрые инструменты*
-
-Если тебе нужен не "стартап на год", а инструмент, который начинает экономить время сейчас:
-
-✓ Мини-панель для команды
-✓ Генератор КП/брифов/скриптов
-✓ Внутренний ассистент по базе знаний
-✓ Прототип сервиса для клиентов
-"""
-
-    keyboard = [
-        [InlineKeyboardButton("◀️ Предыдущая страница", callback_data='programs')],
-        [InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.callback_query.edit_message_text(
-        programs_text,
-        parse_mode=ParseMode.MARKDOWN,
-        reply_markup=reply_markup
-    )
+    await show_screen(update, 'programs_2')
 
 
 # ==================== КОМАНДА /contact ====================
+@track_handler()
+@traced()
 async def contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Контактная информация"""
-    contact_text = """
-📞 *Контакты*
-
-Свяжись со мной удобным способом:
-
-🔹 *Telegram:* [@sergeyzisman](https://t.me/sergeyzisman)
-🔹 *WhatsApp:* [+972 58 630 5753](https://wa.me/972586305753)
-🔹 *LinkedIn:* [Sergey Zisman](https://www.linkedin.com/in/sergeyzisman/)
-🔹 *Сайт:* [sergeyzisman.tech](https://sergeyzisman.tech/)
-
-💬 Напиши мне напрямую или запишись на бесплатную консультацию!
-"""
-
-    keyboard = [[InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
-            contact_text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup,
-            disable_web_page_preview=True
-        )
-    else:
-        await update.message.reply_text(
-            contact_text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup,
-            disable_web_page_preview=True
-        )
+    await show_screen(update, 'contact')
 
 
 # ==================== КОМАНДА /cases ====================
+@track_handler()
+@traced()
 async def cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Кейсы и примеры работ"""
-    cases_text = """
-💼 *Кейсы и примеры работ*
-
-🎯 *Тебе ко мне, если:*
-
-✅ Лиды есть, но конверсия в созвон слабая
-✅ Менеджеры перегружены и пропускают тёплых
-✅ Поддержка съедает день и мешает росту
-✅ Контент нужен постоянно, но ты не хочешь жить в контент-мясорубке
-✅ Хочется системно, быстро, без лишней разработки
-
-─────────────────
-
-🔥 *Примеры реализованных решений:*
-
-• Квалификационный бот для B2B-сервиса
-• AI-помощник в поддержку с базой знаний
-• Контент-генератор для экспертов
-• Внутренние инструменты для команды
-
-_Подробнее о кейсах и результатах — пиши в личку!_
-"""
-
-    keyboard = [[InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
-            cases_text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup
-        )
-    else:
-        await update.message.reply_text(
-            cases_text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup
-        )
+    await show_screen(update, 'cases')
 
 
 # ==================== КОМАНДА /consultation ====================
+@track_handler()
+@traced()
 async def consultation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Запись на консультацию"""
-    consultation_text = """
-📅 *Записаться на консультацию*
-
-Хочешь разобраться, как AI-агенты могут помочь именно твоему бизнесу?
-
-🎯 *На консультации я:*
-1️⃣ Задам 7-10 коротких вопросов
-2️⃣ Соберу контекст твоей ситуации
-3️⃣ Предложу 2-3 сценария внедрения
-
-📌 *Ты узнаешь:*
-✓ Что автоматизировать первым
-✓ Какой эффект ожидать
-✓ Какие данные нужны для запуска
-
-─────────────────
-
-💬 *Как записаться:*
-
-Напиши мне напрямую в удобный мессенджер:
-
-🔹 [Telegram](https://t.me/sergeyzisman)
-🔹 [WhatsApp](https://wa.me/972586305753)
-
-Или отправь сообщение прямо здесь — я получу уведомление!
-"""
-
-    keyboard = [
-        [InlineKeyboardButton("✍️ Написать Сергею", url='https://t.me/sergeyzisman')],
-        [InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
-            consultation_text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup,
-            disable_web_page_preview=True
-        )
-    else:
-        await update.message.reply_text(
-            consultation_text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup,
-            disable_web_page_preview=True
-        )
+    await show_screen(update, 'consultation')
 
 
 # ==================== AI-ДИАЛОГ: НАЧАЛО ====================
+@track_handler()
+@traced()
 async def start_ai_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало диалога с AI-агентом"""
     query = update.callback_query
     user = update.effective_user
 
-    # Сохраняем пользователя в БД
-    db.add_user(
+    # Перезапуск диалога: спекуляция прошлой анкеты больше не понадобится
+    if speculative:
+        speculative.cancel(context.user_data.get('conversation_id'))
+
+    # Сохраняем пользователя в БД и создаем новый диалог
+    conversation_id = await sessions.start_conversation(
         user_id=user.id,
         username=user.username,
         first_name=user.first_name,
         last_name=user.last_name
     )
-
-    # Создаем новый диалог
-    conversation_id = db.start_conversation(user.id)
     context.user_data['conversation_id'] = conversation_id
     context.user_data['current_question'] = 1
 
@@ -385,7 +317,8 @@ _Готов начать? Жми кнопку ниже!_ 👇
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await query.edit_message_text(
+    await edit(
+        update,
         intro_text,
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=reply_markup
@@ -394,6 +327,8 @@ _Готов начать? Жми кнопку ниже!_ 👇
     return ASKING_QUESTIONS
 
 
+@track_handler()
+@traced()
 async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Задать очередной вопрос пользователю"""
     query = update.callback_query
@@ -409,7 +344,8 @@ async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [[InlineKeyboardButton("❌ Отменить диалог", callback_data='cancel_dialog')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await query.edit_message_text(
+    await edit(
+        update,
         question_text,
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=reply_markup
@@ -418,6 +354,8 @@ async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ASKING_QUESTIONS
 
 
+@track_handler()
+@traced()
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ответа пользователя на вопрос"""
     user_answer = update.message.text
@@ -428,7 +366,8 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     question_data = ai_agent.get_question_by_number(question_number)
 
     # Сохраняем ответ в БД
-    db.save_answer(
+    await sessions.save_answer(
+        user_id=update.effective_user.id,
         conversation_id=conversation_id,
         question_number=question_number,
         question_text=question_data['text'],
@@ -441,6 +380,11 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Проверяем, есть ли еще вопросы
     total_questions = ai_agent.get_total_questions()
 
+    # После предпоследнего ответа можно заранее начать генерацию
+    if speculative and question_number == total_questions - 1:
+        answers = await sessions.get_answers(update.effective_user.id, conversation_id)
+        speculative.start(conversation_id, answers)
+
     if question_number < total_questions:
         # Задаем следующий вопрос
         next_question_text = ai_agent.format_question(question_number + 1)
@@ -448,7 +392,8 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = [[InlineKeyboardButton("❌ Отменить диалог", callback_data='cancel_dialog')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await update.message.reply_text(
+        await reply(
+            update,
             f"✅ Принято!\n\n{next_question_text}",
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=reply_markup
@@ -457,32 +402,74 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ASKING_QUESTIONS
     else:
         # Все вопросы заданы, генерируем сценарии
-        await update.message.reply_text(
-            "✅ *Отлично! Все ответы получены.*\n\n⏳ Анализирую данные и готовлю сценарии...",
-            parse_mode=ParseMode.MARKDOWN
-        )
-
         return await generate_scenarios_from_message(update, context)
 
 
-async def generate_scenarios(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Генерация сценариев внедрения через Claude API"""
-    query = update.callback_query
-    conversation_id = context.user_data.get('conversation_id')
+def queue_text(position: int) -> str:
+    """Сообщение о позиции в очереди на генерацию"""
+    return f"⏳ Сейчас много запросов. Ты {position}-й в очереди — сценарии скоро будут готовы."
+
+
+ERROR_TEXT = "❌ Произошла ошибка при генерации сценариев. Попробуй позже или свяжись напрямую с Сергеем."
+DUPLICATE_TEXT = "⏳ Сценарии уже готовятся — результат появится в сообщении выше."
+
+
+@track_handler()
+@traced()
+async def process_generation_job(bot: Bot, job: Dict):
+    """Выполнение задачи из очереди: генерация с постепенным обновлением сообщения"""
+    conversation_id = job['conversation_id']
+    user_id = job['user_id']
+    chat_id, message_id = job['chat_id'], job['message_id']
+
+    async def edit_progress(text: str, priority: int = BULK, **kwargs):
+        # Промежуточные правки — фоновые, финальная — интерактивная; ждущие правки склеиваются
+        return await outbox.submit(
+            chat_id,
+            partial(bot.edit_message_text, text, chat_id=chat_id, message_id=message_id, **kwargs),
+            priority=priority,
+            coalesce_key=(chat_id, message_id),
+        )
+
+    # Получаем все ответы (из кэша сессии, без обращения к БД)
+    answers = await sessions.get_answers(user_id, conversation_id)
 
-    # Получаем все ответы из БД
-    answers = db.get_conversation_answers(conversation_id)
+    progress = ProgressiveMessage(
+        edit_progress,
+        min_interval=float(os.getenv('STREAM_EDIT_INTERVAL', '1.5')),
+    )
+
+    async def on_queued(position: int):
+        await edit_progress(queue_text(position), priority=INTERACTIVE)
+
+    # Если генерация уже запущена заранее и бюджет совпал — берем готовый результат.
+    # Спекуляция живёт в памяти процесса; в режиме супервизора задача выполняется
+    # тем же воркером, что получает апдейты пользователя (WORKER_SHARD)
+    scenarios_text = None
+    if speculative:
+        budget_answer = next(
+            (a['answer'] for a in answers
+             if a['question_number'] == ai_agent.get_total_questions()),
+            ''
+        )
+        scenarios_text = await speculative.resolve(conversation_id, budget_answer)
 
     # Генерируем сценарии через Claude API
-    try:
-        scenarios_text = ai_agent.generate_scenarios(answers)
+    if scenarios_text is None:
+        async for delta in ai_agent.stream_scenarios(answers, on_queued=on_queued,
+                                                     conversation_id=conversation_id):
+            progress.append(delta)
 
-        # Сохраняем сценарии в БД
-        db.save_scenarios(conversation_id, [{"text": scenarios_text}])
-        db.complete_conversation(conversation_id)
+        scenarios_text = progress.text
 
-        # Отправляем результат пользователю
-        result_message = f"""
+    # Сохраняем сценарии в БД (повторная задача того же диалога ничего не перезапишет)
+    if not await db.save_scenarios(conversation_id, [{"text": scenarios_text}]):
+        logger.info(f"Сценарии диалога {conversation_id} уже сохранены ранее")
+    await db.complete_conversation(conversation_id)
+    sessions.finish(user_id, conversation_id)
+
+    # Отправляем результат пользователю
+    result_message = f"""
 🎯 *Анализ завершен! Вот твои персональные сценарии внедрения:*
 
 {scenarios_text}
@@ -496,87 +483,127 @@ async def generate_scenarios(update: Update, context: ContextTypes.DEFAULT_TYPE)
 • [WhatsApp](https://wa.me/972586305753)
 """
 
-        keyboard = [
-            [InlineKeyboardButton("✍️ Написать Сергею", url='https://t.me/sergeyzisman')],
-            [InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    keyboard = [
+        [InlineKeyboardButton("✍️ Написать Сергею", url='https://t.me/sergeyzisman')],
+        [InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await query.edit_message_text(
-            result_message,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup,
-            disable_web_page_preview=True
-        )
+    result_kwargs = dict(
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=reply_markup,
+        disable_web_page_preview=True
+    )
+    try:
+        await progress.finish(result_message, priority=INTERACTIVE, **result_kwargs)
+    except BadRequest as e:
+        # Исходное сообщение могло пропасть (например, задача восстановлена после рестарта)
+        logger.warning(f"Не удалось обновить сообщение, отправляем новое: {e}")
+        await outbox.submit(chat_id, partial(bot.send_message, chat_id, result_message, **result_kwargs))
 
-    except Exception as e:
-        logger.error(f"Ошибка при генерации сценариев: {e}")
-        await query.edit_message_text(
-            "❌ Произошла ошибка при генерации сценариев. Попробуй позже или свяжись напрямую с Сергеем.",
-            parse_mode=ParseMode.MARKDOWN
-        )
 
-    return ConversationHandler.END
+async def generation_job_failed(bot: Bot, job: Dict, error: Exception):
+    """Сообщить пользователю, что генерация не удалась после всех попыток"""
+    logger.error(f"Ошибка при генерации сценариев: {error}")
+    chat_id, message_id = job['chat_id'], job['message_id']
+    try:
+        await outbox.submit(
+            chat_id,
+            partial(bot.edit_message_text, ERROR_TEXT, chat_id=chat_id, message_id=message_id,
+                    parse_mode=ParseMode.MARKDOWN),
+            coalesce_key=(chat_id, message_id),
+        )
+    except BadRequest:
+        await outbox.submit(chat_id, partial(bot.send_message, chat_id, ERROR_TEXT,
+                                             parse_mode=ParseMode.MARKDOWN))
 
 
-async def generate_scenarios_from_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Генерация сценариев (вызов из обработчика сообщений)"""
+async def enqueue_generation(message: Message, update: Update,
+                             context: ContextTypes.DEFAULT_TYPE):
+    """
+    Поставить генерацию сценариев в очередь; результат придет правкой сообщения.
+    Двойное нажатие или повторная отправка ответа не создают вторую задачу
+    """
     conversation_id = context.user_data.get('conversation_id')
-
-    # Получаем все ответы из БД
-    answers = db.get_conversation_answers(conversation_id)
-
-    # Генерируем сценарии через Claude API
+    user_id = update.effective_user.id
     try:
-        scenarios_text = ai_agent.generate_scenarios(answers)
-
-        # Сохраняем сценарии в БД
-        db.save_scenarios(conversation_id, [{"text": scenarios_text}])
-        db.complete_conversation(conversation_id)
+        answers = await sessions.get_answers(user_id, conversation_id)
+        job_id, created = await generation_workers.enqueue(
+            conversation_id=conversation_id,
+            user_id=user_id,
+            chat_id=message.chat_id,
+            message_id=message.message_id,
+            answers_hash=answers_hash(answers),
+        )
+    except Exception as e:
+        logger.error(f"Не удалось поставить генерацию в очередь: {e}")
+        await outbox.submit(
+            message.chat_id,
+            partial(message.edit_text, ERROR_TEXT, parse_mode=ParseMode.MARKDOWN),
+            coalesce_key=(message.chat_id, message.message_id),
+        )
+        return ConversationHandler.END
+
+    if not created:
+        logger.info(f"Генерация для диалога {conversation_id} уже в очереди, повтор пропущен")
+        await outbox.submit(
+            message.chat_id,
+            partial(message.edit_text, DUPLICATE_TEXT),
+            coalesce_key=(message.chat_id, message.message_id),
+        )
+        return ConversationHandler.END
 
-        # Отправляем результат пользователю
-        result_message = f"""
-🎯 *Анализ завершен! Вот твои персональные сценарии внедрения:*
+    # Все воркеры заняты: показываем место в очереди задач, а не ждём молча
+    try:
+        position = await generation_workers.queue_position(job_id)
+    except Exception as e:
+        logger.warning(f"Не удалось узнать место задачи {job_id} в очереди: {e}")
+        position = 0
+    if position:
+        await outbox.submit(
+            message.chat_id,
+            partial(message.edit_text, queue_text(position)),
+            coalesce_key=(message.chat_id, message.message_id),
+        )
 
-{scenarios_text}
+    return ConversationHandler.END
 
-─────────────────
 
-💬 *Что дальше?*
+@track_handler()
+@traced()
+async def generate_scenarios(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Генерация сценариев внедрения через Claude API"""
+    query = update.callback_query
 
-Если хочешь обсудить детали внедрения — пиши Сергею напрямую:
-• [Telegram](https://t.me/sergeyzisman)
-• [WhatsApp](https://wa.me/972586305753)
-"""
+    await edit(update, "⏳ Анализирую данные и готовлю сценарии...")
 
-        keyboard = [
-            [InlineKeyboardButton("✍️ Написать Сергею", url='https://t.me/sergeyzisman')],
-            [InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    return await enqueue_generation(query.message, update, context)
 
-        await update.message.reply_text(
-            result_message,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup,
-            disable_web_page_preview=True
-        )
 
-    except Exception as e:
-        logger.error(f"Ошибка при генерации сценариев: {e}")
-        await update.message.reply_text(
-            "❌ Произошла ошибка при генерации сценариев. Попробуй позже или свяжись напрямую с Сергеем.",
-            parse_mode=ParseMode.MARKDOWN
-        )
+@track_handler()
+@traced()
+async def generate_scenarios_from_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Генерация сценариев (вызов из обработчика сообщений)"""
+    message = await reply(
+        update,
+        "✅ *Отлично! Все ответы получены.*\n\n⏳ Анализирую данные и готовлю сценарии...",
+        parse_mode=ParseMode.MARKDOWN
+    )
 
-    return ConversationHandler.END
+    return await enqueue_generation(message, update, context)
 
 
+@track_handler()
+@traced()
 async def cancel_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена диалога"""
     query = update.callback_query
     await query.answer()
 
+    sessions.finish(update.effective_user.id)
+    if speculative:
+        speculative.cancel(context.user_data.get('conversation_id'))
+
     cancel_text = """
 ❌ *Диалог отменен*
 
@@ -588,7 +615,8 @@ async def cancel_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [[InlineKeyboardButton("◀️ Вернуться в меню", callback_data='menu')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await query.edit_message_text(
+    await edit(
+        update,
         cancel_text,
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=reply_markup
@@ -601,72 +629,174 @@ async def cancel_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий на inline-кнопки"""
     query = update.callback_query
-    await query.answer()
+    # Маршрутизация по callback_data через словарь CALLBACK_HANDLERS
+    handler = CALLBACK_HANDLERS.get(query.data)
+    route = query.data if handler else 'unknown'
+
+    with HANDLER_SECONDS.time(handler=f'button_callback:{route}'), \
+            tracer.span('button_callback', route=route, update_id=update.update_id,
+                        user_id=update.effective_user.id if update.effective_user else None):
+        await query.answer()
 
-    # Маршрутизация по callback_data
-    if query.data == 'menu':
-        await start_callback(update, context)
-    elif query.data == 'about':
-        await about(update, context)
-    elif query.data == 'programs':
-        await programs(update, context)
-    elif query.data == 'programs_2':
-        await programs_page_2(update, context)
-    elif query.data == 'contact':
-        await contact(update, context)
-    elif query.data == 'cases':
-        await cases(update, context)
-    elif query.data == 'consultation':
-        await consultation(update, context)
-    elif query.data == 'start_ai_dialog':
-        return await start_ai_dialog(update, context)
-    elif query.data == 'ask_first_question':
-        return await ask_question(update, context)
-    elif query.data == 'cancel_dialog':
-        return await cancel_dialog(update, context)
+        if handler:
+            return await handler(update, context)
 
 
+@track_handler()
+@traced()
 async def start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Возврат в главное меню через callback"""
-    user = update.effective_user
+    await show_screen(update, 'menu')
+
+
+# Обработчики кнопок по callback_data
+CALLBACK_HANDLERS = {
+    'menu': start_callback,
+    'about': about,
+    'programs': programs,
+    'programs_2': programs_page_2,
+    'contact': contact,
+    'cases': cases,
+    'consultation': consultation,
+    'start_ai_dialog': start_ai_dialog,
+    'ask_first_question': ask_question,
+    'cancel_dialog': cancel_dialog,
+}
+
+
+# ==================== ОГРАНИЧЕНИЕ ЧАСТОТЫ ====================
+FLOOD_TEXT = "⏳ Слишком много запросов. Подожди немного и попробуй снова."
+GENERATION_FLOOD_TEXT = (
+    "⏳ Ты уже несколько раз запускал подбор сценариев. "
+    "Попробуй позже или напиши Сергею напрямую: @sergeyzisman"
+)
 
-    welcome_text = f"""
-🤖 *Привет, {user.first_name}!*
 
-Я AI-агент *Сергея Зисмана* — эксперта по внедрению AI-решений и автоматизации для B2B-бизнеса.
+async def flood_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Проверка лимитов до всех обработчиков. Каждый апдейт тратит токен меню,
+    запуск AI-диалога (который заканчивается генерацией) — ещё и токен генерации.
+    Отклонённый апдейт дальше не обрабатывается
+    """
+    user = update.effective_user
+    if user is None:
+        return
 
-Здесь ты можешь:
-• Узнать о Сергее и его подходе
-• Изучить программы и услуги
-• Получить контакты для связи
-• Записаться на консультацию
-• Пройти диалог с AI-агентом для подбора сценария
+    query = update.callback_query
+    if not menu_limiter.allow(user.id):
+        budget, text = 'menu', FLOOD_TEXT
+    elif query and query.data == 'start_ai_dialog' and not generation_limiter.allow(user.id):
+        budget, text = 'generation', GENERATION_FLOOD_TEXT
+    else:
+        return
 
-_Выбери интересующий раздел из меню ниже_ 👇
-"""
+    FLOOD_REJECTED.inc(budget=budget)
+    logger.warning(f"Отклонён апдейт пользователя {user.id}: исчерпан лимит {budget}")
 
-    keyboard = [
-        [InlineKeyboardButton("👤 О Сергее", callback_data='about')],
-        [InlineKeyboardButton("📋 Программы и услуги", callback_data='programs')],
-        [InlineKeyboardButton("📞 Контакты", callback_data='contact')],
-        [InlineKeyboardButton("💼 Кейсы", callback_data='cases')],
-        [InlineKeyboardButton("📅 Записаться на консультацию", callback_data='consultation')],
-        [InlineKeyboardButton("🤖 Диалог с AI-агентом", callback_data='start_ai_dialog')],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if query:
+        # Ответ на callback не расходует лимиты отправки и убирает «часики» на кнопке
+        try:
+            await query.answer(text, show_alert=budget == 'generation')
+        except BadRequest:
+            pass
+    # На сообщения сверх лимита не отвечаем, чтобы не тратить лимит чата
+    raise ApplicationHandlerStop
 
-    await update.callback_query.edit_message_text(
-        welcome_text,
-        parse_mode=ParseMode.MARKDOWN,
-        reply_markup=reply_markup
+
+# ==================== ГЛАВНАЯ ФУНКЦИЯ ====================
+async def post_init(application: Application):
+    """Запуск фоновых воркеров и эндпоинта метрик после инициализации бота"""
+    outbox.start()
+    await generation_workers.start(
+        partial(process_generation_job, application.bot),
+        on_failed=partial(generation_job_failed, application.bot),
     )
 
+    DB_PENDING.set_function(lambda: db.pending)
+    GENERATIONS_IN_FLIGHT.set_function(lambda: ai_agent.in_flight)
+    GENERATIONS_WAITING.set_function(lambda: ai_agent.waiting)
+    UPDATE_QUEUE_DEPTH.set_function(application.update_queue.qsize)
+    FLOOD_TRACKED_USERS.set_function(lambda: len(menu_limiter), budget='menu')
+    FLOOD_TRACKED_USERS.set_function(lambda: len(generation_limiter), budget='generation')
+    if hedge_policy:
+        HEDGE_DEADLINE_SECONDS.set_function(hedge_policy.deadline)
+
+    if scenario_cache:
+        application.bot_data['cache_purger'] = asyncio.create_task(
+            scenario_cache.purge_expired(float(os.getenv('SCENARIO_CACHE_PURGE_INTERVAL', '3600')))
+        )
+
+    if speculative:
+        # Без этого брошенные спекуляции чистились бы только при запуске новой
+        application.bot_data['speculation_sweeper'] = asyncio.create_task(
+            speculative.sweep_expired(float(os.getenv('SPECULATIVE_SWEEP_INTERVAL', '60')))
+        )
 
-# ==================== ГЛАВНАЯ ФУНКЦИЯ ====================
-def main():
-    """Запуск бота"""
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    reload_interval = float(os.getenv('CONTENT_RELOAD_INTERVAL', '2'))
+    if reload_interval > 0:
+        application.bot_data['content_watcher'] = asyncio.create_task(content.watch(reload_interval))
+
+    tracer.configure(
+        sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', '0')),
+        path=os.getenv('TRACE_FILE', 'traces.jsonl'),
+    )
+
+    metrics_port = int(os.getenv('METRICS_PORT', '0'))
+    if metrics_port:
+        server = MetricsServer(metrics_port, host=os.getenv('METRICS_HOST', '127.0.0.1'))
+        server.start()
+        application.bot_data['metrics_server'] = server
+
+
+async def post_shutdown(application: Application):
+    """Освобождение ресурсов при остановке бота"""
+    for name in ('content_watcher', 'cache_purger', 'speculation_sweeper'):
+        task = application.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+    server = application.bot_data.pop('metrics_server', None)
+    if server:
+        server.stop()
+    await generation_workers.stop()
+    await outbox.stop()
+    await db.wait_background()
+    try:
+        # Ошибка записи остатка очереди пробрасывается: процесс завершится с ошибкой
+        db.shutdown()
+    finally:
+        tracer.close()
+
+
+def build_application(polling: bool = True) -> Application:
+    """Создать приложение со всеми обработчиками; polling=False — без Updater (вебхук, воркер)"""
+    # Разные пользователи обрабатываются параллельно, апдейты одного — по порядку:
+    # иначе два быстрых ответа прочитают один и тот же текущий вопрос
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(UserOrderedUpdateProcessor(int(os.getenv('CONCURRENT_UPDATES', '64'))))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if os.getenv('PERSISTENCE', '1') == '1':
+        # Состояние анкеты переживает перезапуск: пользователь продолжит с текущего вопроса
+        builder = builder.persistence(SQLitePersistence(
+            db, update_interval=float(os.getenv('PERSISTENCE_INTERVAL', '5')),
+            max_loaded=int(os.getenv('PERSISTENCE_LOADED_USERS', '10000')),
+        ))
+    api_url = os.getenv('TELEGRAM_API_URL')
+    if api_url:
+        # Свой сервер Bot API: локальный telegram-bot-api или заглушка нагрузочного теста
+        api_url = api_url.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    if not polling:
+        # Апдейты приходят не через long polling, Updater не нужен
+        builder = builder.updater(None)
+    application = builder.build()
+
+    if FLOOD_CONTROL:
+        # Группа -1 проверяется раньше всех обработчиков
+        application.add_handler(TypeHandler(Update, flood_control), group=-1)
 
     # Создаем ConversationHandler для AI-диалога
     ai_dialog_handler = ConversationHandler(
@@ -685,6 +815,8 @@ def main():
             CommandHandler('start', start),
         ],
         allow_reentry=True,
+        name='ai_dialog',
+        persistent=os.getenv('PERSISTENCE', '1') == '1',
     )
 
     # Регистрируем ConversationHandler
@@ -701,9 +833,31 @@ def main():
     # Регистрируем обработчик кнопок (должен быть после ConversationHandler)
     application.add_handler(CallbackQueryHandler(button_callback))
 
+    return application
+
+
+def main():
+    """Запуск бота"""
+    # Режим приема апдейтов: polling (по умолчанию) или webhook
+    mode = os.getenv('BOT_MODE', 'polling')
+    application = build_application(polling=mode != 'webhook')
+
     # Запускаем бота
-    logger.info("Бот запущен!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if mode == 'webhook':
+        logger.info("Бот запущен в режиме вебхука!")
+        asyncio.run(run_webhook(
+            application,
+            listen=os.getenv('WEBHOOK_LISTEN', '127.0.0.1'),
+            port=int(os.getenv('WEBHOOK_PORT', '8443')),
+            url_path=os.getenv('WEBHOOK_PATH', '/telegram'),
+            secret_token=os.getenv('WEBHOOK_SECRET') or None,
+            webhook_url=os.getenv('WEBHOOK_URL') or None,
+            max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40')),
+            allowed_updates=Update.ALL_TYPES,
+        ))
+    else:
+        logger.info("Бот запущен!")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,106 @@
+"""
+Реестр экранов меню: тексты и кнопки загружаются из content.json,
+собираются один раз в готовые к отправке объекты и перечитываются
+при изменении файла без перезапуска бота
+"""
+
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Optional, Dict, Mapping
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+# Подстановка имени пользователя в тексте экрана
+FIRST_NAME = '{first_name}'
+
+
+@dataclass(frozen=True)
+class Screen:
+    """Готовый экран: текст, клавиатура и параметры отправки"""
+    name: str
+    text: str
+    reply_markup: InlineKeyboardMarkup
+    disable_web_page_preview: bool = False
+    personalized: bool = False
+
+    def render(self, first_name: Optional[str] = None) -> str:
+        """Текст экрана; имя подставляется только в персональные экраны"""
+        if not self.personalized:
+            return self.text
+        return self.text.replace(FIRST_NAME, first_name or '')
+
+
+def _build_screen(name: str, data: Dict) -> Screen:
+    keyboard = tuple(
+        tuple(InlineKeyboardButton(**button) for button in row)
+        for row in data.get('buttons', [])
+    )
+    return Screen(
+        name=name,
+        text=data['text'],
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        disable_web_page_preview=data.get('disable_web_page_preview', False),
+        personalized=FIRST_NAME in data['text'],
+    )
+
+
+def load_screens(path: str) -> Mapping[str, Screen]:
+    """Прочитать файл контента и собрать все экраны"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    return MappingProxyType({
+        name: _build_screen(name, screen) for name, screen in data['screens'].items()
+    })
+
+
+class ContentRegistry:
+    """Экраны меню с перезагрузкой при изменении файла"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = os.stat(path).st_mtime_ns
+        self.screens = load_screens(path)
+        self.reloads = 0
+
+    def __getitem__(self, name: str) -> Screen:
+        return self.screens[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.screens
+
+    def reload_if_changed(self) -> bool:
+        """Перечитать файл, если он изменился; при ошибке остаётся прежний контент"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logger.warning(f"Файл контента недоступен: {e}")
+            return False
+
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+
+        try:
+            screens = load_screens(self.path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Не удалось перечитать {self.path}, оставляем прежний контент: {e}")
+            return False
+
+        # Замена одной ссылкой: обработчики видят либо старый, либо новый набор целиком
+        self.screens = screens
+        self.reloads += 1
+        logger.info(f"Контент перечитан из {self.path}: экранов {len(screens)}")
+        return True
+
+    async def watch(self, interval: float = 2.0):
+        """Проверять файл раз в interval секунд"""
+        while True:
+            await asyncio.sleep(interval)
+            self.reload_if_changed()
@@ -1,193 +1,1074 @@
 import sqlite3
 import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Iterator, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Долгоживущие соединения с SQLite: одно на запись и пул на чтение"""
+
+    def __init__(self, db_path: str, readers: int = 4, wal: bool = True,
+                 synchronous: str = "NORMAL", mmap_size: int = 64 * 1024 * 1024,
+                 cache_size_kb: int = 8192, cached_statements: int = 128,
+                 busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.wal = wal
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+        self.busy_timeout_ms = busy_timeout_ms
+
+        # Писатель один: SQLite всё равно сериализует запись
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+
+        # In-memory база видна только своему соединению, поэтому читаем через писателя
+        self._shared = db_path == ":memory:" or readers <= 0
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        if not self._shared:
+            for _ in range(readers):
+                self._readers.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть соединение и применить настройки производительности"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        if self.wal and self.db_path != ":memory:":
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        # Отрицательное значение cache_size задаёт размер кэша в килобайтах
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Соединение для записи; транзакция фиксируется при выходе из блока"""
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Соединение для чтения из пула"""
+        if self._shared:
+            with self._write_lock:
+                yield self._writer
+            return
+
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            # Завершаем неявную транзакцию чтения, чтобы не держать старый снимок WAL
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def close(self):
+        """Закрыть все соединения"""
+        with self._write_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+
+def is_transient(error: BaseException) -> bool:
+    """Ошибка, которая пройдёт сама: база занята другим соединением или процессом"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class WriteBehindQueue:
+    """Отложенная запись: копит мелкие INSERT/UPDATE и фиксирует их одной транзакцией"""
+
+    def __init__(self, write_batch: Callable[[List[Tuple[str, tuple]]], None],
+                 interval_ms: float = 50.0, max_rows: int = 100,
+                 retry_base: float = 0.1, retry_max: float = 5.0, dead_letter_size: int = 1000):
+        self.write_batch = write_batch
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+
+        self._pending: List[Tuple[str, tuple]] = []
+        # Операции, которые не записать никогда (нарушение ограничения, ошибка в SQL):
+        # (sql, параметры, текст ошибки), последние dead_letter_size штук
+        self.dead_letters: "deque[Tuple[str, tuple, str]]" = deque(maxlen=dead_letter_size)
+        self._cond = threading.Condition()
+        # Пачки пишутся строго по очереди, чтобы сохранить порядок операций
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self.failures = 0
+
+        self._thread = threading.Thread(target=self._run, name='db-write-behind', daemon=True)
+        self._thread.start()
+
+    def put(self, sql: str, params: tuple):
+        """Поставить операцию в очередь на запись"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Очередь записи уже закрыта")
+            self._pending.append((sql, params))
+            self._cond.notify()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self):
+        """
+        Синхронно записать всё, что накопилось к этому моменту.
+        При временной ошибке (база занята) пачка возвращается в начало очереди, а ошибка
+        пробрасывается. При постоянной пачка пишется по одной операции: плохие уходят
+        в dead_letters, остальные записываются
+        """
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                if is_transient(e):
+                    self._requeue(batch)
+                    raise
+                self._write_one_by_one(batch)
+            except BaseException:
+                self._requeue(batch)
+                raise
+
+    def _requeue(self, batch: List[Tuple[str, tuple]]):
+        with self._cond:
+            # Порядок сохраняется: неудавшаяся пачка идёт раньше новых операций
+            self._pending[:0] = batch
+
+    def _write_one_by_one(self, batch: List[Tuple[str, tuple]]):
+        """Найти в пачке операции, которые не записать никогда, и записать остальные"""
+        for index, operation in enumerate(batch):
+            try:
+                self.write_batch([operation])
+            except Exception as e:
+                if is_transient(e):
+                    self._requeue(batch[index:])
+                    raise
+                sql, params = operation
+                self.dead_letters.append((sql, params, str(e)))
+                logger.error(f"Отложенная запись отброшена: {e}; {' '.join(sql.split())} {params!r}")
+
+    def _run(self):
+        """Фоновый поток: сбрасывает очередь раз в interval или при наборе max_rows"""
+        while True:
+            with self._cond:
+                if not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Даём пачке набраться, если она ещё не заполнена
+                deadline = time.monotonic() + self.interval
+                while len(self._pending) < self.max_rows and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+            try:
+                self.flush()
+                self.failures = 0
+            except Exception as e:
+                self.failures += 1
+                delay = min(self.retry_max, self.retry_base * (2 ** (self.failures - 1)))
+                logger.error(f"Ошибка отложенной записи в БД (попытка {self.failures}, "
+                             f"повтор через {delay:.1f} с, в очереди {len(self)}): {e}")
+                with self._cond:
+                    # Ждём перед повтором, но close() прерывает ожидание
+                    if not self._closed:
+                        self._cond.wait(delay)
+
+    def close(self):
+        """Остановить фоновый поток и записать остаток очереди; ошибку записи пробрасывает"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+
+
+# ==================== МИГРАЦИИ СХЕМЫ ====================
+# Версия схемы хранится в PRAGMA user_version. Новые миграции добавляются
+# только в конец списка, уже применённые никогда не меняются.
+
+def _migrate_base_tables(conn: sqlite3.Connection):
+    """Создание таблиц"""
+    cursor = conn.cursor()
+
+    # Таблица для хранения пользователей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица для хранения диалогов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            status TEXT DEFAULT 'in_progress',
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Таблица для хранения ответов на вопросы
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER,
+            question_number INTEGER,
+            question_text TEXT,
+            answer TEXT,
+            answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+        )
+    ''')
+
+    # Таблица для хранения сгенерированных сценариев
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scenarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER,
+            scenarios_json TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+        )
+    ''')
+
+
+def _migrate_hot_query_indexes(conn: sqlite3.Connection):
+    """Индексы под частые запросы бота"""
+    # get_active_conversation: фильтр по user_id и status, сортировка по started_at
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_conversations_user_status_started
+        ON conversations (user_id, status, started_at)
+    ''')
+
+    # get_user_conversations: покрывающий индекс, таблица не читается вовсе
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_conversations_user_started
+        ON conversations (user_id, started_at, status, completed_at)
+    ''')
+
+    # get_conversation_answers: ответы диалога сразу в порядке вопросов
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_answers_conversation_question
+        ON conversation_answers (conversation_id, question_number)
+    ''')
+
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scenarios_conversation
+        ON scenarios (conversation_id)
+    ''')
+
+
+def _migrate_scenario_cache(conn: sqlite3.Connection):
+    """Кэш ответов Claude по нормализованным ответам клиента"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scenario_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT,
+            prompt_version TEXT,
+            response TEXT,
+            created_at REAL,
+            last_used_at REAL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Вытеснение самых давно использованных записей
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scenario_cache_last_used
+        ON scenario_cache (last_used_at)
+    ''')
+
+
+def _migrate_generation_jobs(conn: sqlite3.Connection):
+    """Очередь задач на генерацию сценариев с арендой (lease) задач воркерами"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER,
+            user_id INTEGER,
+            chat_id INTEGER,
+            message_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            lease_owner TEXT,
+            lease_until REAL,
+            last_error TEXT,
+            created_at REAL,
+            updated_at REAL,
+            FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+        )
+    ''')
+
+    # Поиск следующей задачи: по статусу, затем по истечению аренды
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_status_lease
+        ON generation_jobs (status, lease_until)
+    ''')
+
+
+def _migrate_llm_calls(conn: sqlite3.Connection):
+    """Журнал вызовов Claude: токены, задержки и исход"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER,
+            model TEXT,
+            input_tokens INTEGER DEFAULT 0,
+            output_tokens INTEGER DEFAULT 0,
+            cache_read_tokens INTEGER DEFAULT 0,
+            cache_write_tokens INTEGER DEFAULT 0,
+            ttft_ms REAL,
+            latency_ms REAL,
+            outcome TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_llm_calls_conversation
+        ON llm_calls (conversation_id)
+    ''')
+
+    # Агрегаты за период: выборка по дате без сканирования всей таблицы
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_llm_calls_created
+        ON llm_calls (created_at)
+    ''')
+
+
+def _migrate_persistence(conn: sqlite3.Connection):
+    """Состояния ConversationHandler и user_data для восстановления после перезапуска"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_states (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (name, key)
+        )
+    ''')
+
+
+def _migrate_generation_dedup(conn: sqlite3.Connection):
+    """Один результат генерации на диалог и поиск задачи по диалогу и ответам"""
+    # Дубликаты от повторных вызовов: оставляем самый ранний результат
+    conn.execute('''
+        DELETE FROM scenarios
+        WHERE id NOT IN (SELECT MIN(id) FROM scenarios GROUP BY conversation_id)
+    ''')
+    conn.execute("DROP INDEX IF EXISTS idx_scenarios_conversation")
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_scenarios_conversation
+        ON scenarios (conversation_id)
+    ''')
+
+    conn.execute("ALTER TABLE generation_jobs ADD COLUMN answers_hash TEXT")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_conversation
+        ON generation_jobs (conversation_id, answers_hash)
+    ''')
+
+
+def _migrate_unique_answers(conn: sqlite3.Connection):
+    """Один ответ на вопрос диалога: повторный ответ (после перезапуска) заменяет прежний"""
+    # Дубликаты прошлых перезапусков: оставляем последний ответ
+    conn.execute('''
+        DELETE FROM conversation_answers
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM conversation_answers GROUP BY conversation_id, question_number
+        )
+    ''')
+    conn.execute("DROP INDEX IF EXISTS idx_answers_conversation_question")
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_answers_conversation_question
+        ON conversation_answers (conversation_id, question_number)
+    ''')
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "базовые таблицы", _migrate_base_tables),
+    (2, "индексы для частых запросов", _migrate_hot_query_indexes),
+    (3, "кэш сгенерированных сценариев", _migrate_scenario_cache),
+    (4, "очередь задач генерации", _migrate_generation_jobs),
+    (5, "журнал вызовов Claude", _migrate_llm_calls),
+    (6, "состояния диалогов и user_data", _migrate_persistence),
+    (7, "защита от повторной генерации", _migrate_generation_dedup),
+    (8, "один ответ на вопрос диалога", _migrate_unique_answers),
+]
+
+
+def _shard_filter(shard: Optional[Tuple[int, int]]) -> Tuple[str, tuple]:
+    """Условие на задачи шарда (номер, всего) для запросов к generation_jobs"""
+    if shard is None:
+        return '', ()
+    index, total = shard
+    return ' AND user_id % ? = ?', (total, index)
+
 
 class Database:
     """Класс для работы с SQLite базой данных"""
 
-    def __init__(self, db_path: str = "bot_data.db"):
+    def __init__(self, db_path: str = "bot_data.db", persistent: bool = True,
+                 pool_size: int = 4, wal: bool = True, synchronous: str = "NORMAL",
+                 mmap_size: int = 64 * 1024 * 1024, cache_size_kb: int = 8192,
+                 cached_statements: int = 128, write_behind: bool = False,
+                 batch_interval_ms: float = 50.0, batch_max_rows: int = 100):
         self.db_path = db_path
-        self.init_database()
+        self._closed = False
 
-    def init_database(self):
-        """Инициализация базы данных и создание таблиц"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Таблица для хранения пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        # persistent=False возвращает старое поведение (соединение на каждый вызов),
+        # что удобно для сравнения в бенчмарках
+        self.pool: Optional[ConnectionPool] = None
+        if persistent:
+            self.pool = ConnectionPool(
+                db_path,
+                readers=pool_size,
+                wal=wal,
+                synchronous=synchronous,
+                mmap_size=mmap_size,
+                cache_size_kb=cache_size_kb,
+                cached_statements=cached_statements,
             )
-        ''')
-
-        # Таблица для хранения диалогов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP,
-                status TEXT DEFAULT 'in_progress',
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-
-        # Таблица для хранения ответов на вопросы
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS conversation_answers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conversation_id INTEGER,
-                question_number INTEGER,
-                question_text TEXT,
-                answer TEXT,
-                answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (conversation_id) REFERENCES conversations (id)
-            )
-        ''')
-
-        # Таблица для хранения сгенерированных сценариев
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS scenarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                conversation_id INTEGER,
-                scenarios_json TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+
+        self.init_database()
+
+        # Отложенная запись ответов и пользователей пачками
+        self.write_behind: Optional[WriteBehindQueue] = None
+        if write_behind:
+            self.write_behind = WriteBehindQueue(
+                self._write_batch,
+                interval_ms=batch_interval_ms,
+                max_rows=batch_max_rows,
             )
-        ''')
 
-        conn.commit()
-        conn.close()
+    @contextmanager
+    def _writer(self) -> Iterator[sqlite3.Connection]:
+        """Соединение для записи"""
+        if self.pool:
+            with self.pool.writer() as conn:
+                yield conn
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Соединение для чтения"""
+        if self.pool:
+            with self.pool.reader() as conn:
+                yield conn
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _write_batch(self, batch: List[Tuple[str, tuple]]):
+        """Записать пачку отложенных операций одной транзакцией"""
+        with self._writer() as conn:
+            for sql, params in batch:
+                conn.execute(sql, params)
+
+    def _write(self, sql: str, params: tuple):
+        """Выполнить запись сразу или поставить её в очередь отложенной записи"""
+        if self.write_behind:
+            self.write_behind.put(sql, params)
+            return
+
+        with self._writer() as conn:
+            conn.execute(sql, params)
+
+    def flush(self):
+        """Барьер: дописать все отложенные операции перед чтением или зависимой записью"""
+        if self.write_behind:
+            self.write_behind.flush()
+
+    def close(self):
+        """Дописать очередь и закрыть соединения с базой"""
+        if self._closed:
+            return
+        self._closed = True
+
+        try:
+            if self.write_behind:
+                # Ошибка записи остатка очереди не глотается: вызывающий узнает о потере данных
+                self.write_behind.close()
+                # Сбрасываем WAL в основной файл, чтобы данные гарантированно легли на диск
+                with self._writer() as conn:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            if self.pool:
+                self.pool.close()
+
+    def init_database(self):
+        """Инициализация базы данных: применение недостающих миграций схемы"""
+        with self._writer() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for target, description, migrate in MIGRATIONS:
+            if target <= version:
+                continue
+
+            with self._writer() as conn:
+                # Каждая миграция — отдельная транзакция вместе с номером версии.
+                # Версию перечитываем под блокировкой: миграции может запускать другой процесс
+                conn.execute("BEGIN IMMEDIATE")
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if target <= version:
+                    conn.execute("COMMIT")
+                    continue
+                migrate(conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+
+            logger.info(f"Применена миграция БД {target}: {description}")
+            version = target
+
+    def explain_query_plan(self, sql: str, params: tuple = ()) -> List[str]:
+        """Получить план выполнения запроса (для проверки использования индексов)"""
+        with self._reader() as conn:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+
+        return [row['detail'] for row in rows]
 
     def add_user(self, user_id: int, username: str = None,
                  first_name: str = None, last_name: str = None):
         """Добавление или обновление пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
+        self._write('''
             INSERT OR REPLACE INTO users (user_id, username, first_name, last_name)
             VALUES (?, ?, ?, ?)
         ''', (user_id, username, first_name, last_name))
 
-        conn.commit()
-        conn.close()
-
     def start_conversation(self, user_id: int) -> int:
         """Начать новый диалог для пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.flush()
 
-        cursor.execute('''
-            INSERT INTO conversations (user_id, status)
-            VALUES (?, 'in_progress')
-        ''', (user_id,))
+        with self._writer() as conn:
+            cursor = conn.execute('''
+                INSERT INTO conversations (user_id, status)
+                VALUES (?, 'in_progress')
+            ''', (user_id,))
 
-        conversation_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            conversation_id = cursor.lastrowid
 
         return conversation_id
 
     def save_answer(self, conversation_id: int, question_number: int,
                     question_text: str, answer: str):
-        """Сохранить ответ на вопрос"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
+        """
+        Сохранить ответ на вопрос. Состояние анкеты сохраняется реже ответов, поэтому
+        после падения пользователь может ответить на вопрос ещё раз — новый ответ заменяет старый
+        """
+        self._write('''
             INSERT INTO conversation_answers
             (conversation_id, question_number, question_text, answer)
             VALUES (?, ?, ?, ?)
+            ON CONFLICT (conversation_id, question_number) DO UPDATE SET
+                question_text = excluded.question_text,
+                answer = excluded.answer,
+                answered_at = CURRENT_TIMESTAMP
         ''', (conversation_id, question_number, question_text, answer))
 
-        conn.commit()
-        conn.close()
-
     def get_conversation_answers(self, conversation_id: int) -> List[Dict]:
         """Получить все ответы для диалога"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT question_number, question_text, answer, answered_at
-            FROM conversation_answers
-            WHERE conversation_id = ?
-            ORDER BY question_number
-        ''', (conversation_id,))
+        self.flush()
 
-        rows = cursor.fetchall()
-        conn.close()
+        with self._reader() as conn:
+            rows = conn.execute('''
+                SELECT question_number, question_text, answer, answered_at
+                FROM conversation_answers
+                WHERE conversation_id = ?
+                ORDER BY question_number
+            ''', (conversation_id,)).fetchall()
 
         return [dict(row) for row in rows]
 
     def complete_conversation(self, conversation_id: int):
         """Завершить диалог"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            UPDATE conversations
-            SET status = 'completed', completed_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (conversation_id,))
+        self.flush()
 
-        conn.commit()
-        conn.close()
-
-    def save_scenarios(self, conversation_id: int, scenarios: List[Dict]):
-        """Сохранить сгенерированные сценарии"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._writer() as conn:
+            conn.execute('''
+                UPDATE conversations
+                SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (conversation_id,))
 
+    def save_scenarios(self, conversation_id: int, scenarios: List[Dict]) -> bool:
+        """
+        Сохранить сгенерированные сценарии. Повторный вызов для того же диалога
+        ничего не меняет; возвращает False, если результат уже был сохранён
+        """
+        self.flush()
         scenarios_json = json.dumps(scenarios, ensure_ascii=False)
 
-        cursor.execute('''
-            INSERT INTO scenarios (conversation_id, scenarios_json)
-            VALUES (?, ?)
-        ''', (conversation_id, scenarios_json))
+        with self._writer() as conn:
+            cursor = conn.execute('''
+                INSERT INTO scenarios (conversation_id, scenarios_json)
+                VALUES (?, ?)
+                ON CONFLICT (conversation_id) DO NOTHING
+            ''', (conversation_id, scenarios_json))
 
-        conn.commit()
-        conn.close()
+        return cursor.rowcount > 0
 
     def get_user_conversations(self, user_id: int) -> List[Dict]:
         """Получить все диалоги пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        self.flush()
 
-        cursor.execute('''
-            SELECT id, started_at, completed_at, status
-            FROM conversations
-            WHERE user_id = ?
-            ORDER BY started_at DESC
-        ''', (user_id,))
-
-        rows = cursor.fetchall()
-        conn.close()
+        with self._reader() as conn:
+            rows = conn.execute('''
+                SELECT id, started_at, completed_at, status
+                FROM conversations
+                WHERE user_id = ?
+                ORDER BY started_at DESC
+            ''', (user_id,)).fetchall()
 
         return [dict(row) for row in rows]
 
     def get_active_conversation(self, user_id: int) -> Optional[int]:
         """Получить активный диалог пользователя (если есть)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.flush()
 
-        cursor.execute('''
-            SELECT id FROM conversations
-            WHERE user_id = ? AND status = 'in_progress'
-            ORDER BY started_at DESC
-            LIMIT 1
-        ''', (user_id,))
-
-        row = cursor.fetchone()
-        conn.close()
+        with self._reader() as conn:
+            row = conn.execute('''
+                SELECT id FROM conversations
+                WHERE user_id = ? AND status = 'in_progress'
+                ORDER BY started_at DESC
+                LIMIT 1
+            ''', (user_id,)).fetchone()
 
         return row[0] if row else None
+
+    def get_cached_response(self, cache_key: str,
+                            max_age_seconds: float) -> Optional[Tuple[str, float]]:
+        """Ответ из кэша сценариев и время его создания, если он не старше max_age_seconds"""
+        now = time.time()
+
+        with self._reader() as conn:
+            row = conn.execute('''
+                SELECT response, created_at FROM scenario_cache
+                WHERE cache_key = ? AND created_at >= ?
+            ''', (cache_key, now - max_age_seconds)).fetchone()
+
+        if not row:
+            return None
+
+        # Отметка об использовании нужна только для вытеснения, её можно записать позже
+        self._write('''
+            UPDATE scenario_cache
+            SET last_used_at = ?, hits = hits + 1
+            WHERE cache_key = ?
+        ''', (now, cache_key))
+
+        return row[0], row[1]
+
+    def put_cached_response(self, cache_key: str, model: str, prompt_version: str,
+                            response: str, max_entries: int):
+        """Сохранить ответ в кэш сценариев и вытеснить лишние записи"""
+        now = time.time()
+        self.flush()
+
+        with self._writer() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO scenario_cache
+                (cache_key, model, prompt_version, response, created_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+            ''', (cache_key, model, prompt_version, response, now, now))
+
+            conn.execute('''
+                DELETE FROM scenario_cache
+                WHERE cache_key IN (
+                    SELECT cache_key FROM scenario_cache
+                    ORDER BY last_used_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (max_entries,))
+
+    def delete_expired_cache(self, max_age_seconds: float) -> int:
+        """Удалить устаревшие записи кэша сценариев"""
+        self.flush()
+
+        with self._writer() as conn:
+            cursor = conn.execute('''
+                DELETE FROM scenario_cache WHERE created_at < ?
+            ''', (time.time() - max_age_seconds,))
+
+        return cursor.rowcount
+
+    def enqueue_generation_job(self, conversation_id: int, user_id: int, chat_id: int,
+                               message_id: int, answers_hash: Optional[str] = None) -> Tuple[int, bool]:
+        """
+        Поставить задачу на генерацию сценариев в очередь. Если для диалога с теми же
+        ответами задача уже есть (не проваленная), новая не создаётся.
+        Возвращает id задачи и признак того, что она создана этим вызовом
+        """
+        now = time.time()
+        self.flush()
+
+        with self._writer() as conn:
+            # Проверка и вставка под одной блокировкой записи: дубль из другого процесса не пройдёт
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute('''
+                SELECT id FROM generation_jobs
+                WHERE conversation_id = ? AND answers_hash IS ? AND status != 'failed'
+                ORDER BY id
+                LIMIT 1
+            ''', (conversation_id, answers_hash)).fetchone()
+
+            if row:
+                return row['id'], False
+
+            cursor = conn.execute('''
+                INSERT INTO generation_jobs
+                (conversation_id, user_id, chat_id, message_id, answers_hash, status,
+                 created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)
+            ''', (conversation_id, user_id, chat_id, message_id, answers_hash, now, now))
+
+            job_id = cursor.lastrowid
+
+        return job_id, True
+
+    def claim_generation_job(self, worker_id: str, lease_seconds: float,
+                             shard: Optional[Tuple[int, int]] = None) -> Optional[Dict]:
+        """
+        Взять в работу следующую задачу: ожидающую или с истекшей арендой.
+        shard=(номер, всего) — только задачи пользователей с user_id % всего == номер
+        """
+        now = time.time()
+        shard_filter, shard_params = _shard_filter(shard)
+        self.flush()
+
+        with self._writer() as conn:
+            # IMMEDIATE сразу берет блокировку записи, чтобы задачу не забрал другой процесс
+            conn.execute("BEGIN IMMEDIATE")
+            # Две ветки вместо OR и явный индекс: иначе планировщик идёт по id
+            # и просматривает всю историю выполненных задач
+            row = conn.execute(f'''
+                SELECT MIN(id) FROM (
+                    SELECT MIN(id) AS id FROM generation_jobs
+                    INDEXED BY idx_generation_jobs_status_lease
+                    WHERE status = 'pending'{shard_filter}
+                    UNION ALL
+                    SELECT MIN(id) FROM generation_jobs
+                    INDEXED BY idx_generation_jobs_status_lease
+                    WHERE status = 'running' AND lease_until < ?{shard_filter}
+                )
+            ''', shard_params + (now,) + shard_params).fetchone()
+
+            if row[0] is None:
+                return None
+
+            conn.execute('''
+                UPDATE generation_jobs
+                SET status = 'running', lease_owner = ?, lease_until = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE id = ?
+            ''', (worker_id, now + lease_seconds, now, row[0]))
+
+            job = conn.execute('''
+                SELECT * FROM generation_jobs WHERE id = ?
+            ''', (row[0],)).fetchone()
+
+        return dict(job)
+
+    def extend_generation_lease(self, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """Продлить аренду задачи; False, если задачу уже забрал другой воркер"""
+        now = time.time()
+
+        with self._writer() as conn:
+            cursor = conn.execute('''
+                UPDATE generation_jobs
+                SET lease_until = ?, updated_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'running'
+            ''', (now + lease_seconds, now, job_id, worker_id))
+
+        return cursor.rowcount > 0
+
+    def complete_generation_job(self, job_id: int, worker_id: str) -> bool:
+        """Отметить задачу выполненной; False, если аренда уже у другого воркера"""
+        self.flush()
+
+        with self._writer() as conn:
+            cursor = conn.execute('''
+                UPDATE generation_jobs
+                SET status = 'done', lease_owner = NULL, lease_until = NULL, updated_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'running'
+            ''', (time.time(), job_id, worker_id))
+
+        return cursor.rowcount > 0
+
+    def fail_generation_job(self, job_id: int, worker_id: str, error: str, retry: bool) -> bool:
+        """
+        Вернуть задачу в очередь для повтора или отметить её проваленной;
+        False, если аренда уже у другого воркера
+        """
+        self.flush()
+
+        with self._writer() as conn:
+            cursor = conn.execute('''
+                UPDATE generation_jobs
+                SET status = ?, last_error = ?, lease_owner = NULL, lease_until = NULL,
+                    updated_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'running'
+            ''', ('pending' if retry else 'failed', error, time.time(), job_id, worker_id))
+
+        return cursor.rowcount > 0
+
+    def get_generation_queue_position(self, job_id: int, shard: Optional[Tuple[int, int]] = None) -> int:
+        """
+        Место ожидающей задачи в очереди (1 — следующая); 0, если задача уже не ждёт.
+        С shard считаются только задачи того же шарда, что и в claim_generation_job
+        """
+        shard_filter, shard_params = _shard_filter(shard)
+        self.flush()
+
+        with self._reader() as conn:
+            job = conn.execute('''
+                SELECT status FROM generation_jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+            if not job or job['status'] != 'pending':
+                return 0
+
+            row = conn.execute(f'''
+                SELECT COUNT(*) FROM generation_jobs
+                INDEXED BY idx_generation_jobs_status_lease
+                WHERE status = 'pending' AND id <= ?{shard_filter}
+            ''', (job_id,) + shard_params).fetchone()
+
+        return row[0]
+
+    def recover_generation_jobs(self, owner_prefix: Optional[str] = None) -> int:
+        """
+        Вернуть в очередь задачи, оставшиеся в работе после остановки процесса.
+        С owner_prefix — только задачи этого владельца (другие процессы живы)
+        """
+        self.flush()
+
+        query = '''
+            UPDATE generation_jobs
+            SET status = 'pending', lease_owner = NULL, lease_until = NULL, updated_at = ?
+            WHERE status = 'running'
+        '''
+        params: tuple = (time.time(),)
+        if owner_prefix is not None:
+            query += " AND lease_owner LIKE ? || '-%'"
+            params += (owner_prefix,)
+
+        with self._writer() as conn:
+            cursor = conn.execute(query, params)
+
+        return cursor.rowcount
+
+    def record_llm_call(self, conversation_id: Optional[int], model: str, outcome: str,
+                        input_tokens: int = 0, output_tokens: int = 0,
+                        cache_read_tokens: int = 0, cache_write_tokens: int = 0,
+                        ttft_ms: Optional[float] = None, latency_ms: Optional[float] = None,
+                        error: Optional[str] = None):
+        """Записать вызов Claude в журнал (через отложенную запись, если она включена)"""
+        self._write('''
+            INSERT INTO llm_calls
+            (conversation_id, model, input_tokens, output_tokens, cache_read_tokens,
+             cache_write_tokens, ttft_ms, latency_ms, outcome, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (conversation_id, model, input_tokens, output_tokens, cache_read_tokens,
+              cache_write_tokens, ttft_ms, latency_ms, outcome, error))
+
+    def get_llm_latency_percentiles(self, days: int = 1,
+                                    percentiles: Tuple[float, ...] = (0.5, 0.95)) -> Dict:
+        """Перцентили задержки и времени до первого токена успешных вызовов за период"""
+        self.flush()
+        since = f'-{int(days)} days'
+        result = {}
+
+        with self._reader() as conn:
+            for column in ('latency_ms', 'ttft_ms'):
+                count = conn.execute(f'''
+                    SELECT COUNT({column}) FROM llm_calls
+                    WHERE created_at >= datetime('now', ?) AND outcome = 'ok'
+                ''', (since,)).fetchone()[0]
+
+                for p in percentiles:
+                    key = f"{column[:-3]}_p{int(p * 100)}"
+                    if not count:
+                        result[key] = None
+                        continue
+
+                    # Ближайший ранг: значение, ниже которого доля p всех вызовов
+                    offset = min(count - 1, max(0, int(round(p * count)) - 1))
+                    row = conn.execute(f'''
+                        SELECT {column} FROM llm_calls
+                        WHERE created_at >= datetime('now', ?) AND outcome = 'ok'
+                          AND {column} IS NOT NULL
+                        ORDER BY {column}
+                        LIMIT 1 OFFSET ?
+                    ''', (since, offset)).fetchone()
+                    result[key] = row[0] if row else None
+
+        return result
+
+    def get_llm_tokens_per_day(self, days: int = 30) -> List[Dict]:
+        """Расход токенов и число вызовов по дням"""
+        self.flush()
+
+        with self._reader() as conn:
+            rows = conn.execute('''
+                SELECT date(created_at) AS day,
+                       COUNT(*) AS calls,
+                       SUM(input_tokens) AS input_tokens,
+                       SUM(output_tokens) AS output_tokens,
+                       SUM(cache_read_tokens) AS cache_read_tokens,
+                       SUM(cache_write_tokens) AS cache_write_tokens
+                FROM llm_calls
+                WHERE created_at >= datetime('now', ?)
+                GROUP BY day
+                ORDER BY day
+            ''', (f'-{int(days)} days',)).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def get_llm_cost_per_completed_lead(self, pricing: Dict[str, Dict[str, float]],
+                                        days: int = 30) -> Optional[float]:
+        """
+        Средняя стоимость вызовов Claude на один завершенный диалог
+
+        Args:
+            pricing: Цены в долларах за миллион токенов по моделям:
+                {model: {'input': ..., 'output': ..., 'cache_read': ..., 'cache_write': ...}}
+            days: Период в днях
+        """
+        self.flush()
+        since = f'-{int(days)} days'
+
+        with self._reader() as conn:
+            usage = conn.execute('''
+                SELECT model,
+                       SUM(input_tokens) AS input,
+                       SUM(output_tokens) AS output,
+                       SUM(cache_read_tokens) AS cache_read,
+                       SUM(cache_write_tokens) AS cache_write
+                FROM llm_calls
+                WHERE created_at >= datetime('now', ?)
+                GROUP BY model
+            ''', (since,)).fetchall()
+
+            completed = conn.execute('''
+                SELECT COUNT(*) FROM conversations
+                WHERE status = 'completed' AND completed_at >= datetime('now', ?)
+            ''', (since,)).fetchone()[0]
+
+        if not completed:
+            return None
+
+        total = 0.0
+        for row in usage:
+            prices = pricing.get(row['model'], {})
+            for kind in ('input', 'output', 'cache_read', 'cache_write'):
+                total += (row[kind] or 0) * prices.get(kind, 0.0) / 1_000_000
+
+        return total / completed
+
+    def get_user_data(self, user_id: int) -> Optional[Dict]:
+        """Сохраненные user_data пользователя"""
+        with self._reader() as conn:
+            row = conn.execute(
+                'SELECT data FROM user_data WHERE user_id = ?', (user_id,)
+            ).fetchone()
+
+        return json.loads(row['data']) if row else None
+
+    def get_conversation_states(self, name: str) -> Dict[tuple, object]:
+        """Состояния ConversationHandler с именем name: ключ диалога → состояние"""
+        with self._reader() as conn:
+            rows = conn.execute(
+                'SELECT key, state FROM conversation_states WHERE name = ?', (name,)
+            ).fetchall()
+
+        return {tuple(json.loads(row['key'])): json.loads(row['state']) for row in rows}
+
+    def save_persistence(self, user_data: Dict[int, Optional[Dict]],
+                         states: Dict[Tuple[str, tuple], object]):
+        """
+        Записать накопленные изменения одной транзакцией.
+        None вместо данных или состояния означает удаление
+        """
+        now = time.time()
+        upsert_users = [(user_id, json.dumps(data, ensure_ascii=False), now)
+                        for user_id, data in user_data.items() if data is not None]
+        delete_users = [(user_id,) for user_id, data in user_data.items() if data is None]
+        upsert_states = [(name, json.dumps(list(key)), json.dumps(state), now)
+                         for (name, key), state in states.items() if state is not None]
+        delete_states = [(name, json.dumps(list(key)))
+                         for (name, key), state in states.items() if state is None]
+
+        with self._writer() as conn:
+            conn.executemany('''
+                INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            ''', upsert_users)
+            conn.executemany('DELETE FROM user_data WHERE user_id = ?', delete_users)
+            conn.executemany('''
+                INSERT INTO conversation_states (name, key, state, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+            ''', upsert_states)
+            conn.executemany('DELETE FROM conversation_states WHERE name = ? AND key = ?', delete_states)
@@ -0,0 +1,173 @@
+"""
+Очередь задач генерации сценариев в SQLite и пул асинхронных воркеров.
+Задачи переживают перезапуск процесса: незавершённые возвращаются в очередь
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from typing import Optional, Dict, List, Tuple, Callable, Awaitable
+
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Обработчик задачи и обработчик окончательной ошибки
+JobHandler = Callable[[Dict], Awaitable[None]]
+JobFailureHandler = Callable[[Dict, Exception], Awaitable[None]]
+
+
+class GenerationWorkerPool:
+    """Пул воркеров, которые забирают задачи из БД с арендой и выполняют их"""
+
+    def __init__(self, db: AsyncDatabase, workers: int = 2, lease_seconds: float = 120.0,
+                 poll_interval: float = 1.0, max_attempts: int = 3,
+                 owner_prefix: Optional[str] = None, shard: Optional[Tuple[int, int]] = None):
+        self.db = db
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+        # Префикс владельца аренды. Постоянный префикс (воркер супервизора) означает,
+        # что процессов несколько: при запуске восстанавливаются только свои задачи
+        self.shared = owner_prefix is not None
+        self.owner_prefix = owner_prefix or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # (номер, всего): процесс берёт задачи только своих пользователей
+        self.shard = shard
+
+        self.handler: Optional[JobHandler] = None
+        self.on_failed: Optional[JobFailureHandler] = None
+
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self.in_progress = 0
+
+    async def start(self, handler: JobHandler, on_failed: Optional[JobFailureHandler] = None,
+                    recover: bool = True):
+        """Запустить воркеры; при recover=True вернуть в очередь прерванные задачи"""
+        self.handler = handler
+        self.on_failed = on_failed
+
+        if recover:
+            recovered = await self.db.recover_generation_jobs(
+                self.owner_prefix if self.shared else None
+            )
+            if recovered:
+                logger.info(f"Возвращено в очередь прерванных задач генерации: {recovered}")
+
+        for number in range(self.workers):
+            worker_id = f"{self.owner_prefix}-{number}"
+            self._tasks.append(asyncio.create_task(self._run(worker_id), name=f"generation-{number}"))
+
+        # Восстановленные задачи нужно разобрать сразу, не дожидаясь нового enqueue
+        self._wakeup.set()
+
+    async def enqueue(self, conversation_id: int, user_id: int, chat_id: int, message_id: int,
+                      answers_hash: Optional[str] = None) -> Tuple[int, bool]:
+        """
+        Поставить задачу в очередь и разбудить воркеры. Повтор для того же диалога
+        и тех же ответов возвращает уже существующую задачу (created=False)
+        """
+        job_id, created = await self.db.enqueue_generation_job(
+            conversation_id, user_id, chat_id, message_id, answers_hash
+        )
+        if created:
+            self._wakeup.set()
+        return job_id, created
+
+    async def queue_position(self, job_id: int) -> int:
+        """Место задачи в очереди; 0 — её возьмёт свободный воркер без ожидания"""
+        if self.in_progress < self.workers:
+            return 0
+        return await self.db.get_generation_queue_position(job_id, self.shard)
+
+    async def _run(self, worker_id: str):
+        """Цикл воркера: взять задачу, выполнить, отчитаться"""
+        while True:
+            # Сбрасываем сигнал до попытки взять задачу, чтобы не пропустить новый enqueue
+            self._wakeup.clear()
+            try:
+                job = await self.db.claim_generation_job(worker_id, self.lease_seconds, self.shard)
+            except Exception as e:
+                logger.error(f"Воркер {worker_id} не смог взять задачу: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._process(worker_id, job)
+            except Exception as e:
+                logger.error(f"Воркер {worker_id} не смог отчитаться по задаче {job['id']}: {e}")
+
+    async def _keep_lease(self, job: Dict, worker_id: str):
+        """Продлевать аренду, пока задача выполняется; завершается, когда аренда потеряна"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                extended = await self.db.extend_generation_lease(job['id'], worker_id, self.lease_seconds)
+            except Exception as e:
+                # Временная ошибка БД: аренда ещё действует, попробуем в следующий раз
+                logger.error(f"Не удалось продлить аренду задачи {job['id']}: {e}")
+                continue
+            if not extended:
+                logger.warning(f"Аренда задачи {job['id']} потеряна воркером {worker_id}")
+                return
+
+    async def _process(self, worker_id: str, job: Dict):
+        """Выполнить задачу с продлением аренды и обработкой ошибок"""
+        self.in_progress += 1
+        work = asyncio.create_task(self.handler(job))
+        lease = asyncio.create_task(self._keep_lease(job, worker_id))
+        try:
+            await asyncio.wait((work, lease), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # Остановка процесса: задача останется в работе и будет восстановлена при запуске
+            work.cancel()
+            raise
+        finally:
+            lease.cancel()
+            self.in_progress -= 1
+
+        if not work.done():
+            # Задачу забрал другой воркер — второй ответ пользователю не нужен
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+            return
+        if work.cancelled():
+            # Обработчик отменён изнутри: задача вернётся в очередь по истечении аренды
+            return
+
+        error = work.exception()
+        if error is None:
+            if not await self.db.complete_generation_job(job['id'], worker_id):
+                logger.warning(f"Задача {job['id']} выполнена, но её аренда уже у другого воркера")
+            return
+
+        retry = job['attempts'] < self.max_attempts
+        logger.error(
+            f"Ошибка задачи генерации {job['id']} (попытка {job['attempts']}): {error}"
+        )
+        if not await self.db.fail_generation_job(job['id'], worker_id, str(error), retry):
+            logger.warning(f"Задача {job['id']} уже у другого воркера, ошибку не записываем")
+            return
+        if retry:
+            self._wakeup.set()
+        elif self.on_failed:
+            try:
+                await self.on_failed(job, error)
+            except Exception as notify_error:
+                logger.error(f"Не удалось сообщить об ошибке задачи {job['id']}: {notify_error}")
+
+    async def stop(self):
+        """Остановить воркеры"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
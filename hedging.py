@@ -0,0 +1,175 @@
+"""
+Хеджирование запросов к Claude: если первый токен не пришёл к сроку,
+параллельно отправляется второй такой же запрос, проигравший отменяется
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional, AsyncIterator, Callable
+
+from metrics import HEDGE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class _StreamError:
+    """Ошибка потока, переданная через очередь"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StreamPump:
+    """Читает асинхронный поток в фоне и складывает фрагменты в очередь"""
+
+    def __init__(self, stream: AsyncIterator[str]):
+        self.queue: "asyncio.Queue" = asyncio.Queue()
+        self.first_item = asyncio.Event()
+        self.started_at = time.monotonic()
+        self.first_item_at: Optional[float] = None
+        # Поток завершился ошибкой, не отдав ни одного фрагмента
+        self.failed = False
+        self.task = asyncio.create_task(self._run(stream))
+
+    async def _run(self, stream: AsyncIterator[str]):
+        try:
+            async for item in stream:
+                self._put(item)
+            self._put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._put(_StreamError(e))
+
+    def _put(self, item):
+        if not self.first_item.is_set():
+            self.first_item_at = time.monotonic()
+            self.failed = isinstance(item, _StreamError)
+            self.first_item.set()
+        self.queue.put_nowait(item)
+
+    def cancel(self):
+        self.task.cancel()
+
+    async def drain(self) -> AsyncIterator[str]:
+        """Отдать фрагменты потока по мере поступления"""
+        while True:
+            item = await self.queue.get()
+            if item is _END:
+                return
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+
+
+class HedgePolicy:
+    """Срок ожидания первого токена по перцентилю и бюджет на дополнительные запросы"""
+
+    def __init__(self, percentile: float = 0.95, min_delay: float = 1.0,
+                 initial_delay: float = 5.0, budget_ratio: float = 0.1,
+                 window: int = 200, min_samples: int = 20):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+
+        # Последние значения времени до первого токена
+        self._ttft = deque(maxlen=window)
+
+        self.requests = 0
+        self.hedges_started = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.skipped_by_budget = 0
+
+    def record_ttft(self, seconds: float):
+        self._ttft.append(seconds)
+
+    def deadline(self) -> float:
+        """Сколько ждать первого токена, прежде чем отправить хедж"""
+        if len(self._ttft) < self.min_samples:
+            return self.initial_delay
+
+        samples = sorted(self._ttft)
+        index = min(len(samples) - 1, int(len(samples) * self.percentile))
+        return max(self.min_delay, samples[index])
+
+    def can_hedge(self) -> bool:
+        """Не превышен ли бюджет: доля хеджей от всех запросов не больше budget_ratio"""
+        return self.hedges_started + 1 <= self.budget_ratio * self.requests
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'hedges_started': self.hedges_started,
+            'hedge_wins': self.hedge_wins,
+            'primary_wins': self.primary_wins,
+            'skipped_by_budget': self.skipped_by_budget,
+            'deadline': self.deadline(),
+        }
+
+
+async def hedged_stream(make_stream: Callable[[], AsyncIterator[str]],
+                        policy: HedgePolicy) -> AsyncIterator[str]:
+    """
+    Поток с хеджированием: make_stream создаёт новый независимый запрос.
+    Побеждает поток, первым отдавший фрагмент; второй отменяется
+    """
+    policy.requests += 1
+    primary = StreamPump(make_stream())
+    hedge: Optional[StreamPump] = None
+    waiters = {asyncio.create_task(primary.first_item.wait()): primary}
+
+    try:
+        done, _ = await asyncio.wait(waiters, timeout=policy.deadline())
+        if not done:
+            if policy.can_hedge():
+                policy.hedges_started += 1
+                HEDGE_REQUESTS.inc(outcome='sent')
+                logger.info(f"Первый токен не пришел за {policy.deadline():.1f} с, отправляем хедж")
+                hedge = StreamPump(make_stream())
+                waiters[asyncio.create_task(hedge.first_item.wait())] = hedge
+            else:
+                policy.skipped_by_budget += 1
+                HEDGE_REQUESTS.inc(outcome='budget_denied')
+
+        done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        winner = waiters[next(iter(done))]
+
+        if hedge is not None:
+            loser = hedge if winner is primary else primary
+
+            # Если победитель сразу упал, а второй может ответить — ждём второй
+            if winner.failed and not loser.failed:
+                await loser.first_item.wait()
+                if not loser.failed:
+                    winner, loser = loser, winner
+
+            loser.cancel()
+            if winner is hedge:
+                policy.hedge_wins += 1
+                HEDGE_REQUESTS.inc(outcome='won')
+            else:
+                policy.primary_wins += 1
+                HEDGE_REQUESTS.inc(outcome='lost')
+            logger.info(
+                f"Хедж {'выиграл' if winner is hedge else 'проиграл'}: "
+                f"хеджей {policy.hedges_started}, побед {policy.hedge_wins}"
+            )
+
+        if not winner.failed:
+            policy.record_ttft(winner.first_item_at - winner.started_at)
+
+        async for item in winner.drain():
+            yield item
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+        primary.cancel()
+        if hedge is not None:
+            hedge.cancel()
@@ -0,0 +1,618 @@
+"""
+Нагрузочный тест бота без сети: синтетические апдейты кладутся прямо в очередь
+Application, а запросы к Telegram и Claude обслуживают локальные заглушки.
+
+Виртуальные пользователи либо ходят по меню, либо проходят анкету из 7 вопросов
+до готовых сценариев. Каждый шаг ждёт ответа бота, время шага — от апдейта
+до запроса бота к Telegram с этим ответом.
+
+    python load_test.py --users 200 --concurrency 50 --dialog-share 0.3
+    python load_test.py --claude-ttft 1.5 --claude-tps 40 --json report.json
+
+Код выхода 1, если доля ошибок больше --max-error-rate
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Optional, Dict, List, Callable
+from urllib.parse import parse_qsl
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.iostream import StreamClosedError
+from tornado.netutil import bind_sockets
+
+logger = logging.getLogger('load_test')
+
+LOAD_TOKEN = '123456:LOAD-TEST'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Load Test', 'username': 'load_test_bot'}
+
+# Кнопки меню, между которыми переходят виртуальные пользователи
+MENU_CALLBACKS = ['menu', 'about', 'programs', 'programs_2', 'contact', 'cases', 'consultation']
+
+WORDS = ('автоматизация заявок клиенты продажи интеграция CRM бот поддержка ответы '
+         'аналитика отчёты менеджер сценарий эффект бюджет внедрение процесс').split()
+
+# Ответ заглушки и что с ним делать: None — ждать дальше, 'ok' или вид ошибки
+Expectation = Callable[[str, str], Optional[str]]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Перцентиль по ближайшему рангу (values отсортированы)"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(len(values) * q) - 1)]
+
+
+class _StubHandler(tornado.web.RequestHandler):
+    """Обработчик обеих заглушек: запрос передаётся методу respond своего сервера"""
+
+    def initialize(self, stub: '_StubServer'):
+        self.stub = stub
+
+    async def post(self, *args):
+        await self.stub.respond(self)
+
+
+class _StubServer(ABC):
+    """Общая часть заглушек: HTTP-сервер tornado на свободном порту"""
+
+    def __init__(self):
+        self.port: Optional[int] = None
+        self._server: Optional[HTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        app = tornado.web.Application([(r'/.*', _StubHandler, {'stub': self})],
+                                      log_function=lambda handler: None)
+        self._server = HTTPServer(app)
+        sockets = bind_sockets(0, '127.0.0.1')
+        self._server.add_sockets(sockets)
+        self.port = sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
+
+    @abstractmethod
+    async def respond(self, handler: tornado.web.RequestHandler):
+        """Ответить на запрос бота"""
+
+
+class FakeTelegram(_StubServer):
+    """
+    Заглушка Bot API: отвечает на запросы бота правдоподобными объектами
+    и раскладывает их по входящим очередям виртуальных пользователей
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._message_ids = itertools.count(1000)
+        self._inboxes: Dict[int, asyncio.Queue] = {}
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    def inbox(self, chat_id: int) -> asyncio.Queue:
+        """Запросы бота к этому чату: (метод, текст, message_id)"""
+        return self._inboxes.setdefault(chat_id, asyncio.Queue())
+
+    def close_inbox(self, chat_id: int):
+        self._inboxes.pop(chat_id, None)
+
+    async def respond(self, handler: tornado.web.RequestHandler):
+        request = handler.request
+        payload = self._handle(request.path, request.headers, request.body)
+        handler.set_header('Content-Type', 'application/json')
+        handler.write(json.dumps(payload))
+
+    def _handle(self, path: str, headers, body: bytes) -> Dict:
+        method = path.rsplit('/', 1)[-1]
+        if headers.get('content-type', '').startswith('application/json'):
+            params = json.loads(body or b'{}')
+        else:
+            params = dict(parse_qsl(body.decode('utf-8')))
+        self.calls[method] += 1
+
+        chat_id = params.get('chat_id')
+        if chat_id is None and 'callback_query_id' in params:
+            # id колбэка виртуального пользователя начинается с номера его чата
+            chat_id = params['callback_query_id'].split(':', 1)[0]
+        text = params.get('text', '')
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method in ('sendMessage', 'editMessageText'):
+            message_id = int(params.get('message_id') or next(self._message_ids))
+            result = {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id), 'type': 'private'},
+                'from': BOT_USER,
+                'text': text,
+            }
+        else:
+            result = True
+
+        if chat_id is not None:
+            inbox = self._inboxes.get(int(chat_id))
+            if inbox is not None:
+                message_id = result['message_id'] if isinstance(result, dict) else None
+                inbox.put_nowait((method, text, message_id))
+
+        return {'ok': True, 'result': result}
+
+
+class FakeClaude(_StubServer):
+    """
+    Заглушка Messages API. Задержка первого токена и скорость выдачи
+    берутся из логнормальных распределений с заданными медианами
+    """
+
+    def __init__(self, ttft: float = 0.8, ttft_sigma: float = 0.3, tokens_per_second: float = 60.0,
+                 tps_sigma: float = 0.2, output_tokens: int = 400, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        super().__init__()
+        self.ttft = ttft
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_second = tokens_per_second
+        self.tps_sigma = tps_sigma
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def respond(self, handler: tornado.web.RequestHandler):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await self._handle(json.loads(handler.request.body), handler)
+        except StreamClosedError:
+            pass
+        finally:
+            self.active -= 1
+
+    async def _handle(self, params: Dict, handler: tornado.web.RequestHandler):
+        self.requests += 1
+
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            error = {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Overloaded'}}
+            handler.set_status(529, 'Overloaded')
+            handler.set_header('Content-Type', 'application/json')
+            handler.write(json.dumps(error))
+            return
+
+        model = params.get('model', 'claude-load-test')
+        prompt = json.dumps(params.get('messages', []), ensure_ascii=False)
+        input_tokens = len(prompt) // 4
+        words = [self.random.choice(WORDS) for _ in range(self.output_tokens)]
+
+        await asyncio.sleep(self.random.lognormvariate(math.log(self.ttft), self.ttft_sigma))
+
+        handler.set_header('Content-Type', 'application/json')
+        if not params.get('stream'):
+            message = self._message(model, input_tokens, self.output_tokens, ' '.join(words))
+            handler.write(json.dumps(message))
+            return
+
+        # Поток событий: tornado отдаёт тело частями (chunked) по мере flush
+        handler.set_header('Content-Type', 'text/event-stream')
+        handler.set_header('Cache-Control', 'no-cache')
+
+        def event(name: str, data: Dict):
+            handler.write(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n")
+
+        event('message_start', {'type': 'message_start',
+                                'message': self._message(model, input_tokens, 1, None)})
+        event('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                      'content_block': {'type': 'text', 'text': ''}})
+
+        tokens_per_second = max(1.0, self.random.lognormvariate(math.log(self.tokens_per_second),
+                                                                self.tps_sigma))
+        chunk = 5
+        for start in range(0, len(words), chunk):
+            text = ' '.join(words[start:start + chunk]) + ' '
+            event('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                          'delta': {'type': 'text_delta', 'text': text}})
+            await handler.flush()
+            await asyncio.sleep(chunk / tokens_per_second)
+
+        event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        event('message_delta', {'type': 'message_delta',
+                                'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                'usage': {'output_tokens': self.output_tokens}})
+        event('message_stop', {'type': 'message_stop'})
+
+    @staticmethod
+    def _message(model: str, input_tokens: int, output_tokens: int, text: Optional[str]) -> Dict:
+        return {
+            'id': f"msg_load_{random.getrandbits(32):08x}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': model,
+            'content': [{'type': 'text', 'text': text}] if text is not None else [],
+            'stop_reason': 'end_turn' if text is not None else None,
+            'stop_sequence': None,
+            'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens},
+        }
+
+
+# ==================== СИНТЕТИЧЕСКИЕ АПДЕЙТЫ ====================
+def _user(user_id: int) -> Dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Dict:
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def callback_update(update_id: int, user_id: int, data: str, message_id: int) -> Dict:
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': f"{user_id}:{update_id}",
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '...',
+            },
+        },
+    }
+
+
+def reply_in(*methods: str) -> Expectation:
+    """Ждать запрос бота одним из методов"""
+    def expect(method: str, text: str) -> Optional[str]:
+        if method == 'answerCallbackQuery' and text:
+            # Ответ на кнопку с текстом — отказ ограничения частоты
+            return 'rejected'
+        return 'ok' if method in methods else None
+    return expect
+
+
+# ==================== НАГРУЗКА ====================
+class LoadTest:
+    """Виртуальные пользователи поверх Application и сбор статистики по шагам"""
+
+    def __init__(self, application, telegram: FakeTelegram, result_marker: str, error_text: str,
+                 menu_clicks: int = 5, think_time: float = 0.5, step_timeout: float = 30.0,
+                 generation_timeout: float = 180.0, seed: Optional[int] = None):
+        self.application = application
+        self.telegram = telegram
+        self.result_marker = result_marker
+        self.error_text = error_text
+        self.menu_clicks = menu_clicks
+        self.think_time = think_time
+        self.step_timeout = step_timeout
+        self.generation_timeout = generation_timeout
+        self.random = random.Random(seed)
+
+        self._update_ids = itertools.count(1)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.updates = 0
+        self.sessions = defaultdict(int)
+
+    def _generation_result(self, method: str, text: str) -> Optional[str]:
+        if method not in ('editMessageText', 'sendMessage'):
+            return None
+        if self.result_marker in text:
+            return 'ok'
+        if text == self.error_text:
+            return 'error'
+        return None
+
+    async def _think(self):
+        if self.think_time > 0:
+            await asyncio.sleep(self.random.expovariate(1 / self.think_time))
+
+    async def _wait(self, name: str, inbox: asyncio.Queue, expect: Expectation,
+                    started: float, timeout: float) -> Optional[int]:
+        """Дождаться ответа бота; возвращает message_id ответа или None при ошибке"""
+        deadline = started + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            try:
+                method, text, message_id = await asyncio.wait_for(inbox.get(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                self.errors[name]['timeout'] += 1
+                return None
+
+            outcome = expect(method, text)
+            if outcome is None:
+                continue
+            if outcome != 'ok':
+                self.errors[name][outcome] += 1
+                return None
+
+            self.latencies[name].append(time.perf_counter() - started)
+            return message_id if message_id is not None else 0
+
+    async def _step(self, name: str, user_id: int, update: Dict, expect: Expectation,
+                    timeout: Optional[float] = None) -> Optional[int]:
+        """Отправить апдейт и дождаться ответа бота"""
+        from telegram import Update
+
+        inbox = self.telegram.inbox(user_id)
+        started = time.perf_counter()
+        self.updates += 1
+        await self.application.update_queue.put(Update.de_json(update, self.application.bot))
+        return await self._wait(name, inbox, expect, started, timeout or self.step_timeout)
+
+    async def menu_session(self, user_id: int):
+        """Пользователь открывает меню и переходит по разделам"""
+        import bot
+
+        message_id = await self._step('start', user_id, message_update(next(self._update_ids), user_id, '/start'),
+                                      reply_in('sendMessage'))
+        for _ in range(self.menu_clicks):
+            if message_id is None:
+                return
+            await self._think()
+            data = self.random.choice(MENU_CALLBACKS)
+            message_id = await self._step(
+                bot.CALLBACK_HANDLERS[data].__name__, user_id,
+                callback_update(next(self._update_ids), user_id, data, message_id),
+                reply_in('editMessageText'),
+            )
+        if message_id is not None:
+            self.sessions['menu'] += 1
+
+    async def dialog_session(self, user_id: int):
+        """Пользователь проходит анкету и ждёт сценарии"""
+        import bot
+
+        message_id = await self._step('start', user_id, message_update(next(self._update_ids), user_id, '/start'),
+                                      reply_in('sendMessage'))
+        for data in ('start_ai_dialog', 'ask_first_question'):
+            if message_id is None:
+                return
+            await self._think()
+            message_id = await self._step(
+                bot.CALLBACK_HANDLERS[data].__name__, user_id,
+                callback_update(next(self._update_ids), user_id, data, message_id),
+                reply_in('editMessageText'),
+            )
+
+        total = bot.ai_agent.get_total_questions()
+        for number in range(1, total + 1):
+            if message_id is None:
+                return
+            await self._think()
+            # Уникальные ответы, чтобы кэш сценариев не подменял генерацию
+            answer = f"{user_id}: " + ' '.join(self.random.choice(WORDS) for _ in range(12))
+            started = time.perf_counter()
+            message_id = await self._step('handle_answer', user_id,
+                                          message_update(next(self._update_ids), user_id, answer),
+                                          reply_in('sendMessage'))
+
+        if message_id is None:
+            return
+        # Генерация: от последнего ответа до готового результата в чате
+        if await self._wait('generation', self.telegram.inbox(user_id), self._generation_result,
+                            started, self.generation_timeout) is not None:
+            self.sessions['dialog'] += 1
+
+    async def run(self, users: int, concurrency: int, dialog_share: float,
+                  first_user_id: int = 10_000) -> float:
+        """Прогнать users пользователей, не больше concurrency одновременно; возвращает время"""
+        slots = asyncio.Semaphore(concurrency)
+
+        async def session(user_id: int, dialog: bool):
+            async with slots:
+                try:
+                    if dialog:
+                        await self.dialog_session(user_id)
+                    else:
+                        await self.menu_session(user_id)
+                finally:
+                    self.telegram.close_inbox(user_id)
+
+        plan = [self.random.random() < dialog_share for _ in range(users)]
+        started = time.perf_counter()
+        await asyncio.gather(*(session(first_user_id + i, dialog) for i, dialog in enumerate(plan)))
+        return time.perf_counter() - started
+
+    def report(self, seconds: float) -> Dict:
+        handlers = {}
+        steps = failures = 0
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[name])
+            errors = dict(self.errors[name])
+            count = len(values) + sum(errors.values())
+            steps += count
+            failures += sum(errors.values())
+            handlers[name] = {
+                'count': count,
+                'errors': errors,
+                'error_rate': round(sum(errors.values()) / count, 4) if count else 0.0,
+                'p50_ms': _ms(percentile(values, 0.50)),
+                'p95_ms': _ms(percentile(values, 0.95)),
+                'p99_ms': _ms(percentile(values, 0.99)),
+                'max_ms': _ms(values[-1] if values else None),
+            }
+
+        return {
+            'seconds': round(seconds, 3),
+            'updates': self.updates,
+            'updates_per_second': round(self.updates / seconds, 1) if seconds else 0.0,
+            'menu_sessions': self.sessions['menu'],
+            'dialogs_completed': self.sessions['dialog'],
+            'dialogs_per_minute': round(self.sessions['dialog'] / seconds * 60, 1) if seconds else 0.0,
+            'steps': steps,
+            'error_rate': round(failures / steps, 4) if steps else 0.0,
+            'handlers': handlers,
+        }
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 1) if value is not None else None
+
+
+def configure_environment(args, telegram: FakeTelegram, claude: FakeClaude, workdir: str):
+    """Настройки бота для прогона: заглушки вместо внешних API, файлы в workdir, без метрик и трейсов"""
+    os.environ.update({
+        'DB_PATH': os.path.join(workdir, 'bot_data.db'),
+        'TRACE_FILE': os.path.join(workdir, 'traces.jsonl'),
+        'TELEGRAM_BOT_TOKEN': LOAD_TOKEN,
+        'TELEGRAM_API_URL': telegram.url,
+        'ANTHROPIC_API_KEY': 'load-test',
+        'ANTHROPIC_BASE_URL': claude.url,
+        'BOT_MODE': 'webhook',
+        'METRICS_PORT': '0',
+        'TRACE_SAMPLE_RATE': '0',
+        'CONTENT_RELOAD_INTERVAL': '0',
+        'FLOOD_CONTROL': '1' if args.flood_control else '0',
+        'SEND_GLOBAL_RATE': str(args.send_rate),
+        'SEND_CHAT_RATE': str(args.chat_rate),
+    })
+
+
+def print_report(report: Dict, bot_stats: Dict):
+    print(f"Длительность: {report['seconds']} с, апдейтов: {report['updates']} "
+          f"({report['updates_per_second']}/с)")
+    print(f"Сессий меню: {report['menu_sessions']}, анкет до сценариев: {report['dialogs_completed']} "
+          f"({report['dialogs_per_minute']}/мин)")
+    print(f"Доля ошибок: {report['error_rate']:.2%}\n")
+
+    header = f"{'обработчик':<24}{'шагов':>8}{'ошибок':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, row in report['handlers'].items():
+        cells = [row[key] if row[key] is not None else '-' for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+        print(f"{name:<24}{row['count']:>8}{sum(row['errors'].values()):>8}"
+              + ''.join(f"{cell:>10}" for cell in cells))
+
+    print()
+    print(json.dumps(bot_stats, ensure_ascii=False, indent=2))
+
+
+async def main(args) -> int:
+    telegram = FakeTelegram()
+    claude = FakeClaude(
+        ttft=args.claude_ttft,
+        ttft_sigma=args.claude_ttft_sigma,
+        tokens_per_second=args.claude_tps,
+        tps_sigma=args.claude_tps_sigma,
+        output_tokens=args.claude_output_tokens,
+        error_rate=args.claude_error_rate,
+        seed=args.seed,
+    )
+    await telegram.start()
+    await claude.start()
+
+    # База и прочие файлы бота — во временном каталоге, который удаляется после прогона
+    with tempfile.TemporaryDirectory(prefix='bot-load-') as workdir:
+        configure_environment(args, telegram, claude, workdir)
+
+        import bot
+        from metrics import HANDLER_ERRORS, FLOOD_REJECTED
+        from webhook import running
+
+        logging.getLogger().setLevel(args.log_level)
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+
+        application = bot.build_application(polling=False)
+        test = LoadTest(
+            application, telegram,
+            result_marker='Анализ завершен',
+            error_text=bot.ERROR_TEXT,
+            menu_clicks=args.menu_clicks,
+            think_time=args.think_time,
+            step_timeout=args.step_timeout,
+            generation_timeout=args.generation_timeout,
+            seed=args.seed,
+        )
+
+        try:
+            async with running(application):
+                seconds = await test.run(args.users, args.concurrency, args.dialog_share)
+                handler_names = set(test.latencies) | set(test.errors) | set(bot.CALLBACK_HANDLERS)
+                bot_stats = {
+                    'handler_exceptions': {
+                        name: HANDLER_ERRORS.value(handler=name) for name in sorted(handler_names)
+                        if HANDLER_ERRORS.value(handler=name)
+                    },
+                    'flood_rejected': {budget: FLOOD_REJECTED.value(budget=budget)
+                                       for budget in ('menu', 'generation')},
+                    'telegram_calls': dict(telegram.calls),
+                    'claude_requests': claude.requests,
+                    'claude_errors': claude.errors,
+                    'claude_max_concurrency': claude.max_active,
+                    'send_scheduler': bot.outbox.stats(),
+                    'hedging': bot.hedge_policy.stats() if bot.hedge_policy else None,
+                }
+        finally:
+            await telegram.stop()
+            await claude.stop()
+
+    report = test.report(seconds)
+    report['bot'] = bot_stats
+    print_report(report, bot_stats)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if report['error_rate'] > args.max_error_rate:
+        print(f"\nДоля ошибок {report['error_rate']:.2%} больше допустимой {args.max_error_rate:.2%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота с заглушками Telegram и Claude')
+    parser.add_argument('--users', type=int, default=100, help='сколько виртуальных пользователей')
+    parser.add_argument('--concurrency', type=int, default=20, help='сколько из них активны одновременно')
+    parser.add_argument('--dialog-share', type=float, default=0.3, help='доля проходящих анкету')
+    parser.add_argument('--menu-clicks', type=int, default=5, help='переходов по меню за сессию')
+    parser.add_argument('--think-time', type=float, default=0.5, help='средняя пауза пользователя, с')
+    parser.add_argument('--step-timeout', type=float, default=30.0)
+    parser.add_argument('--generation-timeout', type=float, default=180.0)
+    parser.add_argument('--claude-ttft', type=float, default=0.8, help='медиана задержки первого токена, с')
+    parser.add_argument('--claude-ttft-sigma', type=float, default=0.3)
+    parser.add_argument('--claude-tps', type=float, default=60.0, help='медиана токенов в секунду')
+    parser.add_argument('--claude-tps-sigma', type=float, default=0.2)
+    parser.add_argument('--claude-output-tokens', type=int, default=400)
+    parser.add_argument('--claude-error-rate', type=float, default=0.0, help='доля ответов 529')
+    parser.add_argument('--send-rate', type=float, default=30.0, help='общий лимит отправки в Telegram, в секунду')
+    parser.add_argument('--chat-rate', type=float, default=1.0, help='лимит отправки в один чат, в секунду')
+    parser.add_argument('--flood-control', action='store_true', help='не отключать ограничение частоты')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', default=None, help='сохранить отчёт в файл')
+    parser.add_argument('--log-level', default='WARNING')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,366 @@
+"""
+Метрики процесса в формате Prometheus: счётчики, gauge и гистограммы
+в памяти и HTTP-эндпоинт /metrics для их сбора
+"""
+
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, List, Tuple, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм по умолчанию (секунды), как в клиентах Prometheus
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Для запросов к Claude нужны границы длиннее
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание, метки и блокировка"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.label_names}, получено {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться функцией в момент сбора"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """Значение берётся из function() при каждом сборе метрик"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        function = self._functions.get(key)
+        return function() if function else self._values.get(key, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                items[key] = function()
+            except Exception as e:
+                logger.debug(f"Не удалось вычислить {self.name}: {e}")
+        for key, value in items.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Для каждого набора меток: счётчики корзин (не накопительные), сумма, количество
+        self._series: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замерить длительность блока в секундах"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(upper)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# Реестр процесса и метрики бота
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    'bot_handler_duration_seconds', 'Время обработки апдейта обработчиком', ('handler',)
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    'bot_handler_errors_total', 'Исключения в обработчиках', ('handler',)
+)
+DB_CALL_SECONDS = REGISTRY.histogram(
+    'bot_db_call_duration_seconds', 'Время вызова метода Database, включая ожидание в пуле', ('method',)
+)
+DB_PENDING = REGISTRY.gauge(
+    'bot_db_pending_calls', 'Вызовы БД в очереди и в работе'
+)
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    'bot_llm_call_duration_seconds', 'Полное время запроса к Claude', ('model', 'outcome'), LLM_BUCKETS
+)
+LLM_TTFT_SECONDS = REGISTRY.histogram(
+    'bot_llm_ttft_seconds', 'Время до первого токена Claude', ('model',), LLM_BUCKETS
+)
+LLM_TOKENS = REGISTRY.counter(
+    'bot_llm_tokens_total', 'Токены Claude по типу', ('model', 'kind')
+)
+GENERATIONS_IN_FLIGHT = REGISTRY.gauge(
+    'bot_generations_in_flight', 'Генерации сценариев, выполняющиеся сейчас'
+)
+GENERATIONS_WAITING = REGISTRY.gauge(
+    'bot_generations_waiting', 'Генерации, ожидающие свободного слота'
+)
+UPDATE_QUEUE_DEPTH = REGISTRY.gauge(
+    'bot_update_queue_depth', 'Апдейты Telegram, ожидающие обработки'
+)
+
+SEND_QUEUE_DEPTH = REGISTRY.gauge(
+    'bot_send_queue_depth', 'Запросы к Telegram в очереди планировщика', ('priority',)
+)
+SEND_WAIT_SECONDS = REGISTRY.histogram(
+    'bot_send_wait_seconds', 'Ожидание запроса к Telegram в очереди планировщика', ('priority',)
+)
+SENDS_TOTAL = REGISTRY.counter(
+    'bot_sends_total', 'Запросы к Telegram через планировщик', ('priority', 'outcome')
+)
+SEND_COALESCED = REGISTRY.counter(
+    'bot_send_coalesced_total', 'Правки сообщений, склеенные с более поздней правкой'
+)
+SEND_RETRY_AFTER = REGISTRY.counter(
+    'bot_send_retry_after_total', 'Ответы 429 (RetryAfter) от Telegram'
+)
+
+SCENARIO_CACHE_LOOKUPS = REGISTRY.counter(
+    'bot_scenario_cache_lookups_total', 'Обращения к кэшу сценариев по результату', ('result',)
+)
+
+HEDGE_REQUESTS = REGISTRY.counter(
+    'bot_hedge_requests_total',
+    'Хеджи запросов к Claude: sent — отправлен, won/lost — ответил первым или нет, '
+    'budget_denied — не отправлен из-за бюджета', ('outcome',)
+)
+HEDGE_DEADLINE_SECONDS = REGISTRY.gauge(
+    'bot_hedge_deadline_seconds', 'Текущий срок ожидания первого токена перед хеджем'
+)
+
+FLOOD_REJECTED = REGISTRY.counter(
+    'bot_flood_rejected_total', 'Апдейты, отброшенные ограничением частоты на пользователя', ('budget',)
+)
+FLOOD_TRACKED_USERS = REGISTRY.gauge(
+    'bot_flood_tracked_users', 'Пользователи с неполным запасом токенов', ('budget',)
+)
+
+
+def track_handler(name: Optional[str] = None):
+    """Декоратор: время и ошибки асинхронного обработчика"""
+    def decorator(handler):
+        label = name or handler.__name__
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=label)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, handler=label)
+
+        return wrapper
+
+    return decorator
+
+
+def observe_llm_call(model: str, outcome: str, input_tokens: int = 0, output_tokens: int = 0,
+                     cache_read_tokens: int = 0, cache_write_tokens: int = 0,
+                     ttft_ms: Optional[float] = None, latency_ms: Optional[float] = None, **_):
+    """Учесть вызов Claude (принимает ту же запись, что и журнал llm_calls)"""
+    if latency_ms is not None:
+        LLM_CALL_SECONDS.observe(latency_ms / 1000, model=model, outcome=outcome)
+    if ttft_ms is not None:
+        LLM_TTFT_SECONDS.observe(ttft_ms / 1000, model=model)
+    for kind, amount in (('input', input_tokens), ('output', output_tokens),
+                         ('cache_read', cache_read_tokens), ('cache_write', cache_write_tokens)):
+        if amount:
+            LLM_TOKENS.inc(amount, model=model, kind=kind)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"metrics: {format % args}")
+
+
+class MetricsServer:
+    """HTTP-сервер /metrics в отдельном потоке"""
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY):
+        handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='metrics', daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Метрики доступны на http://{self._server.server_address[0]}:{self.port}/metrics")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
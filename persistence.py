@@ -0,0 +1,159 @@
+"""
+Хранение состояний ConversationHandler и user_data в SQLite, чтобы
+анкета продолжалась с текущего вопроса после перезапуска бота
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistence для PTB поверх Database. user_data загружаются лениво при первом
+    апдейте пользователя; изменения копятся и пишутся в БД одной транзакцией
+    """
+
+    def __init__(self, db: AsyncDatabase, update_interval: float = 5.0, max_loaded: int = 10000):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False,
+                                        user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+
+        # Пользователи, чьи user_data уже подняты из БД (LRU), и загрузки, идущие сейчас.
+        # Вытесненный пользователь просто перечитается из БД при следующем апдейте
+        self.max_loaded = max_loaded
+        self._loaded: "OrderedDict[int, None]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Task] = {}
+
+        # Изменения, ещё не записанные в БД; None — удаление
+        self._dirty_users: Dict[int, Optional[Dict]] = {}
+        self._dirty_states: Dict[Tuple[str, tuple], object] = {}
+        self._write_task: Optional[asyncio.Task] = None
+
+        self.lazy_loads = 0
+        self.batches = 0
+
+    # ---------- Загрузка ----------
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        # Ничего не грузим заранее: данные пользователя читаются в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        """Перед обработкой апдейта: при первом обращении поднять user_data из БД"""
+        if user_id in self._loaded:
+            self._loaded.move_to_end(user_id)
+            return
+        if user_id in self._dirty_users:
+            # Незаписанные изменения новее БД: перечитывать нечего
+            self._remember(user_id)
+            return
+
+        task = self._loading.get(user_id)
+        if task is not None:
+            # Параллельный апдейт того же пользователя: ждём ту же загрузку
+            await task
+            return
+
+        task = self._loading[user_id] = asyncio.create_task(self.db.get_user_data(user_id))
+        try:
+            stored = await task
+        finally:
+            self._loading.pop(user_id, None)
+
+        self._remember(user_id)
+        if stored:
+            self.lazy_loads += 1
+            # Данные, уже записанные обработчиками, важнее сохранённых
+            for key, value in stored.items():
+                user_data.setdefault(key, value)
+
+    def _remember(self, user_id: int):
+        self._loaded[user_id] = None
+        self._loaded.move_to_end(user_id)
+        while len(self._loaded) > self.max_loaded:
+            self._loaded.popitem(last=False)
+
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        return await self.db.get_conversation_states(name)
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # ---------- Запись ----------
+
+    async def update_user_data(self, user_id: int, data: Dict):
+        self._dirty_users[user_id] = data
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int):
+        self._dirty_users[user_id] = None
+        self._loaded.pop(user_id, None)
+        self._schedule_write()
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]):
+        self._dirty_states[(name, key)] = new_state
+        self._schedule_write()
+
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_dirty())
+
+    async def _write_dirty(self):
+        # Application вызывает update_* пачкой — даём им всем попасть в буфер
+        await asyncio.sleep(0)
+
+        while self._dirty_users or self._dirty_states:
+            users, self._dirty_users = self._dirty_users, {}
+            states, self._dirty_states = self._dirty_states, {}
+            try:
+                await self.db.save_persistence(users, states)
+                self.batches += 1
+            except Exception as e:
+                logger.error(f"Не удалось сохранить состояния диалогов: {e}")
+                # Вернём изменения в буфер, не затирая более свежие
+                for user_id, data in users.items():
+                    self._dirty_users.setdefault(user_id, data)
+                for key, state in states.items():
+                    self._dirty_states.setdefault(key, state)
+                return
+
+    async def flush(self):
+        """Записать всё накопленное (вызывается при остановке приложения)"""
+        if self._write_task is not None:
+            await asyncio.gather(self._write_task, return_exceptions=True)
+        await self._write_dirty()
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        pass
+
+    async def update_bot_data(self, data: Dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
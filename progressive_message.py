@@ -0,0 +1,82 @@
+"""
+Постепенно обновляемое сообщение Telegram для потоковой генерации.
+Частые обновления склеиваются, чтобы не упираться в лимиты на редактирование
+"""
+
+import asyncio
+import logging
+from typing import Optional, Callable, Awaitable
+
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину текста сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+
+class ProgressiveMessage:
+    """Сообщение, которое редактируется по мере поступления текста"""
+
+    def __init__(self, edit: Callable[..., Awaitable], min_interval: float = 1.5,
+                 cursor: str = " ▌"):
+        # edit(text, **kwargs) — правка нужного сообщения, например Message.edit_text
+        self.edit = edit
+        self.min_interval = min_interval
+        self.cursor = cursor
+
+        self.text = ""
+        self._sent: Optional[str] = None
+        self._last_edit = float('-inf')
+        self._task: Optional[asyncio.Task] = None
+        self._editing = False
+
+    def append(self, delta: str):
+        """Добавить фрагмент текста; сообщение обновится не чаще min_interval"""
+        self.text += delta
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        """Дождаться окончания интервала и отправить последнюю версию текста"""
+        loop = asyncio.get_running_loop()
+        delay = self._last_edit + self.min_interval - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        text = self.text
+        if not text.strip() or text == self._sent:
+            return
+
+        # Промежуточные версии отправляем без разметки: незакрытые * и _ ломают Markdown
+        preview = text[:MAX_MESSAGE_LENGTH - len(self.cursor)] + self.cursor
+        self._editing = True
+        try:
+            await self.edit(preview)
+            self._sent = text
+        except RetryAfter as e:
+            logger.warning(f"Telegram просит подождать {e.retry_after} с перед правкой")
+            self._last_edit = loop.time() + float(e.retry_after)
+            return
+        except BadRequest as e:
+            logger.debug(f"Промежуточная правка не прошла: {e}")
+        finally:
+            self._editing = False
+
+        self._last_edit = loop.time()
+
+    async def _stop(self):
+        """Остановить отложенную правку; уже идущую дождаться, чтобы не обогнать финальную"""
+        if self._task is None or self._task.done():
+            return
+
+        if self._editing:
+            await asyncio.gather(self._task, return_exceptions=True)
+        else:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def finish(self, text: str, **kwargs):
+        """Финальная правка: полный текст с разметкой и клавиатурой"""
+        await self._stop()
+        return await self.edit(text, **kwargs)
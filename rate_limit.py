@@ -0,0 +1,101 @@
+"""
+Token bucket для ограничения частоты: исходящие сообщения в Telegram
+и входящие события от пользователей
+"""
+
+import time
+from typing import Optional, Dict
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst накопленных"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, burst: float = 1.0, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 — уже доступен)"""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, now: float, amount: float = 1.0):
+        """Списать токены (после проверки delay)"""
+        self._refill(now)
+        self.tokens -= amount
+
+    def try_consume(self, now: float, amount: float = 1.0) -> bool:
+        """Списать токены, если они есть"""
+        self._refill(now)
+        if now < self.blocked_until or self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def block(self, now: float, seconds: float):
+        """Не выдавать токены seconds секунд (например, после 429 от Telegram)"""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def is_full(self, now: float) -> bool:
+        """Ведро полное — состояние можно забыть без потери информации"""
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.blocked_until
+
+
+class UserRateLimiter:
+    """
+    Отдельный token bucket на каждого пользователя. Хранятся только вёдра
+    с неполным запасом: полные периодически удаляются
+    """
+
+    def __init__(self, rate: float, burst: float, cleanup_interval: float = 300.0):
+        self.rate = rate
+        self.burst = burst
+        self.cleanup_interval = cleanup_interval
+
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._last_cleanup = time.monotonic()
+
+        self.allowed = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Списать токен пользователя; False — лимит исчерпан"""
+        now = time.monotonic() if now is None else now
+        if now - self._last_cleanup >= self.cleanup_interval:
+            self.cleanup(now)
+
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst, now)
+
+        if bucket.try_consume(now):
+            self.allowed += 1
+            return True
+
+        self.rejected += 1
+        return False
+
+    def cleanup(self, now: Optional[float] = None):
+        """Удалить вёдра, которые уже восстановились полностью"""
+        now = time.monotonic() if now is None else now
+        self._last_cleanup = now
+        full = [user_id for user_id, bucket in self._buckets.items() if bucket.is_full(now)]
+        for user_id in full:
+            del self._buckets[user_id]
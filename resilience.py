@@ -0,0 +1,109 @@
+"""
+Устойчивость запросов к Claude: повтор с экспоненциальной задержкой,
+circuit breaker на каждую модель и классификация ошибок API
+"""
+
+import random
+import time
+from typing import Optional
+
+import anthropic
+
+# Статусы, при которых имеет смысл повторить запрос: перегрузка, лимиты, сбои сервера
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+
+# Статусы, при которых модель недоступна этому ключу — сразу переходим к следующей
+MODEL_UNAVAILABLE_STATUSES = {403, 404}
+
+
+class CircuitOpenError(Exception):
+    """Все модели в цепочке временно отключены circuit breaker'ом"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Временная ли ошибка (стоит повторить запрос)"""
+    if isinstance(error, (anthropic.APIConnectionError, anthropic.APITimeoutError)):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUSES
+    return False
+
+
+def is_model_unavailable(error: Exception) -> bool:
+    """Нет доступа к модели — имеет смысл сразу перейти к следующей"""
+    return (isinstance(error, anthropic.APIStatusError)
+            and error.status_code in MODEL_UNAVAILABLE_STATUSES)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Задержка из заголовка retry-after, если API её прислал"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Экспоненциальная задержка с полным джиттером (attempt начинается с 0)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Размыкатель для одной модели: после серии ошибок запросы к ней
+    не отправляются reset_timeout секунд, затем пропускается один пробный
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # Время выдачи пробного запроса; None — проба не выполняется
+        self.probe_started: Optional[float] = None
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос"""
+        if self.state == self.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        elif self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+            # Пробный запрос ещё выполняется
+            return False
+
+        # Пропускаем один пробный запрос; зависший через reset_timeout заменяем новым
+        self.probe_started = now
+        return True
+
+    def release(self):
+        """Пробный запрос завершился без результата (отмена, ошибка запроса) — можно пробовать снова"""
+        if self.state == self.HALF_OPEN:
+            self.probe_started = None
+
+    def record_success(self):
+        """Успешный запрос замыкает размыкатель"""
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_started = None
+
+    def record_failure(self):
+        """Ошибка запроса; при превышении порога размыкатель открывается"""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probe_started = None
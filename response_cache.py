@@ -0,0 +1,114 @@
+"""
+Кэш сгенерированных сценариев: одинаковые по смыслу ответы клиентов
+не требуют повторного запроса к Claude
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple
+
+from async_database import AsyncDatabase
+from metrics import SCENARIO_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_answer(text: str) -> str:
+    """Нормализовать ответ: схлопнуть пробелы и привести регистр"""
+    return ' '.join(str(text).split()).casefold()
+
+
+def make_cache_key(answers: List[Dict], model: str, prompt_version: str) -> str:
+    """Ключ кэша: хэш нормализованных ответов, модели и версии промпта"""
+    parts = [model, prompt_version]
+    for answer in sorted(answers, key=lambda a: a['question_number']):
+        parts.append(f"{answer['question_number']}:{normalize_answer(answer['answer'])}")
+
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ScenarioCache:
+    """Двухуровневый кэш ответов: LRU в памяти процесса поверх таблицы SQLite"""
+
+    def __init__(self, db: AsyncDatabase, ttl_seconds: float = 7 * 24 * 3600,
+                 max_entries: int = 10000, front_size: int = 256):
+        self.db = db
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.front_size = front_size
+
+        # cache_key -> (время создания, текст ответа)
+        self._front: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+        self.front_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self.front_hits + self.db_hits
+
+    def make_key(self, answers: List[Dict], model: str, prompt_version: str) -> str:
+        """Ключ кэша для набора ответов"""
+        return make_cache_key(answers, model, prompt_version)
+
+    def _remember(self, cache_key: str, created_at: float, response: str):
+        """Положить ответ в кэш процесса"""
+        self._front[cache_key] = (created_at, response)
+        self._front.move_to_end(cache_key)
+        while len(self._front) > self.front_size:
+            self._front.popitem(last=False)
+
+    async def get(self, cache_key: str) -> Optional[str]:
+        """Найти ответ сначала в памяти, затем в SQLite"""
+        entry = self._front.get(cache_key)
+        if entry is not None:
+            created_at, response = entry
+            if time.time() - created_at <= self.ttl:
+                self._front.move_to_end(cache_key)
+                self.front_hits += 1
+                SCENARIO_CACHE_LOOKUPS.inc(result='front_hit')
+                return response
+            del self._front[cache_key]
+
+        cached = await self.db.get_cached_response(cache_key, self.ttl)
+        if cached is None:
+            self.misses += 1
+            SCENARIO_CACHE_LOOKUPS.inc(result='miss')
+            return None
+
+        # Время создания из БД: в памяти запись истекает тогда же, когда и в SQLite
+        response, created_at = cached
+        self._remember(cache_key, created_at, response)
+        self.db_hits += 1
+        SCENARIO_CACHE_LOOKUPS.inc(result='db_hit')
+        return response
+
+    async def put(self, cache_key: str, model: str, prompt_version: str, response: str):
+        """Сохранить ответ в обоих уровнях кэша"""
+        self._remember(cache_key, time.time(), response)
+        await self.db.put_cached_response(cache_key, model, prompt_version,
+                                          response, self.max_entries)
+
+    async def purge_expired(self, interval: float):
+        """Периодически удалять из SQLite записи старше TTL (запускается фоновой задачей)"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                deleted = await self.db.delete_expired_cache(self.ttl)
+            except Exception as e:
+                logger.warning(f"Ошибка очистки кэша сценариев: {e}")
+                continue
+            if deleted:
+                logger.info(f"Из кэша сценариев удалено устаревших записей: {deleted}")
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов"""
+        return {
+            'front_hits': self.front_hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,253 @@
+"""
+Планировщик исходящих запросов к Telegram: общий лимит на бота и лимит
+на чат, склейка правок одного сообщения и приоритет интерактивных ответов
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Optional, Dict, List, Tuple, Callable, Awaitable, Any, Hashable
+
+from telegram.error import RetryAfter
+
+from rate_limit import TokenBucket
+from metrics import SEND_QUEUE_DEPTH, SEND_WAIT_SECONDS, SENDS_TOTAL, SEND_COALESCED, SEND_RETRY_AFTER
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: ответы на действия пользователя раньше фоновых правок и рассылок
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+# Запрос к Telegram, который выполнит планировщик
+SendCall = Callable[[], Awaitable[Any]]
+
+
+class _Item:
+    """Запрос в очереди чата; при склейке правок call заменяется на последний"""
+
+    __slots__ = ('call', 'futures', 'priority', 'coalesce_key', 'enqueued_at', 'attempts')
+
+    def __init__(self, call: SendCall, future: asyncio.Future, priority: int,
+                 coalesce_key: Optional[Hashable], now: float):
+        self.call = call
+        self.futures = [future]
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+        self.enqueued_at = now
+        self.attempts = 0
+
+
+class _Chat:
+    """Очередь и лимит одного чата"""
+
+    __slots__ = ('items', 'bucket', 'busy', 'scheduled')
+
+    def __init__(self, bucket: TokenBucket):
+        self.items: "deque[_Item]" = deque()
+        self.bucket = bucket
+        # Запрос чата выполняется — следующий ждёт, чтобы не нарушить порядок
+        self.busy = False
+        # Чат уже стоит в одной из куч диспетчера
+        self.scheduled = False
+
+
+class SendScheduler:
+    """
+    Все запросы проходят через общий token bucket (~30 в секунду) и bucket чата
+    (1 в секунду с небольшим запасом). Запросы одного чата выполняются по порядку
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_retries: int = 3, cleanup_interval: float = 60.0):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.cleanup_interval = cleanup_interval
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, _Chat] = {}
+
+        # Чаты, готовые к отправке: (приоритет, порядок, chat_id)
+        self._ready: List[Tuple[int, int, int]] = []
+        # Чаты, ждущие своего лимита: (время готовности, порядок, chat_id)
+        self._waiting: List[Tuple[float, int, int]] = []
+        self._seq = itertools.count()
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sending = set()
+        self._last_cleanup = time.monotonic()
+
+        self.depth = {INTERACTIVE: 0, BULK: 0}
+        for priority, name in PRIORITY_NAMES.items():
+            SEND_QUEUE_DEPTH.set_function(lambda p=priority: self.depth[p], priority=name)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name='send-scheduler')
+
+    async def stop(self, timeout: float = 10.0):
+        """Дождаться отправки очереди (не дольше timeout) и остановить диспетчер"""
+        if self._task is None:
+            return
+
+        deadline = time.monotonic() + timeout
+        while (self._ready or self._waiting or self._sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def submit(self, chat_id: int, call: SendCall, priority: int = INTERACTIVE,
+                     coalesce_key: Optional[Hashable] = None) -> Any:
+        """
+        Выполнить запрос к Telegram с учётом лимитов и вернуть его результат.
+        Запросы с одинаковым coalesce_key (правки одного сообщения), ещё не
+        отправленные, склеиваются: выполняется только последний
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        now = time.monotonic()
+
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst, now))
+
+        if coalesce_key is not None:
+            for item in chat.items:
+                if item.coalesce_key == coalesce_key:
+                    item.call = call
+                    item.futures.append(future)
+                    if priority < item.priority:
+                        self.depth[item.priority] -= 1
+                        self.depth[priority] += 1
+                        item.priority = priority
+                    SEND_COALESCED.inc()
+                    return await future
+
+        chat.items.append(_Item(call, future, priority, coalesce_key, now))
+        self.depth[priority] += 1
+        self._schedule(chat_id, chat, now)
+        return await future
+
+    def _schedule(self, chat_id: int, chat: _Chat, now: float):
+        """Поставить чат в очередь диспетчера, если у него есть что отправить"""
+        if chat.busy or chat.scheduled or not chat.items:
+            return
+
+        chat.scheduled = True
+        delay = chat.bucket.delay(now)
+        if delay > 0:
+            heapq.heappush(self._waiting, (now + delay, next(self._seq), chat_id))
+        else:
+            heapq.heappush(self._ready, (chat.items[0].priority, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._waiting)
+                chat = self._chats[chat_id]
+                heapq.heappush(self._ready, (chat.items[0].priority, next(self._seq), chat_id))
+
+            if now - self._last_cleanup >= self.cleanup_interval:
+                self._cleanup(now)
+
+            if not self._ready:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global.delay(now)
+            if delay > 0:
+                # Пока ждём общий лимит, может прийти более срочный запрос
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            chat = self._chats[chat_id]
+            chat.scheduled = False
+            item = chat.items.popleft()
+            self.depth[item.priority] -= 1
+
+            if all(future.done() for future in item.futures):
+                # Все, кто ждал результат, отменены
+                self._schedule(chat_id, chat, now)
+                continue
+
+            self._global.consume(now)
+            chat.bucket.consume(now)
+            chat.busy = True
+            SEND_WAIT_SECONDS.observe(now - item.enqueued_at, priority=PRIORITY_NAMES[item.priority])
+
+            task = asyncio.create_task(self._send(chat_id, chat, item))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: int, chat: _Chat, item: _Item):
+        priority = PRIORITY_NAMES[item.priority]
+        try:
+            result = await item.call()
+        except RetryAfter as e:
+            now = time.monotonic()
+            retry_after = float(getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)())
+            SEND_RETRY_AFTER.inc()
+            logger.warning(f"Telegram просит подождать {retry_after:.0f} с (чат {chat_id})")
+            # 429 может быть и общим лимитом бота — притормаживаем всё
+            chat.bucket.block(now, retry_after)
+            self._global.block(now, retry_after)
+            if item.attempts < self.max_retries:
+                item.attempts += 1
+                chat.items.appendleft(item)
+                self.depth[item.priority] += 1
+            else:
+                SENDS_TOTAL.inc(priority=priority, outcome='retry_after')
+                self._resolve(item, error=e)
+        except Exception as e:
+            SENDS_TOTAL.inc(priority=priority, outcome='error')
+            self._resolve(item, error=e)
+        else:
+            SENDS_TOTAL.inc(priority=priority, outcome='ok')
+            self._resolve(item, result=result)
+        finally:
+            chat.busy = False
+            self._schedule(chat_id, chat, time.monotonic())
+
+    @staticmethod
+    def _resolve(item: _Item, result: Any = None, error: Optional[BaseException] = None):
+        for future in item.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _cleanup(self, now: float):
+        """Забыть простаивающие чаты с полным ведром"""
+        self._last_cleanup = now
+        idle = [chat_id for chat_id, chat in self._chats.items()
+                if not chat.items and not chat.busy and not chat.scheduled and chat.bucket.is_full(now)]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def stats(self) -> Dict:
+        return {
+            'chats': len(self._chats),
+            'interactive': self.depth[INTERACTIVE],
+            'bulk': self.depth[BULK],
+            'sending': len(self._sending),
+        }
@@ -0,0 +1,157 @@
+"""
+Кэш состояния анкеты в памяти: диалог, текущий вопрос и собранные ответы.
+Запись идёт сквозь кэш в SQLite, чтение во время анкеты обходится без БД
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional, Dict, List
+
+from async_database import AsyncDatabase
+
+
+@dataclass
+class Session:
+    """Состояние анкеты одного пользователя"""
+    user_id: int
+    conversation_id: int
+    current_question: int = 1
+    answers: List[Dict] = field(default_factory=list)
+    touched_at: float = field(default_factory=time.monotonic)
+
+
+class SessionCache:
+    """Write-through кэш активных анкет с вытеснением по LRU и TTL"""
+
+    def __init__(self, db: AsyncDatabase, max_size: int = 10000, ttl_seconds: float = 3600):
+        self.db = db
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+
+        # Порядок ключей совпадает с порядком последнего обращения
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, user_id: int) -> Optional[Session]:
+        """Получить сессию пользователя, если она есть и не устарела"""
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+
+        now = time.monotonic()
+        if now - session.touched_at > self.ttl:
+            del self._sessions[user_id]
+            return None
+
+        session.touched_at = now
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def _put(self, session: Session):
+        """Положить сессию в кэш и вытеснить лишнее"""
+        self._sessions[session.user_id] = session
+        self._sessions.move_to_end(session.user_id)
+        self.evict()
+
+    def evict(self):
+        """Удалить устаревшие сессии и ограничить размер кэша"""
+        now = time.monotonic()
+        # Самые давно использованные сессии стоят в начале
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.touched_at <= self.ttl and len(self._sessions) <= self.max_size:
+                break
+            del self._sessions[user_id]
+
+    def finish(self, user_id: int, conversation_id: Optional[int] = None):
+        """
+        Убрать сессию после завершения или отмены анкеты.
+        С conversation_id — только если сессия относится к этому диалогу:
+        пользователь мог уже начать новую анкету
+        """
+        session = self._sessions.get(user_id)
+        if session is None:
+            return
+        if conversation_id is None or session.conversation_id == conversation_id:
+            del self._sessions[user_id]
+
+    async def start_conversation(self, user_id: int, username: str = None,
+                                 first_name: str = None, last_name: str = None) -> int:
+        """Сохранить пользователя, начать новый диалог и завести для него сессию"""
+        await self.db.add_user(
+            user_id=user_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name
+        )
+        conversation_id = await self.db.start_conversation(user_id)
+
+        self._put(Session(user_id=user_id, conversation_id=conversation_id))
+        return conversation_id
+
+    async def save_answer(self, user_id: int, conversation_id: int, question_number: int,
+                          question_text: str, answer: str):
+        """Сохранить ответ в БД и в сессию"""
+        await self.db.save_answer(
+            conversation_id=conversation_id,
+            question_number=question_number,
+            question_text=question_text,
+            answer=answer
+        )
+
+        session = self.get(user_id)
+        if session is None or session.conversation_id != conversation_id:
+            # Сессия вытеснена: восстановим её при следующем чтении из БД
+            return
+
+        # Повторный ответ на тот же вопрос заменяет прежний, как и в БД
+        session.answers = [a for a in session.answers if a['question_number'] != question_number]
+        session.answers.append({
+            'question_number': question_number,
+            'question_text': question_text,
+            'answer': answer,
+            # Тот же формат, что у CURRENT_TIMESTAMP в SQLite
+            'answered_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        session.current_question = question_number + 1
+
+    async def get_answers(self, user_id: int, conversation_id: int) -> List[Dict]:
+        """Ответы диалога: из памяти, а при промахе — из БД с восстановлением сессии"""
+        session = self.get(user_id)
+        if session is not None and session.conversation_id == conversation_id:
+            self.hits += 1
+            return sorted(session.answers, key=lambda a: a['question_number'])
+
+        self.misses += 1
+        answers = await self.db.get_conversation_answers(conversation_id)
+
+        # Ответы старого диалога (задача генерации из очереди) не должны
+        # заменять сессию анкеты, которую пользователь уже начал заново
+        if self.get(user_id) is not None:
+            return answers
+
+        current_question = max((a['question_number'] for a in answers), default=0) + 1
+        self._put(Session(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            current_question=current_question,
+            answers=list(answers),
+        ))
+        return answers
+
+    async def get_active_conversation(self, user_id: int) -> Optional[int]:
+        """Активный диалог пользователя: из памяти или из БД"""
+        session = self.get(user_id)
+        if session is not None:
+            self.hits += 1
+            return session.conversation_id
+
+        self.misses += 1
+        return await self.db.get_active_conversation(user_id)
@@ -0,0 +1,95 @@
+"""
+Single-flight для генераций: одновременные запросы с одним ключом
+(диалог и его ответы) выполняются один раз, остальные ждут общий результат
+"""
+
+import asyncio
+import hashlib
+from contextlib import contextmanager
+from typing import Dict, List, Hashable, Iterator, Any, Tuple
+
+
+def answers_hash(answers: List[Dict]) -> str:
+    """Отпечаток ответов диалога: повторный вызов с теми же ответами даст тот же хэш"""
+    ordered = sorted(answers, key=lambda a: a['question_number'])
+    parts = [f"{a['question_number']}:{a['answer']}" for a in ordered]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class Flight:
+    """Выполняющийся вызов; ведущий сообщает результат через set_result"""
+
+    __slots__ = ('future',)
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+
+    def set_result(self, result: Any):
+        if not self.future.done():
+            self.future.set_result(result)
+
+
+class SingleFlight:
+    """Реестр выполняющихся вызовов по ключу"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self.led = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    async def join(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Дождаться результата вызова с тем же ключом, если он выполняется.
+        Возвращает (True, результат) или (False, None) — тогда вызов нужно
+        выполнить самому через lead. Ошибка ведущего передаётся всем ждущим
+        """
+        while True:
+            future = self._flights.get(key)
+            if future is None:
+                return False, None
+
+            try:
+                # shield: отмена одного из ждущих не отменяет общий результат
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Ведущего отменили — пробуем снова, возможно, выполнять придётся нам
+                continue
+
+            self.shared += 1
+            return True, result
+
+    @contextmanager
+    def lead(self, key: Hashable) -> Iterator[Flight]:
+        """
+        Выполнить вызов ведущим. Вызывать сразу после join без await между ними,
+        чтобы второй ведущий не появился
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Ошибку без ждущих никто не заберёт — не шумим в логах
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._flights[key] = future
+        self.led += 1
+        try:
+            yield Flight(future)
+        except (asyncio.CancelledError, GeneratorExit):
+            # Отмена или брошенный поток: ждущие выполнят вызов сами
+            future.cancel()
+            raise
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        finally:
+            if not future.done():
+                # Ведущий вышел, не сообщив результат: ждущие выполнят вызов сами
+                future.cancel()
+            if self._flights.get(key) is future:
+                del self._flights[key]
@@ -0,0 +1,178 @@
+"""
+Спекулятивная генерация сценариев: запрос к Claude стартует сразу после
+предпоследнего вопроса, с типовым бюджетом вместо ответа на последний
+"""
+
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Границы бюджетных корзин в рублях в месяц
+BUDGET_BUCKETS = [
+    (30_000, "до 30 тыс"),
+    (100_000, "30-100 тыс"),
+    (300_000, "100-300 тыс"),
+    (float('inf'), "от 300 тыс"),
+]
+
+# Множители для сокращений в ответах вида "50к", "100 тыс", "1.5 млн", "50 тысяч"
+_MULTIPLIERS = {
+    'к': 1_000, 'k': 1_000, 'тыс': 1_000, 'т': 1_000,
+    'тысяча': 1_000, 'тысячи': 1_000, 'тысяч': 1_000,
+    'млн': 1_000_000, 'm': 1_000_000,
+    'миллион': 1_000_000, 'миллиона': 1_000_000, 'миллионов': 1_000_000,
+}
+
+# Единица должна быть целым словом: "2 месяца", "3 мин", "5 min" — это не тысячи и не миллионы
+_UNITS = '|'.join(sorted(map(re.escape, _MULTIPLIERS), key=len, reverse=True))
+_AMOUNT_RE = re.compile(
+    rf'(\d[\d\s]*(?:[.,]\d+)?)\s*(?:({_UNITS})(?![a-zа-яё]))?', re.IGNORECASE
+)
+
+
+def parse_budget(text: str) -> Optional[float]:
+    """Достать из ответа максимальную упомянутую сумму"""
+    amounts = []
+    for number, suffix in _AMOUNT_RE.findall(text or ''):
+        digits = number.replace(' ', '').replace(',', '.').strip()
+        try:
+            value = float(digits)
+        except ValueError:
+            continue
+        if suffix:
+            value *= _MULTIPLIERS[suffix.lower()]
+        amounts.append(value)
+
+    return max(amounts) if amounts else None
+
+
+def budget_bucket(text: str) -> str:
+    """Бюджетная корзина для ответа на вопрос о бюджете"""
+    amount = parse_budget(text)
+    if amount is None:
+        return "не указан"
+
+    for upper, label in BUDGET_BUCKETS:
+        if amount < upper:
+            return label
+    return BUDGET_BUCKETS[-1][1]
+
+
+@dataclass
+class Speculation:
+    """Запущенная заранее генерация для одного диалога"""
+    task: asyncio.Task
+    started_at: float
+    finished_at: Optional[float] = None
+
+
+class SpeculativeGenerator:
+    """Запускает генерацию до последнего ответа и переиспользует её, если бюджет совпал"""
+
+    def __init__(self, agent, placeholder_budget: str = "50 000 рублей в месяц",
+                 max_age: float = 600.0):
+        self.agent = agent
+        self.placeholder_budget = placeholder_budget
+        # Спекуляции брошенных диалогов (ответа на последний вопрос так и не было)
+        # удаляются через max_age секунд
+        self.max_age = max_age
+        self.placeholder_bucket = budget_bucket(placeholder_budget)
+
+        self._speculations: Dict[int, Speculation] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def start(self, conversation_id: int, answers: List[Dict]):
+        """Начать генерацию с типовым бюджетом вместо ответа на последний вопрос"""
+        self.cancel(conversation_id)
+        self._sweep(time.monotonic())
+
+        total = self.agent.get_total_questions()
+        last_question = self.agent.get_question_by_number(total)
+        speculative_answers = [a for a in answers if a['question_number'] != total]
+        speculative_answers.append({
+            'question_number': total,
+            'question_text': last_question['text'],
+            'answer': self.placeholder_budget,
+        })
+
+        task = asyncio.create_task(self.agent.generate_scenarios_async(
+            speculative_answers, conversation_id=conversation_id
+        ))
+        speculation = Speculation(task=task, started_at=time.monotonic())
+        task.add_done_callback(lambda _: setattr(speculation, 'finished_at', time.monotonic()))
+        self._speculations[conversation_id] = speculation
+
+    async def sweep_expired(self, interval: float):
+        """Периодически удалять брошенные спекуляции (запускается фоновой задачей)"""
+        while True:
+            await asyncio.sleep(interval)
+            self._sweep(time.monotonic())
+
+    def _sweep(self, now: float):
+        """Отменить и забыть спекуляции старше max_age"""
+        expired = [conversation_id for conversation_id, speculation in self._speculations.items()
+                   if now - speculation.started_at > self.max_age]
+        for conversation_id in expired:
+            self.cancel(conversation_id)
+        if expired:
+            logger.info(f"Удалено брошенных спекуляций: {len(expired)}")
+
+    def cancel(self, conversation_id: Optional[int]):
+        """Отменить спекулятивную генерацию диалога, если она есть"""
+        speculation = self._speculations.pop(conversation_id, None)
+        if speculation and not speculation.task.done():
+            speculation.task.cancel()
+
+    async def resolve(self, conversation_id: int, budget_answer: str) -> Optional[str]:
+        """
+        Получить результат спекулятивной генерации
+
+        Returns:
+            Готовый текст, если бюджет попал в ту же корзину, иначе None —
+            тогда генерацию нужно запустить заново с настоящим ответом
+        """
+        speculation = self._speculations.pop(conversation_id, None)
+        if speculation is None:
+            return None
+
+        bucket = budget_bucket(budget_answer)
+        if bucket != self.placeholder_bucket:
+            speculation.task.cancel()
+            self.misses += 1
+            logger.info(
+                f"Спекуляция не подошла: бюджет «{bucket}» вместо «{self.placeholder_bucket}», "
+                f"доля попаданий {self.hit_rate:.0%}"
+            )
+            return None
+
+        resolved_at = time.monotonic()
+        try:
+            text = await speculation.task
+        except Exception as e:
+            self.misses += 1
+            logger.warning(f"Спекулятивная генерация завершилась ошибкой: {e}")
+            return None
+
+        # Выигрыш — время, которое генерация успела отработать до последнего ответа
+        saved = min(resolved_at, speculation.finished_at) - speculation.started_at
+
+        self.hits += 1
+        self.latency_saved += saved
+        logger.info(
+            f"Спекуляция подошла: сэкономлено {saved:.1f} с, "
+            f"доля попаданий {self.hit_rate:.0%}, всего сэкономлено {self.latency_saved:.1f} с"
+        )
+        return text
@@ -39,4 +39,9 @@ export $(cat .env | grep -v '^#' | xargs)
 echo "🚀 Запуск бота..."
 echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
 echo ""
-python bot.py
+if [ "${BOT_WORKERS:-1}" -gt 1 ]; then
+    # Несколько процессов-воркеров под супервизором
+    python supervisor.py
+else
+    python bot.py
+fi
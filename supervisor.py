@@ -0,0 +1,239 @@
+"""
+Супервизор: несколько процессов бота на одной базе SQLite.
+Апдейты принимает супервизор (polling или вебхук) и раздаёт воркерам
+по user_id, поэтому диалог пользователя всегда обрабатывает один процесс.
+
+Запуск: BOT_WORKERS=4 python supervisor.py
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import Optional, Dict, List
+
+from dotenv import load_dotenv
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+from database import Database
+from webhook import WebhookServer, register_webhook, require_secret, running, wait_for_stop_signal
+
+logger = logging.getLogger(__name__)
+
+# Процесс, проживший меньше этого, считается упавшим при старте — задержка перезапуска растёт
+STABLE_UPTIME = 30.0
+MAX_RESTART_DELAY = 60.0
+
+
+def worker_main(index: int, workers: int, updates: "multiprocessing.Queue"):
+    """Точка входа процесса-воркера: приложение бота, апдейты из очереди супервизора"""
+    # Останавливает воркер супервизор (через очередь), Ctrl+C из терминала игнорируем.
+    # SIGTERM до запуска цикла событий тоже: потом он обрабатывается как штатная остановка
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    # Постоянное имя владельца задач генерации, своя доля пользователей и свои порт метрик
+    # и файл трасс
+    os.environ['GENERATION_OWNER'] = f'worker{index}'
+    os.environ['WORKER_SHARD'] = f'{index}/{workers}'
+    metrics_port = int(os.getenv('METRICS_PORT', '0'))
+    if metrics_port:
+        os.environ['METRICS_PORT'] = str(metrics_port + index)
+    trace_file = os.getenv('TRACE_FILE', 'traces.jsonl')
+    root, ext = os.path.splitext(trace_file)
+    os.environ['TRACE_FILE'] = f'{root}.worker{index}{ext}'
+
+    import bot
+
+    application = bot.build_application(polling=False)
+    asyncio.run(_worker_loop(application, updates))
+
+
+async def _worker_loop(application, updates: "multiprocessing.Queue"):
+    loop = asyncio.get_running_loop()
+    # systemd и docker шлют SIGTERM всей группе процессов: завершаемся так же, как по команде
+    # супервизора, чтобы дописать отложенную запись, состояние диалогов и журнал вызовов
+    loop.add_signal_handler(signal.SIGTERM, updates.put, None)
+    async with running(application):
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+
+class Supervisor:
+    """Запускает воркеры, раздаёт им апдейты и перезапускает упавшие"""
+
+    def __init__(self, workers: int, restart_delay: float = 1.0):
+        self.workers = workers
+        self.restart_delay = restart_delay
+
+        # spawn: воркер импортирует bot заново и не наследует соединения с БД
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._started_at = [0.0] * workers
+        self._failures = [0] * workers
+        self._next_start = [0.0] * workers
+        self._stopping = False
+
+        self.restarts = 0
+        self.dispatched = [0] * workers
+
+    def _spawn(self, index: int):
+        process = self._context.Process(target=worker_main, args=(index, self.workers, self.queues[index]),
+                                        name=f'bot-worker-{index}', daemon=False)
+        process.start()
+        self.processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Запущен воркер {index} (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def route(self, update: Update) -> int:
+        """Номер воркера для апдейта: по пользователю, без пользователя — по update_id"""
+        user = update.effective_user
+        return (user.id if user else update.update_id) % self.workers
+
+    def dispatch(self, update: Update, data: Optional[Dict] = None):
+        index = self.route(update)
+        self.queues[index].put(data if data is not None else update.to_dict())
+        self.dispatched[index] += 1
+
+    async def monitor(self):
+        """Следить за воркерами и перезапускать упавшие с растущей задержкой"""
+        while not self._stopping:
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if process is None or process.is_alive():
+                    continue
+
+                if self._next_start[index] == 0.0:
+                    uptime = now - self._started_at[index]
+                    self._failures[index] = self._failures[index] + 1 if uptime < STABLE_UPTIME else 1
+                    delay = min(MAX_RESTART_DELAY, self.restart_delay * 2 ** (self._failures[index] - 1))
+                    self._next_start[index] = now + delay
+                    logger.error(
+                        f"Воркер {index} завершился с кодом {process.exitcode}, "
+                        f"перезапуск через {delay:.0f} с"
+                    )
+
+                if now >= self._next_start[index]:
+                    self._next_start[index] = 0.0
+                    self.restarts += 1
+                    self._spawn(index)
+
+            await asyncio.sleep(0.5)
+
+    def stop(self, timeout: float = 30.0):
+        """Попросить воркеры завершиться; не успевшие — остановить принудительно"""
+        self._stopping = True
+        for queue in self.queues:
+            queue.put(None)
+
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не остановился, завершаем принудительно")
+                process.kill()
+                process.join()
+
+
+async def poll_updates(bot: Bot, supervisor: Supervisor):
+    """Long polling в супервизоре: забрать апдейты и раздать воркерам"""
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30,
+                                            allowed_updates=Update.ALL_TYPES)
+        except TelegramError as e:
+            logger.warning(f"Ошибка получения апдейтов: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        for update in updates:
+            supervisor.dispatch(update)
+            offset = update.update_id + 1
+
+
+async def run(supervisor: Supervisor, token: str, mode: str):
+    """Принимать апдейты в выбранном режиме до сигнала остановки"""
+    supervisor.start()
+    monitor = asyncio.create_task(supervisor.monitor())
+
+    async with Bot(token) as bot:
+        if mode == 'webhook':
+            async def sink(data: Dict):
+                supervisor.dispatch(Update.de_json(data, bot), data)
+
+            secret_token = os.getenv('WEBHOOK_SECRET') or None
+            webhook_url = os.getenv('WEBHOOK_URL')
+            server = WebhookServer(
+                sink,
+                listen=os.getenv('WEBHOOK_LISTEN', '127.0.0.1'),
+                port=int(os.getenv('WEBHOOK_PORT', '8443')),
+                url_path=os.getenv('WEBHOOK_PATH', '/telegram'),
+                secret_token=secret_token,
+            )
+            await server.start()
+            if webhook_url:
+                await register_webhook(bot, webhook_url, secret_token,
+                                       int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40')),
+                                       Update.ALL_TYPES)
+            ingestion = None
+        else:
+            server = None
+            ingestion = asyncio.create_task(poll_updates(bot, supervisor))
+
+        try:
+            await wait_for_stop_signal()
+        finally:
+            if ingestion:
+                ingestion.cancel()
+                await asyncio.gather(ingestion, return_exceptions=True)
+            if server:
+                await server.stop()
+            monitor.cancel()
+            await asyncio.gather(monitor, return_exceptions=True)
+
+    # join блокирует — выполняем вне event loop
+    await asyncio.get_running_loop().run_in_executor(None, supervisor.stop)
+    logger.info(f"Супервизор остановлен, перезапусков воркеров: {supervisor.restarts}, "
+                f"апдейтов по воркерам: {supervisor.dispatched}")
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(processName)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        raise ValueError("Не найден TELEGRAM_BOT_TOKEN в переменных окружения!")
+    if os.getenv('BOT_MODE', 'polling') == 'webhook':
+        require_secret(os.getenv('WEBHOOK_LISTEN', '127.0.0.1'), os.getenv('WEBHOOK_URL'),
+                       os.getenv('WEBHOOK_SECRET'))
+
+    # Миграции применяем до запуска воркеров, чтобы они не соревновались за схему
+    Database(os.getenv('DB_PATH', 'bot_data.db')).close()
+
+    workers = int(os.getenv('BOT_WORKERS') or os.cpu_count() or 1)
+    supervisor = Supervisor(workers, restart_delay=float(os.getenv('WORKER_RESTART_DELAY', '1')))
+    logger.info(f"Супервизор: {workers} воркеров, режим {os.getenv('BOT_MODE', 'polling')}")
+    asyncio.run(run(supervisor, token, os.getenv('BOT_MODE', 'polling')))
+
+
+if __name__ == '__main__':
+    main()
@@ -118,7 +118,6 @@ def test_claude_api():
                 message = client.messages.create(
                     model=model_name,
                     max_tokens=2500,
-                    temperature=0.7,
                     messages=[
                         {
                             "role": "user",
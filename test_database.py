@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Test script to verify schema migrations and that hot queries use indexes
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+
+from database import Database, MIGRATIONS, WriteBehindQueue
+
+# Methods called on every dialog step, with sample arguments
+HOT_QUERIES = [
+    ("get_active_conversation", (1,)),
+    ("get_user_conversations", (1,)),
+    ("get_conversation_answers", (1,)),
+]
+
+
+def capture_statements(db: Database, method_name: str, args: tuple) -> list:
+    """Run a Database method and return the SQL statements it executed"""
+    statements = []
+
+    # In-memory databases read through the single writer connection
+    conn = db.pool._writer
+    conn.set_trace_callback(statements.append)
+    try:
+        getattr(db, method_name)(*args)
+    finally:
+        conn.set_trace_callback(None)
+
+    return [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+
+
+def test_migrations_set_user_version():
+    """A fresh database ends up at the latest schema version"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bot.db")
+        Database(path).close()
+
+        conn = sqlite3.connect(path)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        conn.close()
+
+        assert version == MIGRATIONS[-1][0]
+
+        # Re-opening an up-to-date database must not fail or re-run migrations
+        Database(path).close()
+
+
+def test_hot_queries_use_indexes():
+    """Every hot query is answered from an index, without scans or temp sorts"""
+    db = Database(":memory:")
+
+    for method_name, args in HOT_QUERIES:
+        statements = capture_statements(db, method_name, args)
+        assert statements, f"{method_name} did not run any SELECT"
+
+        for sql in statements:
+            plan = db.explain_query_plan(sql)
+            context = f"{method_name}: {plan}"
+
+            assert any("USING" in step and "INDEX" in step for step in plan), context
+            assert not any(step.startswith("SCAN") for step in plan), context
+            assert not any("TEMP B-TREE" in step for step in plan), context
+
+    db.close()
+
+
+class FlakyWriter:
+    """write_batch that fails a given number of times before succeeding"""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.written = []
+
+    def __call__(self, batch):
+        if self.failures > 0:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        self.written.extend(params[0] for _, params in batch)
+
+
+def test_write_behind_retries_failed_batch_in_order():
+    """A failed batch goes back to the front of the queue and is retried"""
+    writer = FlakyWriter(failures=2)
+    queue = WriteBehindQueue(writer, interval_ms=1, retry_base=0.01)
+    for i in range(5):
+        queue.put("INSERT", (i,))
+
+    deadline = time.monotonic() + 2
+    while len(writer.written) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    queue.put("INSERT", (5,))
+    queue.close()
+    assert writer.written == [0, 1, 2, 3, 4, 5]
+
+
+def test_write_behind_close_raises_on_lost_rows():
+    """Shutdown reports rows that could not be written instead of dropping them"""
+    writer = FlakyWriter(failures=1)
+    queue = WriteBehindQueue(writer, interval_ms=10_000)
+    queue.put("INSERT", (1,))
+
+    try:
+        queue.close()
+    except sqlite3.OperationalError:
+        pass
+    else:
+        raise AssertionError("close() swallowed the write error")
+    assert len(queue) == 1
+
+
+def test_write_behind_isolates_permanent_failure():
+    """A row that can never be written is dead-lettered; the rest of its batch is kept"""
+    db = Database(":memory:", write_behind=True, batch_interval_ms=10_000)
+    db.add_user(1)
+    db.write_behind.put("INSERT INTO users (user_id) VALUES (?)", (1,))
+    db.add_user(2)
+
+    # The read barrier does not fail, and later writes are not blocked
+    db.flush()
+    db.add_user(3)
+    with db._reader() as conn:
+        users = [row[0] for row in conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+
+    assert users == [1, 2, 3]
+    [(sql, params, error)] = db.write_behind.dead_letters
+    assert params == (1,) and "UNIQUE" in error
+    assert len(db.write_behind) == 0
+    db.close()
+
+
+def open_at_version(path: str, version: int) -> sqlite3.Connection:
+    """Create a database with migrations applied only up to version"""
+    conn = sqlite3.connect(path)
+    for number, _, migrate in MIGRATIONS:
+        if number <= version:
+            migrate(conn)
+    conn.execute(f"PRAGMA user_version = {version}")
+    conn.commit()
+    return conn
+
+
+def test_dedup_migration_keeps_first_result():
+    """Migration 7 drops duplicate scenarios and then enforces one per conversation"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bot.db")
+        conn = open_at_version(path, 6)
+        conn.executemany("INSERT INTO scenarios (conversation_id, scenarios_json) VALUES (?, ?)",
+                         [(1, "first"), (1, "second"), (2, "other")])
+        conn.commit()
+        conn.close()
+
+        db = Database(path)
+        assert not db.save_scenarios(1, [{"text": "third"}])
+        with db._reader() as conn:
+            rows = conn.execute("SELECT conversation_id, scenarios_json FROM scenarios "
+                                "ORDER BY id").fetchall()
+        assert [tuple(row) for row in rows] == [(1, "first"), (2, "other")]
+        db.close()
+
+
+def test_repeated_answer_replaces_previous():
+    """Answering a question again (restored after a crash) keeps one row per question"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bot.db")
+        conn = open_at_version(path, 7)
+        conn.executemany("INSERT INTO conversation_answers (conversation_id, question_number, answer) "
+                         "VALUES (?, ?, ?)", [(1, 1, "old"), (1, 1, "new"), (1, 2, "second")])
+        conn.commit()
+        conn.close()
+
+        db = Database(path, write_behind=True)
+        assert [a['answer'] for a in db.get_conversation_answers(1)] == ["new", "second"]
+
+        db.save_answer(1, 2, "Question 2", "second again")
+        db.save_answer(1, 3, "Question 3", "third")
+        answers = db.get_conversation_answers(1)
+        assert [(a['question_number'], a['answer']) for a in answers] == \
+            [(1, "new"), (2, "second again"), (3, "third")]
+        db.close()
+
+
+def test_llm_ledger_reports():
+    """Calls recorded in llm_calls feed the latency, token and cost reports"""
+    db = Database(":memory:")
+    for latency in range(1, 11):
+        db.record_llm_call(None, "model-a", "ok", input_tokens=1000, output_tokens=100,
+                           ttft_ms=latency, latency_ms=latency * 100)
+    db.record_llm_call(None, "model-a", "error", error="timeout")
+
+    percentiles = db.get_llm_latency_percentiles()
+    assert percentiles == {'latency_p50': 500, 'latency_p95': 1000, 'ttft_p50': 5, 'ttft_p95': 10}
+
+    [day] = db.get_llm_tokens_per_day()
+    assert (day['calls'], day['input_tokens'], day['output_tokens']) == (11, 10_000, 1000)
+
+    pricing = {"model-a": {"input": 3.0, "output": 15.0}}
+    assert db.get_llm_cost_per_completed_lead(pricing) is None
+    db.add_user(1)
+    db.complete_conversation(db.start_conversation(1))
+    assert abs(db.get_llm_cost_per_completed_lead(pricing) - 0.045) < 1e-9
+    db.close()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("DATABASE TEST SCRIPT")
+    print("=" * 60)
+
+    test_migrations_set_user_version()
+    print("✓ Migrations applied")
+
+    test_hot_queries_use_indexes()
+    print("✓ Hot queries use indexes")
+
+    test_write_behind_retries_failed_batch_in_order()
+    print("✓ Failed write-behind batch is retried in order")
+
+    test_write_behind_close_raises_on_lost_rows()
+    print("✓ Write-behind close reports lost rows")
+
+    test_write_behind_isolates_permanent_failure()
+    print("✓ Permanent write failure is isolated")
+
+    test_dedup_migration_keeps_first_result()
+    print("✓ Dedup migration keeps the first result")
+
+    test_llm_ledger_reports()
+    print("✓ LLM ledger reports")
+
+    test_repeated_answer_replaces_previous()
+    print("✓ Repeated answer replaces the previous one")
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Test script for the SQLite generation job queue and its worker pool
+"""
+
+import asyncio
+import time
+
+from async_database import AsyncDatabase
+from database import Database
+from generation_jobs import GenerationWorkerPool
+
+
+def test_enqueue_deduplicates_same_answers():
+    """The same conversation and answers reuse the existing job until it fails"""
+    db = Database(":memory:")
+
+    job_id, created = db.enqueue_generation_job(1, 10, 100, 1000, "hash-a")
+    assert created
+    assert db.enqueue_generation_job(1, 10, 100, 1001, "hash-a") == (job_id, False)
+
+    other_id, created = db.enqueue_generation_job(1, 10, 100, 1002, "hash-b")
+    assert created and other_id != job_id
+
+    # A failed job no longer blocks a new attempt
+    db.claim_generation_job("w-0", 60)
+    db.fail_generation_job(job_id, "w-0", "boom", retry=False)
+    retry_id, created = db.enqueue_generation_job(1, 10, 100, 1003, "hash-a")
+    assert created and retry_id not in (job_id, other_id)
+    db.close()
+
+
+def test_claim_lease_and_owner_checks():
+    """Only the lease owner can extend, complete or fail a job"""
+    db = Database(":memory:")
+    job_id, _ = db.enqueue_generation_job(1, 10, 100, 1000, "hash")
+
+    job = db.claim_generation_job("w-0", 60)
+    assert job["id"] == job_id and job["attempts"] == 1
+    assert db.claim_generation_job("w-1", 60) is None, "leased job was claimed twice"
+
+    assert db.extend_generation_lease(job_id, "w-0", 60)
+    assert not db.extend_generation_lease(job_id, "w-1", 60)
+    assert not db.complete_generation_job(job_id, "w-1")
+    assert not db.fail_generation_job(job_id, "w-1", "boom", retry=True)
+
+    assert db.complete_generation_job(job_id, "w-0")
+    assert not db.complete_generation_job(job_id, "w-0"), "completed twice"
+    db.close()
+
+
+def test_expired_lease_is_reclaimed():
+    """A job whose lease expired is picked up by another worker"""
+    db = Database(":memory:")
+    job_id, _ = db.enqueue_generation_job(1, 10, 100, 1000, "hash")
+
+    db.claim_generation_job("w-0", 0.01)
+    time.sleep(0.02)
+    job = db.claim_generation_job("w-1", 60)
+    assert job["id"] == job_id and job["attempts"] == 2
+
+    # The old owner lost the job and cannot report it
+    assert not db.complete_generation_job(job_id, "w-0")
+    assert db.complete_generation_job(job_id, "w-1")
+    db.close()
+
+
+def test_recover_only_own_jobs():
+    """Recovery with an owner prefix leaves other processes' jobs running"""
+    db = Database(":memory:")
+    for conversation_id in (1, 2):
+        db.enqueue_generation_job(conversation_id, 10, 100, 1000, "hash")
+    mine = db.claim_generation_job("worker-1-0", 60)
+    theirs = db.claim_generation_job("worker-10-0", 60)
+
+    assert db.recover_generation_jobs("worker-1") == 1
+    assert db.claim_generation_job("worker-1-0", 60)["id"] == mine["id"]
+    assert db.claim_generation_job("worker-1-0", 60) is None
+
+    assert db.recover_generation_jobs() == 2
+    assert not db.complete_generation_job(theirs["id"], "worker-10-0")
+    db.close()
+
+
+def test_claim_respects_shard():
+    """A supervisor worker only claims jobs of the users routed to it"""
+    db = Database(":memory:")
+    for user_id in (10, 11, 12, 13):
+        db.enqueue_generation_job(user_id, user_id, 100, 1000, "hash")
+
+    even = [db.claim_generation_job("worker0-0", 60, (0, 2))["user_id"] for _ in range(2)]
+    assert even == [10, 12]
+    assert db.claim_generation_job("worker0-0", 60, (0, 2)) is None
+    assert db.claim_generation_job("worker1-0", 60, (1, 2))["user_id"] == 11
+    db.close()
+
+
+def test_queue_position():
+    """Position counts pending jobs up to and including this one"""
+    db = Database(":memory:")
+    ids = [db.enqueue_generation_job(n, 10, 100, 1000, "hash")[0] for n in range(1, 4)]
+
+    assert [db.get_generation_queue_position(job_id) for job_id in ids] == [1, 2, 3]
+    db.claim_generation_job("w-0", 60)
+    assert [db.get_generation_queue_position(job_id) for job_id in ids] == [0, 1, 2]
+    db.close()
+
+
+def test_lost_lease_cancels_handler():
+    """A worker stops its handler once another worker owns the job"""
+    db = AsyncDatabase(Database(":memory:"))
+    pool = GenerationWorkerPool(db, workers=1, lease_seconds=0.06, poll_interval=0.01)
+    cancelled = asyncio.Event()
+
+    async def handler(job):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def run():
+        job_id, _ = await pool.enqueue(1, 10, 100, 1000, "hash")
+        await pool.start(handler, recover=False)
+        while pool.in_progress == 0:
+            await asyncio.sleep(0.005)
+
+        # Another process steals the job (its lease owner changes)
+        db.db.recover_generation_jobs()
+        db.db.claim_generation_job("other-0", 60)
+
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        await pool.stop()
+        return job_id
+
+    job_id = asyncio.run(run())
+    assert db.db.complete_generation_job(job_id, "other-0")
+    db.shutdown()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("GENERATION JOBS TEST SCRIPT")
+    print("=" * 60)
+
+    test_enqueue_deduplicates_same_answers()
+    print("✓ Enqueue deduplicates identical requests")
+
+    test_claim_lease_and_owner_checks()
+    print("✓ Lease owner checks")
+
+    test_expired_lease_is_reclaimed()
+    print("✓ Expired lease is reclaimed")
+
+    test_recover_only_own_jobs()
+    print("✓ Recovery respects owner prefix")
+
+    test_claim_respects_shard()
+    print("✓ Claims respect the worker shard")
+
+    test_queue_position()
+    print("✓ Queue position")
+
+    test_lost_lease_cancels_handler()
+    print("✓ Lost lease cancels the handler")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test script for hedged Claude requests: hedge deadline from the TTFT percentile,
+hedge budget and exported counters
+"""
+
+import asyncio
+
+from hedging import HedgePolicy, hedged_stream
+from metrics import HEDGE_REQUESTS
+
+
+def test_deadline_follows_ttft_percentile():
+    """initial_delay until enough samples, then the percentile clamped by min_delay"""
+    policy = HedgePolicy(percentile=0.9, min_delay=0.5, initial_delay=5.0, min_samples=10)
+    for seconds in range(1, 10):
+        policy.record_ttft(float(seconds))
+    assert policy.deadline() == 5.0
+
+    policy.record_ttft(10.0)
+    assert policy.deadline() == 10.0
+
+    fast = HedgePolicy(percentile=0.9, min_delay=0.5, min_samples=10)
+    for _ in range(10):
+        fast.record_ttft(0.1)
+    assert fast.deadline() == 0.5
+
+
+def test_budget_limits_hedge_share():
+    """Hedges stay within budget_ratio of all requests"""
+    policy = HedgePolicy(budget_ratio=0.1)
+    policy.requests = 9
+    assert not policy.can_hedge()
+
+    policy.requests = 10
+    assert policy.can_hedge()
+    policy.hedges_started = 1
+    assert not policy.can_hedge()
+
+
+def make_stream(delays):
+    """Each call starts the next request, which answers after its delay"""
+    delays = iter(delays)
+
+    def start():
+        delay = next(delays)
+
+        async def stream():
+            await asyncio.sleep(delay)
+            yield f"after {delay}"
+        return stream()
+    return start
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_slow_primary_is_hedged():
+    """A hedge sent after the deadline wins over a slow primary and is counted"""
+    policy = HedgePolicy(initial_delay=0.02, budget_ratio=1.0)
+    sent, won = HEDGE_REQUESTS.value(outcome='sent'), HEDGE_REQUESTS.value(outcome='won')
+
+    assert asyncio.run(collect(hedged_stream(make_stream([1.0, 0.01]), policy))) == ["after 0.01"]
+    assert (policy.hedges_started, policy.hedge_wins) == (1, 1)
+    assert HEDGE_REQUESTS.value(outcome='sent') == sent + 1
+    assert HEDGE_REQUESTS.value(outcome='won') == won + 1
+
+
+def test_hedge_denied_by_budget():
+    """Without budget the slow primary is awaited and the denial is counted"""
+    policy = HedgePolicy(initial_delay=0.01, budget_ratio=0.1)
+    denied = HEDGE_REQUESTS.value(outcome='budget_denied')
+
+    assert asyncio.run(collect(hedged_stream(make_stream([0.03]), policy))) == ["after 0.03"]
+    assert (policy.hedges_started, policy.skipped_by_budget) == (0, 1)
+    assert HEDGE_REQUESTS.value(outcome='budget_denied') == denied + 1
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("HEDGING TEST SCRIPT")
+    print("=" * 60)
+
+    test_deadline_follows_ttft_percentile()
+    print("✓ Deadline follows the TTFT percentile")
+
+    test_budget_limits_hedge_share()
+    print("✓ Budget limits the hedge share")
+
+    test_slow_primary_is_hedged()
+    print("✓ Slow primary is hedged")
+
+    test_hedge_denied_by_budget()
+    print("✓ Hedge denied by budget")
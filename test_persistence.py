@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Test script for SQLite persistence of ConversationHandler states and user_data
+"""
+
+import asyncio
+import os
+import tempfile
+
+from async_database import AsyncDatabase
+from database import Database
+from persistence import SQLitePersistence
+
+
+def test_states_and_user_data_survive_restart():
+    """Written states and user_data are loaded back by a new process"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bot.db")
+
+        async def before_restart():
+            db = AsyncDatabase(Database(path))
+            persistence = SQLitePersistence(db)
+            await persistence.update_conversation('ai_dialog', (1, 1), 0)
+            await persistence.update_conversation('ai_dialog', (2, 2), 0)
+            await persistence.update_user_data(1, {'conversation_id': 7, 'current_question': 3})
+            await persistence.update_user_data(2, {'conversation_id': 8})
+            # The second dialog ended and its user was dropped
+            await persistence.update_conversation('ai_dialog', (2, 2), None)
+            await persistence.drop_user_data(2)
+            await persistence.flush()
+            db.shutdown()
+            return persistence.batches
+
+        async def after_restart():
+            db = AsyncDatabase(Database(path))
+            persistence = SQLitePersistence(db)
+            states = await persistence.get_conversations('ai_dialog')
+
+            user_data = {'current_question': 4}
+            await persistence.refresh_user_data(1, user_data)
+            dropped = {}
+            await persistence.refresh_user_data(2, dropped)
+            db.shutdown()
+            return states, user_data, dropped, persistence.lazy_loads
+
+        assert asyncio.run(before_restart()) == 1, "updates were not batched"
+        states, user_data, dropped, lazy_loads = asyncio.run(after_restart())
+
+    assert states == {(1, 1): 0}
+    # Values set by handlers before the lazy load win over stored ones
+    assert user_data == {'conversation_id': 7, 'current_question': 4}
+    assert dropped == {}
+    assert lazy_loads == 1
+
+
+def test_failed_write_is_kept_for_retry():
+    """Changes that could not be written stay buffered without overwriting newer ones"""
+    db = AsyncDatabase(Database(":memory:"))
+    persistence = SQLitePersistence(db)
+    save = db.save_persistence
+
+    async def broken(users, states):
+        raise OSError("disk full")
+
+    async def run():
+        db.save_persistence = broken
+        await persistence.update_user_data(1, {'step': 1})
+        await persistence.flush()
+        assert persistence._dirty_users == {1: {'step': 1}}
+
+        db.save_persistence = save
+        await persistence.update_user_data(1, {'step': 2})
+        await persistence.flush()
+        return await db.get_user_data(1)
+
+    assert asyncio.run(run()) == {'step': 2}
+    db.shutdown()
+
+
+def test_loaded_users_are_bounded():
+    """Only max_loaded users are remembered; an evicted one is reloaded from the DB"""
+    db = AsyncDatabase(Database(":memory:"))
+    persistence = SQLitePersistence(db, max_loaded=2)
+
+    async def run():
+        await persistence.update_user_data(1, {'step': 1})
+        await persistence.flush()
+        for user_id in (1, 2, 3):
+            await persistence.refresh_user_data(user_id, {})
+        assert list(persistence._loaded) == [2, 3]
+
+        user_data = {}
+        await persistence.refresh_user_data(1, user_data)
+        assert list(persistence._loaded) == [3, 1]
+        return user_data
+
+    assert asyncio.run(run()) == {'step': 1}
+    assert persistence.lazy_loads == 2
+    db.shutdown()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("PERSISTENCE TEST SCRIPT")
+    print("=" * 60)
+
+    test_states_and_user_data_survive_restart()
+    print("✓ States and user_data survive a restart")
+
+    test_failed_write_is_kept_for_retry()
+    print("✓ Failed write is kept for retry")
+
+    test_loaded_users_are_bounded()
+    print("✓ Loaded users are bounded")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Test script for the token bucket and the per-user flood control limiter
+"""
+
+from rate_limit import TokenBucket, UserRateLimiter
+
+
+def test_token_bucket_refill_and_block():
+    """Burst is spent at once, then tokens come back at rate; block() pauses them"""
+    bucket = TokenBucket(rate=2.0, burst=3.0, now=0.0)
+    assert [bucket.try_consume(0.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay(0.0) == 0.5
+
+    assert bucket.try_consume(0.5)
+    assert not bucket.try_consume(0.5)
+
+    bucket.block(1.0, 5.0)
+    assert bucket.delay(1.0) == 5.0
+    assert not bucket.try_consume(3.0), "tokens handed out while blocked"
+    assert bucket.try_consume(6.0)
+
+    assert bucket.is_full(100.0)
+
+
+def test_user_limiter_is_per_user():
+    """One user exhausting the limit does not affect another"""
+    limiter = UserRateLimiter(rate=1.0, burst=2.0)
+    assert [limiter.allow(1, now=0.0) for _ in range(3)] == [True, True, False]
+    assert limiter.allow(2, now=0.0)
+    assert limiter.allow(1, now=1.0)
+    assert (limiter.allowed, limiter.rejected) == (4, 1)
+
+
+def test_user_limiter_forgets_full_buckets():
+    """Buckets that refilled completely are dropped on cleanup"""
+    limiter = UserRateLimiter(rate=1.0, burst=2.0, cleanup_interval=10.0)
+    limiter.allow(1, now=0.0)
+    limiter.allow(2, now=0.0)
+    limiter.allow(2, now=0.0)
+    assert len(limiter) == 2
+
+    limiter.cleanup(now=1.5)
+    assert len(limiter) == 1, "user 1 refilled, user 2 did not"
+
+    # Cleanup also runs on its own once cleanup_interval has passed
+    limiter.allow(3, now=20.0)
+    assert len(limiter) == 1
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("RATE LIMIT TEST SCRIPT")
+    print("=" * 60)
+
+    test_token_bucket_refill_and_block()
+    print("✓ Token bucket refill and block")
+
+    test_user_limiter_is_per_user()
+    print("✓ Limits are per user")
+
+    test_user_limiter_forgets_full_buckets()
+    print("✓ Full buckets are forgotten")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-model circuit breaker and its half-open probe
+"""
+
+import asyncio
+import time
+
+from ai_questions import AIAgent
+from resilience import CircuitBreaker
+
+
+def open_breaker(breaker: CircuitBreaker):
+    """Trip the breaker and wait until it is ready for a probe"""
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    time.sleep(breaker.reset_timeout + 0.01)
+
+
+def test_half_open_allows_single_probe():
+    """After reset_timeout exactly one probe is let through"""
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow(), "one failure is below the threshold"
+
+    open_breaker(breaker)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow(), "second probe while the first is running"
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens():
+    """A failed probe opens the breaker for another reset_timeout"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    open_breaker(breaker)
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_released_or_stale_probe_is_replaced():
+    """A probe without an outcome does not disable the model forever"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    open_breaker(breaker)
+    assert breaker.allow()
+
+    breaker.release()
+    assert breaker.allow(), "released probe frees the slot"
+
+    # Probe that never reports back is replaced after reset_timeout
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+
+def test_cancelled_stream_releases_probe():
+    """Cancelling the generation during a probe leaves the model usable"""
+    agent = AIAgent(api_key="test", models=["model-a"],
+                    breaker_threshold=1, breaker_reset_timeout=0.01)
+
+    async def hanging_attempt(model, answers, conversation_id):
+        await asyncio.sleep(10)
+        yield "never"
+
+    agent._stream_attempt = hanging_attempt
+    breaker = agent.breakers["model-a"]
+    open_breaker(breaker)
+
+    async def run():
+        async def consume():
+            async for _ in agent._stream_with_fallback([]):
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.02)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow(), "probe was not released after cancellation"
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("CIRCUIT BREAKER TEST SCRIPT")
+    print("=" * 60)
+
+    test_half_open_allows_single_probe()
+    print("✓ Half-open state allows a single probe")
+
+    test_failed_probe_reopens()
+    print("✓ Failed probe reopens the breaker")
+
+    test_released_or_stale_probe_is_replaced()
+    print("✓ Released or stale probe is replaced")
+
+    test_cancelled_stream_releases_probe()
+    print("✓ Cancelled generation releases the probe")
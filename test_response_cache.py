@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test script for the scenario cache: only primary-model answers are cached,
+expired rows are purged
+"""
+
+import asyncio
+
+from ai_questions import AIAgent
+from async_database import AsyncDatabase
+from database import Database
+from metrics import SCENARIO_CACHE_LOOKUPS
+from response_cache import ScenarioCache
+
+ANSWERS = [{'question_number': 1, 'question_text': 'Question 1', 'answer': 'Retail'}]
+
+
+def make_agent(cache: ScenarioCache) -> AIAgent:
+    agent = AIAgent(api_key="test", models=["primary", "fallback"], cache=cache,
+                    breaker_threshold=1, breaker_reset_timeout=60)
+
+    async def attempt(model, answers, conversation_id):
+        yield f"answer from {model}"
+
+    agent._stream_attempt = attempt
+    return agent
+
+
+def test_fallback_answer_is_not_cached():
+    """A fallback model's answer is neither served for the primary nor stored"""
+    db = AsyncDatabase(Database(":memory:"))
+    cache = ScenarioCache(db)
+    agent = make_agent(cache)
+    misses = SCENARIO_CACHE_LOOKUPS.value(result='miss')
+
+    async def run():
+        agent.breakers["primary"].record_failure()
+        assert await agent.generate_scenarios_async(ANSWERS) == "answer from fallback"
+        with db.db._reader() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM scenario_cache").fetchone()[0] == 0
+
+        # The primary model recovered: its answer is generated, not taken from the cache
+        agent.breakers["primary"].record_success()
+        assert await agent.generate_scenarios_async(ANSWERS) == "answer from primary"
+        assert await agent.generate_scenarios_async(ANSWERS) == "answer from primary"
+
+    asyncio.run(run())
+    assert cache.stats() == {'front_hits': 1, 'db_hits': 0, 'misses': 2}
+    assert SCENARIO_CACHE_LOOKUPS.value(result='miss') == misses + 2
+    db.shutdown()
+
+
+def test_purge_expired_deletes_old_rows():
+    """The background purge removes rows older than the TTL"""
+    db = AsyncDatabase(Database(":memory:"))
+    cache = ScenarioCache(db, ttl_seconds=0)
+
+    async def run():
+        await cache.put("key", "primary", "v1", "text")
+        await asyncio.sleep(0.01)
+        task = asyncio.create_task(cache.purge_expired(0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return await db.get_cached_response("key", 3600)
+
+    assert asyncio.run(run()) is None
+    db.shutdown()
+
+
+def test_front_cache_keeps_db_expiry():
+    """An entry read from SQLite expires from memory at its original created_at + TTL"""
+    db = AsyncDatabase(Database(":memory:"))
+    writer = ScenarioCache(db, ttl_seconds=0.2)
+    reader = ScenarioCache(db, ttl_seconds=0.2)
+
+    async def run():
+        await writer.put("key", "primary", "v1", "text")
+        await asyncio.sleep(0.15)
+        assert await reader.get("key") == "text"
+        await asyncio.sleep(0.1)
+        return await reader.get("key")
+
+    assert asyncio.run(run()) is None, "entry outlived its TTL in the front cache"
+    assert reader.stats() == {'front_hits': 0, 'db_hits': 1, 'misses': 1}
+    db.shutdown()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("SCENARIO CACHE TEST SCRIPT")
+    print("=" * 60)
+
+    test_fallback_answer_is_not_cached()
+    print("✓ Fallback answer is not cached")
+
+    test_purge_expired_deletes_old_rows()
+    print("✓ Expired rows are purged")
+
+    test_front_cache_keeps_db_expiry()
+    print("✓ Front cache keeps the database expiry")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test script for the outbound send scheduler: coalesced message edits,
+RetryAfter handling and per-chat ordering
+"""
+
+import asyncio
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+from send_scheduler import SendScheduler, BULK
+
+
+def test_pending_edits_are_coalesced():
+    """Edits of the same message waiting for the chat limit collapse into the last one"""
+    sent = []
+
+    def edit(text):
+        async def call():
+            sent.append(text)
+            return text
+        return call
+
+    async def run():
+        scheduler = SendScheduler(global_rate=100, chat_rate=20, chat_burst=1)
+        first = asyncio.create_task(scheduler.submit(1, edit("v1"), BULK, coalesce_key="msg"))
+        await asyncio.sleep(0.01)
+        # The chat bucket is empty now: these three wait and are merged
+        results = await asyncio.gather(*(
+            scheduler.submit(1, edit(text), BULK, coalesce_key="msg")
+            for text in ("v2", "v3", "v4")
+        ))
+        await first
+        await scheduler.stop()
+        return results
+
+    assert asyncio.run(run()) == ["v4", "v4", "v4"]
+    assert sent == ["v1", "v4"]
+
+
+def test_retry_after_pauses_and_retries():
+    """A 429 blocks sending for retry_after and the request is retried"""
+    attempts = []
+
+    async def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RetryAfter(timedelta(milliseconds=100))
+        return "ok"
+
+    async def run():
+        scheduler = SendScheduler(global_rate=100, chat_rate=100, chat_burst=10)
+        result = await scheduler.submit(1, flaky)
+        await scheduler.stop()
+        return result
+
+    assert asyncio.run(run()) == "ok"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.09
+
+
+def test_chat_order_is_preserved():
+    """Requests of one chat run one at a time in submission order"""
+    log = []
+
+    def message(n):
+        async def call():
+            log.append(("start", n))
+            await asyncio.sleep(0.005)
+            log.append(("end", n))
+        return call
+
+    async def run():
+        scheduler = SendScheduler(global_rate=1000, chat_rate=1000, chat_burst=10)
+        await asyncio.gather(*(scheduler.submit(1, message(n)) for n in range(3)))
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert log == [(event, n) for n in range(3) for event in ("start", "end")]
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("SEND SCHEDULER TEST SCRIPT")
+    print("=" * 60)
+
+    test_pending_edits_are_coalesced()
+    print("✓ Pending edits are coalesced")
+
+    test_retry_after_pauses_and_retries()
+    print("✓ RetryAfter pauses and retries")
+
+    test_chat_order_is_preserved()
+    print("✓ Chat order is preserved")
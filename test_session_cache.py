@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-memory questionnaire cache: LRU/TTL eviction and
+the database fallback on a miss
+"""
+
+import asyncio
+import time
+
+from async_database import AsyncDatabase
+from database import Database
+from session_cache import SessionCache
+
+
+def make_cache(**kwargs):
+    return SessionCache(AsyncDatabase(Database(":memory:")), **kwargs)
+
+
+async def answer(sessions, user_id, conversation_id, number, text):
+    await sessions.save_answer(user_id, conversation_id, number, f"Question {number}", text)
+
+
+def test_lru_and_ttl_eviction():
+    """The least recently used session goes first; stale sessions expire"""
+    sessions = make_cache(max_size=2, ttl_seconds=0.05)
+
+    async def run():
+        for user_id in (1, 2):
+            await sessions.start_conversation(user_id)
+        sessions.get(1)
+        await sessions.start_conversation(3)
+        assert sessions.get(2) is None, "LRU session was not evicted"
+        assert sessions.get(1) and sessions.get(3)
+
+        time.sleep(0.06)
+        assert sessions.get(1) is None and len(sessions) == 1
+        sessions.evict()
+        assert len(sessions) == 0
+
+    asyncio.run(run())
+    sessions.db.shutdown()
+
+
+def test_miss_restores_session_from_db():
+    """An evicted session is rebuilt from the database on the next read"""
+    sessions = make_cache()
+
+    async def run():
+        conversation_id = await sessions.start_conversation(1)
+        await answer(sessions, 1, conversation_id, 1, "retail")
+        sessions.finish(1)
+
+        answers = await sessions.get_answers(1, conversation_id)
+        assert [a['answer'] for a in answers] == ["retail"]
+        assert sessions.misses == 1
+        assert sessions.get(1).current_question == 2
+
+        await sessions.get_answers(1, conversation_id)
+        assert sessions.hits == 1
+
+    asyncio.run(run())
+    sessions.db.shutdown()
+
+
+def test_old_conversation_does_not_replace_current_session():
+    """Reading a finished conversation keeps the questionnaire the user restarted"""
+    sessions = make_cache()
+
+    async def run():
+        old_id = await sessions.start_conversation(1)
+        await answer(sessions, 1, old_id, 1, "old answer")
+        new_id = await sessions.start_conversation(1)
+        await answer(sessions, 1, new_id, 1, "new answer")
+
+        # The queued generation of the old conversation reads its answers and finishes
+        old_answers = await sessions.get_answers(1, old_id)
+        assert [a['answer'] for a in old_answers] == ["old answer"]
+        sessions.finish(1, old_id)
+
+        session = sessions.get(1)
+        assert session.conversation_id == new_id
+        assert [a['answer'] for a in session.answers] == ["new answer"]
+
+    asyncio.run(run())
+    sessions.db.shutdown()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("SESSION CACHE TEST SCRIPT")
+    print("=" * 60)
+
+    test_lru_and_ttl_eviction()
+    print("✓ LRU and TTL eviction")
+
+    test_miss_restores_session_from_db()
+    print("✓ Miss restores the session from the database")
+
+    test_old_conversation_does_not_replace_current_session()
+    print("✓ Old conversation does not replace the current session")
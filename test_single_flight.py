@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Test script for single-flight generations: concurrent calls with the same key
+share one result, errors and cancellations are handled per caller
+"""
+
+import asyncio
+
+from single_flight import SingleFlight, answers_hash
+
+
+async def call(flights: SingleFlight, key, work):
+    """join-or-lead the way AIAgent.stream_scenarios does it"""
+    joined, shared = await flights.join(key)
+    if joined:
+        return shared
+    with flights.lead(key) as flight:
+        result = await work()
+        flight.set_result(result)
+        return result
+
+
+def test_concurrent_calls_share_one_result():
+    """Only the leader runs the work; the others get its result"""
+    flights = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "scenarios"
+
+    async def run():
+        return await asyncio.gather(*(call(flights, "key", work) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["scenarios"] * 5
+    assert len(runs) == 1
+    assert (flights.led, flights.shared, len(flights)) == (1, 4, 0)
+
+
+def test_leader_error_reaches_waiters():
+    """Waiters see the leader's exception instead of hanging"""
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("claude down")
+
+    async def run():
+        return await asyncio.gather(*(call(flights, "key", work) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert "key" not in flights
+
+
+def test_cancelled_leader_hands_over():
+    """Cancelling the leader makes a waiter run the work itself"""
+    flights = SingleFlight()
+    started = []
+
+    async def work():
+        started.append(1)
+        await asyncio.sleep(0.02)
+        return "scenarios"
+
+    async def run():
+        leader = asyncio.create_task(call(flights, "key", work))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(call(flights, "key", work))
+        await asyncio.sleep(0.005)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(run()) == "scenarios"
+    assert len(started) == 2
+
+
+def test_answers_hash_ignores_order():
+    """The same answers in a different order give the same key"""
+    a = {'question_number': 1, 'answer': 'retail'}
+    b = {'question_number': 2, 'answer': 'sales'}
+    assert answers_hash([a, b]) == answers_hash([b, a])
+    assert answers_hash([a, b]) != answers_hash([a, dict(b, answer='support')])
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("SINGLE FLIGHT TEST SCRIPT")
+    print("=" * 60)
+
+    test_concurrent_calls_share_one_result()
+    print("✓ Concurrent calls share one result")
+
+    test_leader_error_reaches_waiters()
+    print("✓ Leader error reaches waiters")
+
+    test_cancelled_leader_hands_over()
+    print("✓ Cancelled leader hands over")
+
+    test_answers_hash_ignores_order()
+    print("✓ Answers hash ignores order")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that abandoned speculative generations are cleaned up
+"""
+
+import asyncio
+import time
+
+from speculative import SpeculativeGenerator, parse_budget
+
+
+class FakeAgent:
+    """Agent with two questions whose generation never finishes on its own"""
+
+    def get_total_questions(self):
+        return 2
+
+    def get_question_by_number(self, number):
+        return {'text': f'Question {number}'}
+
+    async def generate_scenarios_async(self, answers, conversation_id=None):
+        await asyncio.sleep(10)
+        return "scenarios"
+
+
+ANSWERS = [{'question_number': 1, 'question_text': 'Question 1', 'answer': 'retail'}]
+
+
+def test_abandoned_speculations_expire():
+    """Speculations older than max_age are cancelled when a new one starts"""
+    async def run():
+        generator = SpeculativeGenerator(FakeAgent(), max_age=0.05)
+        generator.start(1, ANSWERS)
+        old = generator._speculations[1].task
+
+        time.sleep(0.06)
+        generator.start(2, ANSWERS)
+        await asyncio.sleep(0)
+
+        assert list(generator._speculations) == [2]
+        assert old.cancelled()
+
+        generator.cancel(2)
+        generator.cancel(None)
+        assert not generator._speculations
+
+    asyncio.run(run())
+
+
+def test_background_sweep_without_new_speculations():
+    """The periodic sweep drops expired speculations even if none start afterwards"""
+    async def run():
+        generator = SpeculativeGenerator(FakeAgent(), max_age=0.02)
+        generator.start(1, ANSWERS)
+        task = generator._speculations[1].task
+        sweeper = asyncio.create_task(generator.sweep_expired(0.01))
+        await asyncio.sleep(0.06)
+        sweeper.cancel()
+
+        assert not generator._speculations
+        assert task.cancelled()
+
+    asyncio.run(run())
+
+
+def test_parse_budget_units_are_whole_words():
+    """Units count only as whole words, so "месяца" or "min" are not thousands or millions"""
+    cases = {
+        "50к": 50_000,
+        "100 тыс. рублей": 100_000,
+        "50 тысяч": 50_000,
+        "1.5 млн": 1_500_000,
+        "2 миллиона в год": 2_000_000,
+        "50 000 рублей в месяц": 50_000,
+        "2 месяца": 2,
+        "3 мин": 3,
+        "5 min": 5,
+        "7 тарифов": 7,
+        "не знаю": None,
+    }
+    assert {text: parse_budget(text) for text in cases} == cases
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("SPECULATIVE GENERATION TEST SCRIPT")
+    print("=" * 60)
+
+    test_abandoned_speculations_expire()
+    print("✓ Abandoned speculations expire")
+
+    test_background_sweep_without_new_speculations()
+    print("✓ Background sweep drops expired speculations")
+
+    test_parse_budget_units_are_whole_words()
+    print("✓ Budget units are whole words")
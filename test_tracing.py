@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that the sampling decision is made once per trace
+"""
+
+import os
+import tempfile
+
+from tracing import Tracer, current_span, load_traces
+
+
+def test_children_follow_root_sampling():
+    """Spans under an unsampled root are dropped instead of starting new traces"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "traces.jsonl")
+        tracer = Tracer()
+        tracer.configure(0.5, path)
+
+        for _ in range(200):
+            with tracer.span("handler") as root:
+                with tracer.span("db") as child:
+                    assert (root is None) == (child is None)
+                    assert current_span() is child
+            assert current_span() is None
+        tracer.close()
+
+        traces = load_traces(path)
+        assert 0 < len(traces) < 200
+        for spans in traces.values():
+            assert sorted(span["name"] for span in spans) == ["db", "handler"]
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TRACING TEST SCRIPT")
+    print("=" * 60)
+
+    test_children_follow_root_sampling()
+    print("✓ Child spans follow the root sampling decision")
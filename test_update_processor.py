@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Test script for per-user ordered update processing
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import UserOrderedUpdateProcessor
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    user = User(user_id, f"user{user_id}", False)
+    message = Message(update_id, datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=user)
+    return Update(update_id, message=message)
+
+
+def test_one_user_burst_does_not_block_others():
+    """A burst from one user keeps its order and does not hold the global slots"""
+    processor = UserOrderedUpdateProcessor(4)
+    order = []
+
+    async def slow(n):
+        await asyncio.sleep(0.05)
+        order.append(n)
+
+    async def instant(ran_at):
+        ran_at.append(time.monotonic())
+
+    async def run():
+        burst = [asyncio.create_task(processor.process_update(make_update(n, 1), slow(n)))
+                 for n in range(8)]
+        await asyncio.sleep(0.01)
+
+        ran_at = []
+        started = time.monotonic()
+        await processor.process_update(make_update(100, 2), instant(ran_at))
+        waited = ran_at[0] - started
+
+        await asyncio.gather(*burst)
+        return waited
+
+    waited = asyncio.run(run())
+    assert waited < 0.03, f"second user waited {waited:.2f} s behind the first user's burst"
+    assert order == list(range(8))
+    assert len(processor) == 0
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("UPDATE PROCESSOR TEST SCRIPT")
+    print("=" * 60)
+
+    test_one_user_burst_does_not_block_others()
+    print("✓ One user's burst does not block other users")
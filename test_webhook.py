@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test script for the webhook server: secret check, malformed requests,
+chunked bodies and slow clients
+"""
+
+import asyncio
+import json
+
+from webhook import WebhookServer, require_secret
+
+SECRET = "test-secret"
+
+
+async def start_server(**kwargs):
+    received = []
+
+    async def sink(data):
+        received.append(data)
+
+    server = WebhookServer(sink, listen="127.0.0.1", port=0, url_path="/telegram",
+                           secret_token=SECRET, **kwargs)
+    await server.start()
+    return server, received
+
+
+async def exchange(port: int, raw: bytes) -> int:
+    """Send raw bytes and return the response status (0 if the server closed the connection)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(raw)
+        await writer.drain()
+        line = await reader.readline()
+        return int(line.split()[1]) if line else 0
+    finally:
+        writer.close()
+
+
+def post(body: bytes, secret: str = SECRET, extra: str = "") -> bytes:
+    head = ("POST /telegram HTTP/1.1\r\nHost: localhost\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n{extra}")
+    if "Transfer-Encoding" not in extra and "Content-Length" not in extra:
+        head += f"Content-Length: {len(body)}\r\n"
+    return (head + "\r\n").encode("latin-1") + body
+
+
+def test_statuses():
+    """Valid, unauthorized, malformed, non-object, chunked and oversized requests"""
+    async def run():
+        server, received = await start_server()
+        update = json.dumps({"update_id": 1}).encode()
+        try:
+            assert await exchange(server.port, post(update)) == 200
+            assert await exchange(server.port, post(update, secret="wrong")) == 403
+            assert await exchange(server.port, b"GARBAGE\r\n\r\n") == 400
+            for body in (b"[1]", b'"s"', b"5", b"not json"):
+                assert await exchange(server.port, post(body)) == 400, body
+            assert await exchange(server.port, post(b"", extra="Content-Length: abc\r\n")) == 400
+            assert await exchange(server.port, post(b"", extra="Content-Length: 99999999\r\n")) == 400
+
+            chunked = b"5\r\n" + update[:5] + b"\r\n" + f"{len(update) - 5:x}\r\n".encode() \
+                + update[5:] + b"\r\n0\r\n\r\n"
+            assert await exchange(server.port, post(chunked, extra="Transfer-Encoding: chunked\r\n")) == 200
+            assert await exchange(server.port, post(b"", extra="Transfer-Encoding: gzip\r\n")) == 400
+            assert await exchange(server.port, b"GET /telegram HTTP/1.1\r\nHost: x\r\n\r\n") == 405
+            assert await exchange(server.port, post(b"{}").replace(b"/telegram", b"/other")) == 404
+        finally:
+            await server.stop()
+        return received
+
+    received = asyncio.run(run())
+    assert received == [{"update_id": 1}, {"update_id": 1}]
+
+
+def test_slow_client_is_disconnected():
+    """A client that never finishes its headers is dropped after header_timeout"""
+    async def run():
+        server, _ = await start_server(header_timeout=0.05)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(b"POST /telegram HTTP/1.1\r\nHost: local")
+            await writer.drain()
+            data = await asyncio.wait_for(reader.read(), timeout=1)
+            writer.close()
+            return data
+        finally:
+            await server.stop()
+
+    assert asyncio.run(run()) == b""
+
+
+def test_public_webhook_requires_secret():
+    """A registered URL or a non-loopback address without a secret is refused"""
+    require_secret("127.0.0.1", None, None)
+    require_secret("0.0.0.0", "https://example.com/telegram", SECRET)
+    for listen, url in (("127.0.0.1", "https://example.com/telegram"), ("0.0.0.0", None)):
+        try:
+            require_secret(listen, url, None)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"webhook on {listen} without a secret was accepted")
+
+    async def run():
+        server = WebhookServer(lambda data: None, listen="0.0.0.0", port=0)
+        try:
+            await server.start()
+        except ValueError:
+            return
+        await server.stop()
+        raise AssertionError("public webhook server started without a secret")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("WEBHOOK TEST SCRIPT")
+    print("=" * 60)
+
+    test_statuses()
+    print("✓ Response statuses")
+
+    test_slow_client_is_disconnected()
+    print("✓ Slow client is disconnected")
+
+    test_public_webhook_requires_secret()
+    print("✓ Public webhook requires a secret")
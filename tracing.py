@@ -0,0 +1,242 @@
+"""
+Трассировка с выборкой: вложенные спаны обработчик → БД → Claude
+пишутся в JSONL-файл в формате, близком к OTLP, для разбора задержек офлайн
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Текущий спан задачи/потока
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+# Метка трассы, не попавшей в выборку: дочерние спаны не должны разыгрывать выборку заново
+_UNSAMPLED = object()
+
+
+class Span:
+    """Один замер: имя, родитель, время начала и конца, атрибуты"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'error')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = 'ok'
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_error(self, error: BaseException):
+        self.status = 'error'
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> Dict:
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id,
+            'name': self.name,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'durationMs': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+            'status': {'code': self.status, 'message': self.error},
+        }
+
+
+class JsonlExporter:
+    """Дописывает завершённые спаны в файл, по одному JSON на строку"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Tracer:
+    """Создаёт спаны; решение о выборке принимается для корневого спана и наследуется"""
+
+    def __init__(self, sample_rate: float = 0.0, exporter: Optional[JsonlExporter] = None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None and self.sample_rate > 0
+
+    def configure(self, sample_rate: float, path: Optional[str] = None):
+        """Включить трассировку: доля трасс sample_rate, файл path"""
+        self.close()
+        self.sample_rate = sample_rate
+        self.exporter = JsonlExporter(path) if path and sample_rate > 0 else None
+        if self.exporter:
+            logger.info(f"Трассировка включена: {sample_rate:.0%} апдейтов, файл {path}")
+
+    def close(self):
+        if self.exporter:
+            self.exporter.close()
+            self.exporter = None
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """
+        Спан вокруг блока. Корневой спан попадает в выборку с вероятностью
+        sample_rate, дочерние пишутся только внутри выбранной трассы
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        parent = _current_span.get()
+        if parent is _UNSAMPLED:
+            yield None
+            return
+
+        if parent is None:
+            if random.random() >= self.sample_rate:
+                token = _current_span.set(_UNSAMPLED)
+                try:
+                    yield None
+                finally:
+                    _reset(token)
+                return
+            span = Span(name, os.urandom(16).hex(), attributes=attributes)
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _reset(token)
+            span.end_ns = time.time_ns()
+            self.exporter.export(span)
+
+
+def _reset(token: contextvars.Token):
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Асинхронный генератор закрыт из другого контекста
+        pass
+
+
+# Трассировщик процесса; выключен, пока не вызван configure()
+tracer = Tracer()
+
+
+def current_span() -> Optional[Span]:
+    span = _current_span.get()
+    return None if span is _UNSAMPLED else span
+
+
+def _update_attributes(args) -> Dict:
+    """Атрибуты апдейта Telegram, если он среди аргументов обработчика"""
+    for arg in args:
+        update_id = getattr(arg, 'update_id', None)
+        if update_id is not None:
+            user = getattr(arg, 'effective_user', None)
+            return {'update_id': update_id, 'user_id': user.id if user else None}
+    return {}
+
+
+def traced(name: Optional[str] = None):
+    """Декоратор: спан вокруг синхронной или асинхронной функции"""
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return await function(*args, **kwargs)
+                with tracer.span(span_name, **_update_attributes(args)):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with tracer.span(span_name, **_update_attributes(args)):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def load_traces(path: str) -> Dict[str, List[Dict]]:
+    """Прочитать файл спанов и сгруппировать по трассам"""
+    traces: Dict[str, List[Dict]] = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                traces.setdefault(span['traceId'], []).append(span)
+    return traces
+
+
+def format_trace(spans: List[Dict]) -> str:
+    """Дерево спанов одной трассы с длительностями и смещением от начала"""
+    children: Dict[Optional[str], List[Dict]] = {}
+    ids = {span['spanId'] for span in spans}
+    for span in sorted(spans, key=lambda s: s['startTimeUnixNano']):
+        parent = span['parentSpanId'] if span['parentSpanId'] in ids else None
+        children.setdefault(parent, []).append(span)
+
+    roots = children.get(None, [])
+    origin = roots[0]['startTimeUnixNano'] if roots else 0
+    lines = []
+
+    def walk(span: Dict, depth: int):
+        offset = (span['startTimeUnixNano'] - origin) / 1e6
+        status = '' if span['status']['code'] == 'ok' else f"  [{span['status']['message']}]"
+        lines.append(f"{'  ' * depth}{span['name']}: {span['durationMs']:.1f} мс (+{offset:.1f}){status}")
+        for child in children.get(span['spanId'], []):
+            walk(child, depth + 1)
+
+    for root in roots:
+        walk(root, 0)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # python tracing.py traces.jsonl — разбивка задержек по каждой трассе
+    for trace_id, spans in load_traces(sys.argv[1] if len(sys.argv) > 1 else 'traces.jsonl').items():
+        print(f"trace {trace_id}")
+        print(format_trace(spans))
+        print()
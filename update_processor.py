@@ -0,0 +1,63 @@
+"""
+Обработка апдейтов: параллельно между пользователями, по очереди внутри одного
+пользователя, чтобы быстрые ответы в анкете не обгоняли друг друга
+"""
+
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Апдейты одного пользователя выполняются строго в порядке поступления,
+    разных пользователей — параллельно (не больше max_concurrent_updates)
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # user_id -> [блокировка, число апдейтов в работе или в ожидании]
+        self._locks: Dict[int, list] = {}
+
+    @staticmethod
+    def _user_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """
+        Сначала очередь пользователя, потом общий слот: апдейты, ждущие своего
+        пользователя, не занимают слоты и не задерживают остальных пользователей
+        """
+        user_id = self._user_id(update)
+        if user_id is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._locks.get(user_id) is entry:
+                # Держим блокировки только активных пользователей
+                del self._locks[user_id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._locks.clear()
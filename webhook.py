@@ -0,0 +1,260 @@
+"""
+Приём апдейтов Telegram через вебхук: HTTP-сервер tornado (тот же, что у
+Updater.start_webhook в PTB) проверяет секретный токен и передаёт апдейт
+обработчику — в очередь приложения или воркеру супервизора.
+
+Локальная проверка без Telegram — отправить записанные апдейты:
+    python webhook.py updates.jsonl --url http://127.0.0.1:8443/telegram --secret ...
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import math
+import signal
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, List, Callable, Awaitable, AsyncIterator
+
+import httpx
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram присылает secret_token из setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Апдейт Telegram не бывает больше нескольких десятков килобайт
+MAX_BODY_SIZE = 1024 * 1024
+
+# Обработчик разобранного апдейта: JSON → постановка в очередь
+UpdateSink = Callable[[Dict], Awaitable[None]]
+
+
+class _UpdateHandler(tornado.web.RequestHandler):
+    """POST на путь вебхука; остальные методы tornado отклоняет с 405"""
+
+    def initialize(self, server: 'WebhookServer'):
+        self.server = server
+
+    async def post(self):
+        status = await self.server.handle(self.request.headers.get(SECRET_HEADER, ''),
+                                          self.request.body)
+        self.set_status(status)
+
+    def log_exception(self, typ, value, tb):
+        # 4xx от самого tornado (405 и т. п.) — не ошибка сервера
+        if not isinstance(value, tornado.web.HTTPError):
+            logger.error(f"Ошибка обработки апдейта вебхука: {value}")
+
+
+class WebhookServer:
+    """HTTP-сервер вебхука: разбор HTTP и соединения — на tornado, здесь только секрет и апдейт"""
+
+    def __init__(self, sink: UpdateSink, listen: str = '127.0.0.1', port: int = 8443,
+                 url_path: str = '/telegram', secret_token: Optional[str] = None,
+                 header_timeout: float = 15.0, body_timeout: float = 30.0):
+        self.sink = sink
+        self.listen = listen
+        self.port = port
+        self.url_path = '/' + url_path.lstrip('/')
+        self.secret_token = secret_token
+        # Медленный клиент не должен держать соединение бесконечно (slowloris);
+        # header_timeout заодно ограничивает простой keep-alive соединения
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+
+        self._server: Optional[HTTPServer] = None
+
+        self.accepted = 0
+        self.rejected = 0
+
+    async def start(self):
+        require_secret(self.listen, None, self.secret_token)
+        app = tornado.web.Application([(self.url_path, _UpdateHandler, {'server': self})],
+                                      log_function=lambda handler: None)
+        self._server = HTTPServer(
+            app,
+            max_body_size=MAX_BODY_SIZE,
+            idle_connection_timeout=self.header_timeout,
+            body_timeout=self.body_timeout,
+        )
+        sockets = bind_sockets(self.port, self.listen)
+        self._server.add_sockets(sockets)
+        # Порт 0 — выбрать свободный (для тестов)
+        self.port = sockets[0].getsockname()[1]
+        logger.info(f"Вебхук слушает http://{self.listen}:{self.port}{self.url_path}")
+
+    async def stop(self):
+        if self._server:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
+
+    def _authorized(self, token: str) -> bool:
+        if not self.secret_token:
+            return True
+        return hmac.compare_digest(token, self.secret_token)
+
+    async def handle(self, token: str, body: bytes) -> int:
+        """Проверить секрет и передать апдейт обработчику; возвращает HTTP-статус"""
+        if not self._authorized(token):
+            self.rejected += 1
+            logger.warning('Вебхук: запрос с неверным секретным токеном')
+            return 403
+
+        try:
+            data = json.loads(body)
+            # Апдейт — всегда JSON-объект; [1] или "s" уронили бы Update.de_json
+            if not isinstance(data, dict):
+                raise TypeError(f"ожидался объект, получен {type(data).__name__}")
+            await self.sink(data)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning(f"Вебхук: некорректный апдейт: {e}")
+            return 400
+
+        self.accepted += 1
+        return 200
+
+
+LOOPBACK = ('127.0.0.1', 'localhost', '::1')
+
+
+def require_secret(listen: str, webhook_url: Optional[str], secret_token: Optional[str]):
+    """
+    Вебхук, доступный снаружи (зарегистрированный в Telegram или слушающий
+    не loopback-адрес), без секретного токена принимал бы поддельные апдейты от кого угодно
+    """
+    if secret_token:
+        return
+    if webhook_url:
+        raise ValueError("Для WEBHOOK_URL нужен WEBHOOK_SECRET: без него вебхук примет апдейты от любого")
+    if listen not in LOOPBACK:
+        raise ValueError(f"Вебхук на {listen} без WEBHOOK_SECRET примет апдейты от любого: "
+                         f"задайте секрет или слушайте 127.0.0.1")
+
+
+async def wait_for_stop_signal():
+    """Дождаться SIGINT или SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+@asynccontextmanager
+async def running(application: Application) -> AsyncIterator[Application]:
+    """
+    Жизненный цикл приложения без Updater: то же, что делает run_polling,
+    включая post_init / post_stop / post_shutdown
+    """
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        yield application
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def run_webhook(application: Application, listen: str, port: int, url_path: str,
+                      secret_token: Optional[str] = None, webhook_url: Optional[str] = None,
+                      max_connections: int = 40, allowed_updates: Optional[List[str]] = None):
+    """
+    Запустить приложение в режиме вебхука. Если задан webhook_url, адрес
+    регистрируется в Telegram; без него сервер принимает апдейты только локально
+    """
+    require_secret(listen, webhook_url, secret_token)
+
+    async def enqueue(data: Dict):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    server = WebhookServer(enqueue, listen, port, url_path, secret_token)
+
+    async with running(application):
+        await server.start()
+        try:
+            if webhook_url:
+                await register_webhook(application.bot, webhook_url, secret_token,
+                                       max_connections, allowed_updates)
+            await wait_for_stop_signal()
+        finally:
+            await server.stop()
+
+
+async def register_webhook(bot, webhook_url: str, secret_token: Optional[str] = None,
+                           max_connections: int = 40, allowed_updates: Optional[List[str]] = None):
+    """Зарегистрировать адрес вебхука в Telegram"""
+    await bot.set_webhook(
+        webhook_url,
+        secret_token=secret_token,
+        max_connections=max_connections,
+        allowed_updates=allowed_updates,
+    )
+    logger.info(f"Вебхук зарегистрирован в Telegram: {webhook_url}")
+
+
+async def post_updates(path: str, url: str, secret_token: Optional[str] = None,
+                       concurrency: int = 8) -> Dict:
+    """Отправить записанные апдейты (JSON-массив или JSONL) на вебхук и замерить время"""
+    with open(path, encoding='utf-8') as f:
+        text = f.read().strip()
+    updates = json.loads(text) if text.startswith('[') else [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    headers = {SECRET_HEADER: secret_token} if secret_token else {}
+    workers = min(concurrency, len(updates)) or 1
+
+    async def client(session: httpx.AsyncClient):
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            response = await session.post(url, json=update, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=workers)) as session:
+        await asyncio.gather(*(client(session) for _ in range(workers)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'updates': len(updates),
+        'seconds': round(elapsed, 3),
+        'per_second': round(len(updates) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        'p95_ms': round(latencies[math.ceil(len(latencies) * 0.95) - 1] * 1000, 2) if latencies else None,
+        'statuses': statuses,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Отправить записанные апдейты на локальный вебхук')
+    parser.add_argument('updates', help='файл с апдейтами: JSON-массив или JSONL')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', default=None)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(post_updates(args.updates, args.url, args.secret, args.concurrency)),
+                     ensure_ascii=False, indent=2))